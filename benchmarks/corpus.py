@@ -0,0 +1,121 @@
+import argparse
+import math
+import os
+import random
+import sys
+
+from iidx_notes_analyzer import iidx, persistence
+
+# 計測用の合成データ（楽曲一覧と譜面データ）。
+# TexTageからスクレイピングしなくても、任意の規模のデータで計測できるようにする。
+# 乱数の種が同じなら同じデータになる。
+
+SCORE_KINDS = [
+    iidx.ScoreKind.from_str(s)
+    for s in ['SPB', 'SPN', 'SPH', 'SPA', 'SPL', 'DPN', 'DPH', 'DPA']
+]
+
+_VERSION_CODES = ['1', 'sub'] + [str(i) for i in range(2, 34)] + ['CS']
+
+# 同時押しの鍵盤の数の出現比（単押し、2個、3個、…）。皿は別に混ぜる。
+_KEY_COUNT_WEIGHTS = [60, 28, 8, 3, 1]
+_SCRATCH_RATE = 0.15
+
+def make_musics(music_count: int, seed: int = 0) -> list[iidx.Music]:
+    rnd = random.Random(seed)
+    musics = []
+    for i in range(music_count):
+        tag = f'music{i:05}'
+        version = iidx.to_version(_VERSION_CODES[i % len(_VERSION_CODES)])
+        musics.append(iidx.Music(
+            tag, version,
+            f'GENRE {i}', f'アーティスト {i}', f'タイトル {i}',
+            [
+                iidx.Score(tag, kind, rnd.randint(1, 12), True)
+                for kind in SCORE_KINDS
+            ],
+        ))
+    return musics
+
+def make_notes(
+    rnd: random.Random, play_mode: iidx.PlayMode, note_count: int,
+) -> list[iidx.Note]:
+
+    """
+    それっぽい譜面（昇順）を作る。
+    """
+
+    keys = iidx.all_keys()
+    notes: list[iidx.Note] = []
+    timing = 0
+    while len(notes) < note_count:
+        timing += rnd.choice([6, 12, 12, 24, 24, 48])
+        play_sides: list[iidx.PlaySide] =\
+            [1] if play_mode == 'SP' else rnd.choice([[1], [2], [1, 2]])
+        for play_side in play_sides:
+            key_count = rnd.choices(
+                range(1, len(_KEY_COUNT_WEIGHTS) + 1), _KEY_COUNT_WEIGHTS,
+            )[0]
+            lanes: list[iidx.Lane] = sorted(rnd.sample(keys, key_count))
+            if rnd.random() < _SCRATCH_RATE:
+                lanes.append(iidx.SCRATCH)
+            notes.extend(iidx.Note(timing, play_side, lane) for lane in lanes)
+
+    del notes[note_count:]
+    return notes
+
+def music_count_for(score_count: int) -> int:
+    return math.ceil(score_count / len(SCORE_KINDS))
+
+def generate(score_count: int, notes_per_score: int, seed: int = 0) -> None:
+    """
+    現在の保存先に、`score_count`譜面分の楽曲一覧と譜面データを保存する。
+    """
+
+    musics = make_musics(music_count_for(score_count), seed)
+    persistence.save_musics(musics, overwrites=True)
+
+    rnd = random.Random(seed)
+    saved_count = 0
+    for music in musics:
+        for score in music.scores:
+            if saved_count >= score_count:
+                return
+            notes = make_notes(rnd, score.kind.play_mode, notes_per_score)
+            persistence.save_notes(music, score, notes, overwrites=True)
+            saved_count += 1
+            if saved_count % 1000 == 0:
+                print(f'Generated {saved_count}/{score_count} scores.', file=sys.stderr)
+
+def main() -> None:
+    p = argparse.ArgumentParser(prog='benchmarks.corpus')
+    p.add_argument('workdir', type=str,
+        help='directory to create the `data` directory in',
+    )
+    p.add_argument('--scores', type=int, default=10000,
+        help='number of scores with saved notes',
+    )
+    p.add_argument('--notes', type=int, default=2000,
+        help='number of notes per score',
+    )
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--store', type=str, default='file',
+        choices=persistence.BACKEND_NAMES,
+    )
+    args = p.parse_args()
+    assert isinstance(args.workdir, str)
+    assert isinstance(args.scores, int)
+    assert isinstance(args.notes, int)
+    assert isinstance(args.seed, int)
+    assert isinstance(args.store, str)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    persistence.use_backend(persistence.open_backend(args.store))
+    try:
+        generate(args.scores, args.notes, args.seed)
+    finally:
+        persistence.get_backend().close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import io
+import time
+from typing import Any
+
+from iidx_notes_analyzer import iidx
+from iidx_notes_analyzer.util import pjson
+
+from . import corpus
+
+# `pjson.dump`の所要時間が、データの大きさに比例して伸びることを確かめる。
+# データは`musics.json`と（以前のJSON形式の）譜面ファイルを真似て作る。
+
+def make_musics(n: int) -> list[dict[str, Any]]:
+    return [music.as_dict() for music in corpus.make_musics(n)]
+
+def make_notes(n: int) -> list[list[Any]]:
+    lanes = iidx.all_lanes()
+    return [[i * 10, 1, lanes[i % len(lanes)]] for i in range(n)]
+
+def make_nested(depth: int) -> list[Any]:
+    # 階層が深いほど旧実装（階層毎に長さを数え直す）が遅くなる形。
+    # インデントの分、書き出す文字数は階層の数の2乗で増える。
+    nested: list[Any] = [list(range(10))]
+    for _ in range(depth):
+        nested = [nested, list(range(10))]
+    return nested
+
+def measure(obj: Any, repeat: int) -> tuple[float, int]:
+    """
+    最速の所要時間と、書き出した文字数を返す。
+    """
+
+    best = float('inf')
+    size = 0
+    for _ in range(repeat):
+        fp = io.StringIO()
+        started = time.perf_counter()
+        pjson.dump(obj, fp, ensure_ascii=False)
+        best = min(best, time.perf_counter() - started)
+        size = fp.tell()
+    return best, size
+
+def main() -> None:
+    p = argparse.ArgumentParser(prog='benchmarks.pjson_dump')
+    p.add_argument('--scale', type=int, default=1,
+        help='multiply the base data sizes',
+    )
+    p.add_argument('--steps', type=int, default=4,
+        help='number of doublings of the data size',
+    )
+    p.add_argument('--repeat', type=int, default=5,
+        help='take the best of this many runs',
+    )
+    args = p.parse_args()
+    assert isinstance(args.scale, int)
+    assert isinstance(args.steps, int)
+    assert isinstance(args.repeat, int)
+
+    # 書き出す文字数あたりの時間が一定なら線形
+    cases = [
+        ('musics', make_musics, 500),
+        ('notes', make_notes, 20000),
+        ('nested levels', make_nested, 100),
+    ]
+    for name, make, base in cases:
+        print(f'{name}:')
+        first_per_kB = None
+        for step in range(args.steps):
+            n = base * args.scale * 2 ** step
+            sec, size = measure(make(n), args.repeat)
+            per_kB = sec / size * 1000
+            if first_per_kB is None:
+                first_per_kB = per_kB
+            print(
+                f'  {n:>8}: {sec:8.4f}s for {size / 1000:10.1f}kB '
+                f'({per_kB * 1e6:.2f}us/kB, '
+                f'x{per_kB / first_per_kB:.2f} of the smallest)'
+            )
+
+if __name__ == '__main__':
+    main()
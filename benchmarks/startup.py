@@ -0,0 +1,110 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from iidx_notes_analyzer import persistence
+
+from . import corpus
+
+# コマンドの起動から終了までの時間を測り、予算を超えていたら失敗（終了コード1）にする。
+# 小さな合成データ（`corpus`）で測るので、データの読み込みより起動時の読み込みが支配的になる。
+#
+# あわせて、`--help`で読み込まれてはいけない重いモジュール
+# （スクレイピング関係やNumPy等、使う時に読み込むもの）が読み込まれていないかも確かめる。
+
+# (名前, `python -m iidx_notes_analyzer`に渡す引数, 予算[ms])
+_COMMANDS: list[tuple[str, list[str], float]] = [
+    ('analyze --help', ['analyze', '--help'], 250),
+    ('analyze (cube)', ['analyze', 'SP', '--lv=5-'], 600),
+    ('analyze (tag)', ['analyze', 'SP', '--tag=music00001'], 600),
+    ('analyze --by-size', ['analyze', 'DP', '--by-size', '--ratio'], 600),
+]
+
+_LAZY_MODULES = [
+    'playwright', 'numpy', 'multiprocessing', 'concurrent.futures.process',
+    'http.server', 'sqlite3',
+]
+
+def _run(args: list[str], cwd: str) -> float:
+    env = os.environ | {'PYTHONPATH': _package_root()}
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-m', 'iidx_notes_analyzer', *args],
+        cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+def _package_root() -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _imported_modules(args: list[str], cwd: str) -> set[str]:
+    env = os.environ | {'PYTHONPATH': _package_root()}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'iidx_notes_analyzer', *args],
+        cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, text=True,
+    )
+    # 各行は`import time: <自身> | <累計> | <モジュール名>`
+    return {
+        line.rsplit('|', 1)[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith('import time:') and '|' in line
+    }
+
+def run(workdir: str, repeat: int, budget_scale: float) -> bool:
+    """
+    全て予算内ならTrue。
+    """
+
+    print('Generating a corpus...', file=sys.stderr)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        persistence.use_backend(persistence.open_backend('file'))
+        corpus.generate(200, 200)
+        persistence.get_backend().close()
+    finally:
+        os.chdir(cwd)
+
+    ok = True
+
+    imported = _imported_modules(['analyze', '--help'], workdir)
+    for name in _LAZY_MODULES:
+        if name in imported:
+            print(f'NG {name} is imported by `analyze --help`')
+            ok = False
+
+    for name, args, budget_ms in _COMMANDS:
+        # 1回目はキャッシュ（楽曲一覧のスナップショット等）を作るので計測から外す
+        _run(args, workdir)
+        median_ms = statistics.median(_run(args, workdir) for _ in range(repeat)) * 1000
+        limit_ms = budget_ms * budget_scale
+        result = 'ok' if median_ms <= limit_ms else 'NG'
+        print(f'{result} {name:<24} {median_ms:8.1f}ms (budget {limit_ms:.0f}ms)')
+        ok = ok and median_ms <= limit_ms
+
+    return ok
+
+def main() -> None:
+    p = argparse.ArgumentParser(prog='benchmarks.startup')
+    p.add_argument('-n', '--repeat', type=int, default=5,
+        help='number of runs per command (the median is compared with the budget)',
+    )
+    p.add_argument('--budget-scale', type=float, default=1.0,
+        help='multiply the budgets by this (for slow machines)',
+    )
+    args = p.parse_args()
+    assert isinstance(args.repeat, int)
+    assert isinstance(args.budget_scale, float)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ok = run(workdir, args.repeat, args.budget_scale)
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+from iidx_notes_analyzer import chord_histogram, iidx, persistence
+from iidx_notes_analyzer import main as analyzer
+from iidx_notes_analyzer.util import pjson
+
+from . import corpus
+
+# 合成データ（`corpus`）で、読み込みから集計までの各段階の所要時間を測る。
+# 保存先毎に、生成直後のデータの複製に対して測るので、
+# 1回目の`analyze`はキャッシュが無い状態からになる。
+#
+# 合成データは作業フォルダに残しておき、同じ設定なら次回は生成を省く。
+
+_CORPUS_DIR_NAME = 'corpus'
+_CORPUS_CONFIG_FILE_NAME = 'corpus.json'
+
+@dataclass(frozen=True, slots=True)
+class Result:
+    store: str | None       # 保存先に依らない計測なら`None`
+    name: str
+    seconds: float
+    items: int              # 処理した件数（曲・譜面・ノーツ等、計測による）
+    unit: str
+
+def _record(results: list[Result], result: Result) -> None:
+    results.append(result)
+    per_item = ''
+    if result.items > 0:
+        per_item = f'{result.seconds / result.items * 1e6:10.2f}us/{result.unit}'
+    print(
+        f'{result.store or "-":>6} {result.name:<24} {result.seconds:9.3f}s '
+        f'{result.items:>10} {result.unit}s {per_item}'
+    )
+
+def _measure(
+    results: list[Result], store: str | None, name: str, unit: str,
+    run: Callable[[], int],
+) -> None:
+
+    """
+    `run`は処理した件数を返す。
+    """
+
+    started = time.perf_counter()
+    items = run()
+    seconds = time.perf_counter() - started
+    _record(results, Result(store, name, seconds, items, unit))
+
+def _prepare_corpus(workdir: str, config: dict[str, Any]) -> str:
+    """
+    合成データのフォルダを返す。設定が前回と違えば作り直す。
+    """
+
+    corpus_dir = os.path.join(workdir, _CORPUS_DIR_NAME)
+    config_file_path = os.path.join(workdir, _CORPUS_CONFIG_FILE_NAME)
+    try:
+        with open(config_file_path) as f:
+            if json.load(f) == config and os.path.isdir(corpus_dir):
+                return corpus_dir
+    except FileNotFoundError:
+        pass
+
+    print('Generating a corpus...', file=sys.stderr)
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    cwd = os.getcwd()
+    os.chdir(corpus_dir)
+    try:
+        persistence.use_backend(persistence.open_backend('file'))
+        corpus.generate(config['scores'], config['notes_per_score'], config['seed'])
+        persistence.get_backend().close()
+    finally:
+        os.chdir(cwd)
+
+    with open(config_file_path, 'w') as f:
+        json.dump(config, f)
+    return corpus_dir
+
+def _reopen(store: str) -> None:
+    # メモリ上のキャッシュ（読み込み済みの楽曲一覧等）を捨てる
+    persistence.use_backend(persistence.open_backend(store))
+
+def _saved_music_scores() -> list[tuple[iidx.Music, iidx.Score]]:
+    return [
+        (music, score)
+        for music, score in persistence.load_musics(persistence.ScoreFilter())
+        if persistence.has_saved_notes(music, score)
+    ]
+
+def _run_store(
+    results: list[Result], store: str, jobs: int | None,
+) -> None:
+
+    if store != 'file':
+        _reopen('file')
+        source = persistence.get_backend()
+        destination = persistence.open_backend(store)
+        _measure(results, store, 'copy_store', 'score',
+            lambda: sum(1 for _ in persistence.copy_all(source, destination)),
+        )
+        destination.close()
+
+    def load_musics() -> int:
+        _reopen(store)
+        return sum(1 for _ in persistence.load_musics(persistence.ScoreFilter()))
+    _measure(results, store, 'load_musics (cold)', 'score', load_musics)
+    _measure(results, store, 'load_musics (warm)', 'score', load_musics)
+
+    music_scores = _saved_music_scores()
+
+    def load_notes() -> int:
+        count = 0
+        for music, score in music_scores:
+            for _ in persistence.load_notes(music, score):
+                count += 1
+        return count
+    _measure(results, store, 'load_notes', 'note', load_notes)
+
+    # `to_chords`だけを測るため、読み込みは計測から外す
+    to_chords_sec = 0.0
+    chord_count = 0
+    for music, score in music_scores:
+        notes = list(persistence.load_notes(music, score))
+        started = time.perf_counter()
+        for _ in iidx.to_chords(notes):
+            chord_count += 1
+        to_chords_sec += time.perf_counter() - started
+    _record(results, Result(store, 'to_chords', to_chords_sec, chord_count, 'chord'))
+
+    for play_mode in ['SP', 'DP']:
+        filter = analyzer.parse_filter_to_analyze(
+            play_mode=play_mode, version='', music_tag='', difficulty='', level='',
+        )
+        score_count = sum(
+            1 for _, score in music_scores if score.kind.play_mode == play_mode
+        )
+
+        def analyze() -> int:
+            _reopen(store)
+            with redirect_stdout(io.StringIO()):
+                analyzer.analyze(filter=filter, jobs=jobs)
+            return score_count
+        _measure(results, store, f'analyze {play_mode} (cold)', 'score', analyze)
+        _measure(results, store, f'analyze {play_mode} (warm)', 'score', analyze)
+
+    persistence.get_backend().close()
+
+def run(
+    workdir: str, stores: list[str],
+    score_count: int, notes_per_score: int, seed: int,
+    jobs: int | None,
+) -> dict[str, Any]:
+
+    config = {'scores': score_count, 'notes_per_score': notes_per_score, 'seed': seed}
+    corpus_dir = _prepare_corpus(workdir, config)
+
+    results: list[Result] = []
+
+    musics = corpus.make_musics(corpus.music_count_for(score_count), seed)
+    dict_musics = [music.as_dict() for music in musics]
+
+    def dump_musics() -> int:
+        pjson.dump(dict_musics, io.StringIO(), ensure_ascii=False)
+        return len(dict_musics)
+    _measure(results, None, 'pjson.dump (musics)', 'music', dump_musics)
+
+    cwd = os.getcwd()
+    for store in stores:
+        # 生成直後の状態から測るため、保存先毎に複製する
+        run_dir = os.path.join(workdir, 'run-' + store)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        shutil.copytree(corpus_dir, run_dir)
+        os.chdir(run_dir)
+        try:
+            _run_store(results, store, jobs)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    return {
+        'config': config | {'stores': stores, 'jobs': jobs},
+        'environment': {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': chord_histogram.np is not None,
+        },
+        'results': [asdict(result) for result in results],
+    }
+
+def main() -> None:
+    p = argparse.ArgumentParser(prog='benchmarks.suite')
+    p.add_argument('--workdir', type=str, default=None,
+        help='directory to keep the generated corpus in (default: a temporary one)',
+    )
+    p.add_argument('--scores', type=int, default=10000,
+        help='number of scores with saved notes',
+    )
+    p.add_argument('--notes', type=int, default=2000,
+        help='number of notes per score',
+    )
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--store', dest='stores', type=str, action='append',
+        choices=persistence.BACKEND_NAMES,
+        help='store to measure (repeatable, default: all)',
+    )
+    p.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for analyze',
+    )
+    p.add_argument('-o', '--output', type=str, default='benchmark_results.json',
+        help='JSON file to write the results to',
+    )
+    args = p.parse_args()
+    assert args.workdir is None or isinstance(args.workdir, str)
+    assert isinstance(args.scores, int)
+    assert isinstance(args.notes, int)
+    assert isinstance(args.seed, int)
+    assert args.stores is None or isinstance(args.stores, list)
+    assert args.jobs is None or isinstance(args.jobs, int)
+    assert isinstance(args.output, str)
+
+    output_path = os.path.abspath(args.output)
+    stores = args.stores or persistence.BACKEND_NAMES
+
+    if args.workdir is None:
+        with tempfile.TemporaryDirectory() as workdir:
+            report = run(workdir, stores, args.scores, args.notes, args.seed, args.jobs)
+    else:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = run(
+            os.path.abspath(args.workdir), stores,
+            args.scores, args.notes, args.seed, args.jobs,
+        )
+
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output_path}')
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import argparse
+import atexit
 
 from . import main
 
@@ -7,6 +8,20 @@ from . import main
 # メッセージはどこで出すのかとかちゃんと決めたい。
 
 p = argparse.ArgumentParser(prog='iidx_notes_analyzer')
+p.add_argument('--store', type=str, default='file',
+    choices=main.STORE_NAMES,
+    help='where to save musics and notes',
+)
+p.add_argument('--paranoid', action='store_true',
+    help='fully validate notes on load even if they have been validated on save',
+)
+p.add_argument('--profile', action='store_true',
+    help='report time, call counts and peak memory per phase to stderr',
+)
+p.add_argument('--profile-json', dest='profile_json', type=str, default=None,
+    metavar='FILE',
+    help='write the --profile report to FILE as JSON instead (implies --profile)',
+)
 
 p_sub = p.add_subparsers(
     help='sub-command',
@@ -16,10 +31,20 @@ p_sub = p.add_subparsers(
 p_scrape_music_list = p_sub.add_parser('scrape_music_list')
 p_scrape_score = p_sub.add_parser('scrape_score')
 p_analyze = p_sub.add_parser('analyze')
+p_analyze_batch = p_sub.add_parser('analyze_batch', aliases=['analyze-batch'])
+p_migrate_notes = p_sub.add_parser('migrate_notes')
+p_copy_store = p_sub.add_parser('copy_store')
+p_rebuild_cache = p_sub.add_parser('rebuild_cache')
+p_stats = p_sub.add_parser('stats')
+p_serve = p_sub.add_parser('serve')
 
 p_scrape_music_list.add_argument('-w', '--overwrite', action='store_true',
     help='overwrite the text file to save scraping results',
 )
+p_scrape_music_list.add_argument('-r', '--refresh', action='store_true',
+    help='show changes from the saved music list, overwrite it '
+        'and mark saved scores whose notes may be changed as stale',
+)
 
 p_scrape_score.add_argument('play_mode', nargs='?', type=str, default='')
 # TODO: "-sub"（バージョンの範囲指定で、無〜substream）が通らない
@@ -29,6 +54,13 @@ p_scrape_score.add_argument('difficulty', nargs='?', type=str, default='')
 p_scrape_score.add_argument('-d', '--debug', action='store_true',
     help='turn on debug mode (it does not scrape actually)',
 )
+p_scrape_score.add_argument('-r', '--resume', action='store_true',
+    help='resume the last scraping session (other conditions are ignored)',
+)
+p_scrape_score.add_argument('--browser-idle', dest='browser_idle', type=float,
+    default=60.0,
+    help='seconds to keep the browser running while it is not used',
+)
 
 p_analyze.add_argument('play_mode', type=str,
     help='SP | DP',
@@ -51,13 +83,81 @@ p_analyze.add_argument('-a', '--show-all', action='store_true',
 p_analyze.add_argument('-l', '--list', action='store_true',
     help='show a list of found scores',
 )
+p_analyze.add_argument('-j', '--jobs', type=int, default=None,
+    help='number of worker processes (default: decided by the CPU count)',
+)
+p_analyze_mode = p_analyze.add_mutually_exclusive_group()
+p_analyze_mode.add_argument('-s', '--by-size', dest='by_size', action='store_true',
+    help='count chords by the number of keys and whether it has a scratch',
+)
+p_analyze_mode.add_argument('-n', '--ngram', dest='ngram_length', type=int,
+    default=None, metavar='N',
+    help='count sequences of N consecutive chords instead of single chords '
+        f'(1-{main.MAX_NGRAM_LENGTH})',
+)
+p_analyze_mode.add_argument('--density', dest='density_window', type=int,
+    default=None, metavar='WINDOW',
+    help='measure the number of notes per WINDOW timings instead of chords',
+)
+p_analyze.add_argument('-r', '--ratio', action='store_true',
+    help='show ratios to the total instead of counts (not with --ngram or --density)',
+)
+p_analyze.add_argument('--server', nargs='?', type=str,
+    const=main.DEFAULT_SERVER_URL, default=None, metavar='URL',
+    help='ask the server started by `serve` instead of loading data '
+        f'(default URL: {main.DEFAULT_SERVER_URL})',
+)
+p_analyze.add_argument('-t', '--top', dest='top_count', type=int, default=20,
+    metavar='K',
+    help='with --ngram or --density, show only the top K sequences or scores '
+        '(0: show all)',
+)
+
+p_analyze_batch.add_argument('query_file', type=str,
+    help='JSON file of queries (see README)',
+)
+p_analyze_batch.add_argument('-o', '--output', type=str, default=None,
+    metavar='FILE',
+    help='write the results to FILE instead of stdout',
+)
+p_analyze_batch.add_argument('-j', '--jobs', type=int, default=None,
+    help='number of worker processes (default: decided by the CPU count)',
+)
+
+p_migrate_notes.add_argument('-k', '--keep-legacy', action='store_true',
+    help='keep the old JSON files after converting them',
+)
+
+p_serve.add_argument('-p', '--port', type=int, default=main.DEFAULT_SERVER_PORT,
+    help='port to listen on (only from this machine)',
+)
+p_serve.add_argument('-j', '--jobs', type=int, default=None,
+    help='number of worker processes (default: decided by the CPU count)',
+)
+
+p_copy_store.add_argument('source', type=str, choices=main.STORE_NAMES)
+p_copy_store.add_argument('destination', type=str, choices=main.STORE_NAMES)
 
 args = p.parse_args()
+
+assert isinstance(args.store, str)
+assert isinstance(args.paranoid, bool)
+assert isinstance(args.profile, bool)
+assert args.profile_json is None or isinstance(args.profile_json, str)
+if args.profile or args.profile_json is not None:
+    main.start_profiling()
+    # atexitは登録と逆順に呼ばれるので、保存先を閉じる分も測れるよう先に登録する
+    atexit.register(main.report_profile, args.profile_json)
+main.use_store(args.store)
+main.set_paranoid(args.paranoid)
+atexit.register(main.close_store)
+
 match args.subcommand:
     case 'scrape_music_list':
         assert isinstance(args.overwrite, bool)
+        assert isinstance(args.refresh, bool)
 
-        main.scrape_music_list(overwrites=args.overwrite)
+        main.scrape_music_list(overwrites=args.overwrite, refreshes=args.refresh)
 
     case 'scrape_score':
         assert isinstance(args.play_mode, str)
@@ -65,6 +165,11 @@ match args.subcommand:
         assert isinstance(args.music_tag, str)
         assert isinstance(args.difficulty, str)
         assert isinstance(args.debug, bool)
+        assert isinstance(args.browser_idle, float)
+        assert isinstance(args.resume, bool)
+
+        if args.browser_idle < 0:
+            p_scrape_score.error('--browser-idle must not be negative')
 
         try:
             filter = main.parse_filter_to_scrape(
@@ -80,6 +185,8 @@ match args.subcommand:
         main.scrape_score(
             filter=filter,
             debug=args.debug,
+            browser_idle_sec=args.browser_idle,
+            resumes=args.resume,
         )
 
     case 'analyze':
@@ -90,6 +197,33 @@ match args.subcommand:
         assert isinstance(args.level, str)
         assert isinstance(args.show_all, bool)
         assert isinstance(args.list, bool)
+        assert args.jobs is None or isinstance(args.jobs, int)
+        assert isinstance(args.by_size, bool)
+        assert isinstance(args.ratio, bool)
+        assert args.ngram_length is None or isinstance(args.ngram_length, int)
+        assert args.density_window is None or isinstance(args.density_window, int)
+        assert args.server is None or isinstance(args.server, str)
+        assert isinstance(args.top_count, int)
+
+        if args.jobs is not None and args.jobs < 1:
+            p_analyze.error('--jobs must be positive')
+        if args.ngram_length is not None\
+                and not 1 <= args.ngram_length <= main.MAX_NGRAM_LENGTH:
+            p_analyze.error(
+                f'--ngram must be between 1 and {main.MAX_NGRAM_LENGTH}'
+            )
+        if args.top_count < 0:
+            p_analyze.error('--top must not be negative')
+        if args.density_window is not None and args.density_window <= 0:
+            p_analyze.error('--density must be positive')
+        if args.ratio and (
+            args.ngram_length is not None or args.density_window is not None
+        ):
+            p_analyze.error('--ratio cannot be used with --ngram or --density')
+        if args.server is not None and (
+            args.ngram_length is not None or args.density_window is not None
+        ):
+            p_analyze.error('--server cannot be used with --ngram or --density')
 
         try:
             filter = main.parse_filter_to_analyze(
@@ -103,11 +237,75 @@ match args.subcommand:
             # TODO: バリデーションエラーのメッセージを詳しく
             raise e
 
-        main.analyze(
-            filter=filter,
-            show_all=args.show_all,
-            show_score_list=args.list,
-        )
+        if args.server is not None:
+            main.analyze_remotely(
+                server_url=args.server,
+                filter=filter,
+                raw_filter={
+                    'play_mode': args.play_mode,
+                    'version': args.version,
+                    'music_tag': args.music_tag,
+                    'difficulty': args.difficulty,
+                    'level': args.level,
+                },
+                show_all=args.show_all,
+                show_score_list=args.list,
+                by_size=args.by_size,
+                shows_ratio=args.ratio,
+            )
+        else:
+            main.analyze(
+                filter=filter,
+                show_all=args.show_all,
+                show_score_list=args.list,
+                jobs=args.jobs,
+                by_size=args.by_size,
+                shows_ratio=args.ratio,
+                ngram_length=args.ngram_length,
+                density_window=args.density_window,
+                top_count=args.top_count or None,
+            )
+
+    case 'analyze_batch' | 'analyze-batch':
+        assert isinstance(args.query_file, str)
+        assert args.output is None or isinstance(args.output, str)
+        assert args.jobs is None or isinstance(args.jobs, int)
+
+        if args.jobs is not None and args.jobs < 1:
+            p_analyze_batch.error('--jobs must be positive')
+
+        try:
+            queries = main.load_batch_queries(args.query_file)
+        except (OSError, ValueError) as e:
+            p_analyze_batch.error(f'invalid query file: {e}')
+
+        main.analyze_batch(queries=queries, jobs=args.jobs, output_file_path=args.output)
+
+    case 'migrate_notes':
+        assert isinstance(args.keep_legacy, bool)
+
+        main.migrate_notes(keeps_legacy=args.keep_legacy)
+
+    case 'copy_store':
+        assert isinstance(args.source, str)
+        assert isinstance(args.destination, str)
+
+        main.copy_store(args.source, args.destination)
+
+    case 'rebuild_cache':
+        main.rebuild_cache()
+
+    case 'stats':
+        main.stats()
+
+    case 'serve':
+        assert isinstance(args.port, int)
+        assert args.jobs is None or isinstance(args.jobs, int)
+
+        if args.jobs is not None and args.jobs < 1:
+            p_serve.error('--jobs must be positive')
+
+        main.serve(port=args.port, jobs=args.jobs)
 
     case _:
         raise ValueError('unknown subcommand: ' + args.subcommand)
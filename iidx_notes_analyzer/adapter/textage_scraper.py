@@ -1,8 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Self
+import threading
+import time
+from typing import Any, Callable, Self
 
 from .. import iidx
 from ..textage_scraper import iidx as origin_iidx, main as origin, url
+from ..util import profile
 
 def _score_from_origin(origin_score: origin_iidx.Score) -> iidx.Score:
     return iidx.Score(
@@ -59,14 +63,56 @@ def _score_page_from_origin(origin_page: origin.ScorePage) -> ScorePage:
     notes = [_note_from_origin(note) for note in origin_page.notes]
     return ScorePage(notes)
 
-class Client:
-    _origin: origin.Client
+@dataclass(frozen=True, slots=True)
+class RawScorePage:
+    """
+    解析前の譜面ページ（`origin.RawScorePage`参照）。
+    """
+
+    _origin: origin.RawScorePage
 
-    def __init__(self) -> None:
-        self._origin = origin.Client()
+    def parse(self) -> ScorePage:
+        return _score_page_from_origin(self._origin.parse())
+
+class Client:
+    """
+    ブラウザは初めて使う時に起動する。
+    Playwrightは起動したスレッドからしか操作できないので、ブラウザの操作は全て専用のスレッドで行う。
+    `idle_timeout_sec`を指定した場合、その間使われなかったブラウザはタイマーで終了する
+    （次に使う時に起動し直す）。
+    """
+
+    _executor: ThreadPoolExecutor
+    _origin: origin.Client | None       # 専用のスレッドからのみ触る
+    _idle_timeout_sec: float | None
+    _last_used: float                   # 同上
+    _idle_timer: threading.Timer | None
+    _lock: threading.Lock
+    _closed: bool
+
+    def __init__(self, idle_timeout_sec: float | None = None) -> None:
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='browser')
+        self._origin = None
+        self._idle_timeout_sec = idle_timeout_sec
+        self._last_used = time.monotonic()
+        self._idle_timer = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # 後に`__del__`（`close`）が呼ばれても困らないよう、全て設定してから確かめる
+        if idle_timeout_sec is not None and idle_timeout_sec < 0:
+            raise ValueError(idle_timeout_sec)
 
     def close(self) -> None:
-        self._origin.close()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+        self._executor.submit(self._shut_down).result()
+        self._executor.shutdown()
 
     def __del__(self) -> None:
         self.close()
@@ -80,16 +126,72 @@ class Client:
 
     @property
     def closed(self) -> bool:
-        return self._origin.closed
+        return self._closed
+
+    @property
+    def browser_is_running(self) -> bool:
+        return self._origin is not None
+
+    def _run[T](self, operation: Callable[[origin.Client], T]) -> T:
+        if self._closed:
+            raise RuntimeError('client is closed')
+        try:
+            return self._executor.submit(self._run_in_browser_thread, operation).result()
+        finally:
+            self._restart_idle_timer()
+
+    def _run_in_browser_thread[T](self, operation: Callable[[origin.Client], T]) -> T:
+        if self._origin is None:
+            with profile.phase('browser_start'):
+                self._origin = origin.Client(phase=profile.phase)
+        try:
+            return operation(self._origin)
+        finally:
+            self._last_used = time.monotonic()
+
+    def _restart_idle_timer(self) -> None:
+        if self._idle_timeout_sec is None:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            self._idle_timer = threading.Timer(self._idle_timeout_sec, self._on_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _on_idle(self) -> None:
+        # タイマーのスレッドからは触れないので、専用のスレッドに終了させる
+        with self._lock:
+            if self._closed:
+                return
+            self._executor.submit(self._shut_down_if_idle)
+
+    def _shut_down_if_idle(self) -> None:
+        assert self._idle_timeout_sec is not None
+        # タイマーを仕掛けた後に使われていれば、そのタイマーの分は無視する
+        if time.monotonic() - self._last_used < self._idle_timeout_sec:
+            return
+        self._shut_down()
+
+    def _shut_down(self) -> None:
+        if self._origin is None:
+            return
+        self._origin.close()
+        self._origin = None
 
     def scrape_music_list_page(self) -> MusicListPage:
-        page = self._origin.scrape_music_list_page()
+        page = self._run(lambda client: client.scrape_music_list_page())
         return _music_list_page_from_origin(page)
 
     # URL関連を用意するのがめんどくなってきたので引数には使用しない
     def scrape_score_page(self, music: iidx.Music, score: iidx.Score) -> ScorePage:
+        return self.fetch_score_page(music, score).parse()
+
+    def fetch_score_page(self, music: iidx.Music, score: iidx.Score) -> RawScorePage:
         url_params = url.ScorePageParams.from_score(
             _music_to_origin(music), _score_to_origin(score)
         )
-        page = self._origin.scrape_score_page(url_params)
-        return _score_page_from_origin(page)
+        raw_page = self._run(lambda client: client.fetch_score_page(url_params))
+        return RawScorePage(raw_page)
@@ -0,0 +1,195 @@
+import marshal
+from typing import Self
+
+from . import iidx
+from .persistence import (
+    LevelFilterAll, ScoreFilter, VersionFilterAll,
+    match_level_filter, match_version_filter,
+)
+
+# 曲・譜面は`iidx.Music`・`iidx.Score`を組み立てずに、基本型のタプル（行）で持つ。
+# 組み立ては絞り込みで当てはまった曲についてだけ行う。
+# 基本型だけなので、スナップショットは`marshal`でそのまま書き出せる。
+_ScoreRow = tuple[str, iidx.PlayMode, iidx.Difficulty, iidx.Level, bool]
+_MusicRow = tuple[str, str, str, str, str, tuple[_ScoreRow, ...]]
+
+_SNAPSHOT_FORMAT_VERSION = 1
+
+class Catalog:
+    """
+    楽曲一覧。
+    (曲, 譜面)の組に通し番号を振り、絞り込み条件の項目毎に番号の集合を索引として持つ。
+    絞り込みは集合の積で行う。
+    """
+
+    _music_rows: list[_MusicRow]
+    _entries: list[tuple[int, int]]     # (曲の番号, 曲内での譜面の番号)
+    _versions: dict[str, iidx.Version]
+    _by_has_URL: dict[bool, set[int]]
+    _by_play_mode: dict[str, set[int]]
+    _by_version: dict[str, set[int]]
+    _by_music_tag: dict[str, set[int]]
+    _by_difficulty: dict[str, set[int]]
+    _by_level: dict[int, set[int]]
+    _musics: list[iidx.Music | None]
+
+    def __init__(self, musics: list[iidx.Music]) -> None:
+        self._init_from_rows([
+            (
+                music.tag, music.version.code,
+                music.genre, music.artist, music.title,
+                tuple(
+                    (
+                        score.music_tag,
+                        score.kind.play_mode, score.kind.difficulty,
+                        score.level, score.has_URL,
+                    )
+                    for score in music.scores
+                ),
+            )
+            for music in musics
+        ])
+        self._musics = list(musics)
+
+    def _init_from_rows(self, music_rows: list[_MusicRow]) -> None:
+        self._music_rows = music_rows
+        self._entries = [
+            (music_index, score_index)
+            for music_index, music_row in enumerate(music_rows)
+            for score_index in range(len(music_row[5]))
+        ]
+        self._versions = {
+            code: iidx.to_version(code)
+            for code in {music_row[1] for music_row in music_rows}
+        }
+
+        self._by_has_URL = {}
+        self._by_play_mode = {}
+        self._by_version = {}
+        self._by_music_tag = {}
+        self._by_difficulty = {}
+        self._by_level = {}
+        for i, (music_index, score_index) in enumerate(self._entries):
+            music_row = music_rows[music_index]
+            _, play_mode, difficulty, level, has_URL = music_row[5][score_index]
+            self._by_has_URL.setdefault(has_URL, set()).add(i)
+            self._by_play_mode.setdefault(play_mode, set()).add(i)
+            self._by_version.setdefault(music_row[1], set()).add(i)
+            self._by_music_tag.setdefault(music_row[0], set()).add(i)
+            self._by_difficulty.setdefault(difficulty, set()).add(i)
+            self._by_level.setdefault(level, set()).add(i)
+
+        self._musics = [None] * len(music_rows)
+
+    def _music(self, music_index: int) -> iidx.Music:
+        music = self._musics[music_index]
+        if music is None:
+            tag, version, genre, artist, title, score_rows =\
+                self._music_rows[music_index]
+            music = iidx.Music(
+                tag, self._versions[version], genre, artist, title,
+                [
+                    iidx.Score(
+                        music_tag, iidx.ScoreKind(play_mode, difficulty),
+                        level, has_URL,
+                    )
+                    for music_tag, play_mode, difficulty, level, has_URL
+                    in score_rows
+                ],
+            )
+            self._musics[music_index] = music
+        return music
+
+    @property
+    def musics(self) -> list[iidx.Music]:
+        return [self._music(i) for i in range(len(self._music_rows))]
+
+    def query(self, filter: ScoreFilter) -> list[tuple[iidx.Music, iidx.Score]]:
+        """
+        条件に当てはまる(曲, 譜面)の組を、楽曲一覧での順番で返す。
+        """
+
+        selections: list[set[int]] = []
+
+        if filter.has_URL is not None:
+            selections.append(self._by_has_URL.get(filter.has_URL, set()))
+        if filter.play_mode:
+            selections.append(self._by_play_mode.get(filter.play_mode, set()))
+        if filter.music_tag:
+            selections.append(self._by_music_tag.get(filter.music_tag, set()))
+        if filter.difficulty:
+            selections.append(self._by_difficulty.get(filter.difficulty, set()))
+
+        # バージョンとレベルは種類が少ないので、当てはまるもの全ての和集合を取る
+        if not isinstance(filter.version, VersionFilterAll):
+            selections.append(set().union(*(
+                self._by_version[code]
+                for code, version in self._versions.items()
+                if match_version_filter(version, filter.version)
+            )))
+        if not isinstance(filter.level, LevelFilterAll):
+            selections.append(set().union(*(
+                indices
+                for level, indices in self._by_level.items()
+                if iidx.is_valid_for_level(level)
+                if match_level_filter(level, filter.level)
+            )))
+
+        if selections:
+            selections.sort(key=len)
+            indices = sorted(selections[0].intersection(*selections[1:]))
+        else:
+            indices = range(len(self._entries))
+
+        result = []
+        for i in indices:
+            music_index, score_index = self._entries[i]
+            music = self._music(music_index)
+            result.append((music, music.scores[score_index]))
+        return result
+
+    def to_snapshot(self) -> bytes:
+        return marshal.dumps((
+            _SNAPSHOT_FORMAT_VERSION,
+            self._music_rows,
+            self._by_has_URL,
+            self._by_play_mode,
+            self._by_version,
+            self._by_music_tag,
+            self._by_difficulty,
+            self._by_level,
+        ))
+
+    @classmethod
+    def from_snapshot(cls, data: bytes) -> Self:
+        try:
+            raw = marshal.loads(data)
+        except (EOFError, ValueError, TypeError) as e:
+            raise ValueError('broken snapshot') from e
+
+        if not isinstance(raw, tuple) or len(raw) != 8:
+            raise ValueError('broken snapshot')
+        if raw[0] != _SNAPSHOT_FORMAT_VERSION:
+            raise ValueError('unsupported format version: ' + str(raw[0]))
+
+        catalog = cls.__new__(cls)
+        (
+            _,
+            catalog._music_rows,
+            catalog._by_has_URL,
+            catalog._by_play_mode,
+            catalog._by_version,
+            catalog._by_music_tag,
+            catalog._by_difficulty,
+            catalog._by_level,
+        ) = raw
+        catalog._entries = [
+            (music_index, score_index)
+            for music_index, music_row in enumerate(catalog._music_rows)
+            for score_index in range(len(music_row[5]))
+        ]
+        catalog._versions = {
+            code: iidx.to_version(code) for code in catalog._by_version
+        }
+        catalog._musics = [None] * len(catalog._music_rows)
+        return catalog
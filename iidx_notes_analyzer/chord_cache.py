@@ -0,0 +1,149 @@
+import os
+from typing import Iterator
+
+from . import chord_histogram, iidx, persistence
+from .util import profile
+
+# 譜面毎の同時押しの個数は譜面データから導出でき、譜面データは一度保存したら変わらない。
+# そのため導出結果を譜面データの横にキャッシュしておき、`analyze`時はそちらを読む。
+# 譜面データが更新されていれば古いキャッシュは使われず、自動で作り直される。
+
+_KIND = 'chords'
+
+def rebuild_histogram(
+    music: iidx.Music, score: iidx.Score,
+) -> chord_histogram.ChordHistogram:
+
+    with profile.phase('notes_load'):
+        note_codes = persistence.load_note_codes(music, score)
+    with profile.phase('chord_extraction'):
+        histogram = chord_histogram.count_chords(note_codes)
+    with profile.phase('chord_cache_save'):
+        persistence.save_derived(music, score, _KIND, histogram.to_bytes())
+    return histogram
+
+def load_histogram(
+    music: iidx.Music, score: iidx.Score,
+) -> chord_histogram.ChordHistogram:
+
+    with profile.phase('chord_cache_load'):
+        data = persistence.load_derived(music, score, _KIND)
+    if data is not None:
+        try:
+            return chord_histogram.ChordHistogram.from_bytes(data)
+        except ValueError:
+            # 壊れていたら作り直す
+            pass
+    return rebuild_histogram(music, score)
+
+def rebuild_all() -> Iterator[tuple[iidx.Music, iidx.Score]]:
+    """
+    保存済みの全譜面のキャッシュを作り直す。
+    作り直した譜面を順に返す。
+    """
+
+    for music, score in persistence.load_musics(persistence.ScoreFilter()):
+        if not persistence.has_saved_notes(music, score):
+            continue
+        rebuild_histogram(music, score)
+        yield (music, score)
+
+# 並列化してもプロセスの起動等で元が取れない程度の譜面数
+_MIN_SCORES_PER_JOB = 64
+
+def default_jobs(score_count: int) -> int:
+    """
+    譜面数に応じたワーカープロセス数。CPUのコア数が上限。
+    """
+
+    cpu_count = os.cpu_count() or 1
+    return max(min(cpu_count, score_count // _MIN_SCORES_PER_JOB), 1)
+
+def init_worker(backend_name: str, paranoid: bool) -> None:
+    """
+    ワーカープロセスで、親プロセスと同じ保存先・設定を使うようにする。
+    """
+
+    persistence.use_backend(persistence.open_backend(backend_name))
+    persistence.set_paranoid(paranoid)
+
+def _sum_histograms_in_worker[K](
+    keyed_music_scores: list[tuple[K, iidx.Music, iidx.Score]],
+) -> dict[K, chord_histogram.ChordHistogram]:
+
+    totals = _sum_histograms_serially(keyed_music_scores)
+    # ワーカープロセスは終了時に保存先を閉じてくれないので、
+    # キャッシュの書き込みを確定させるためにここで閉じる（次に使う時に開き直される）
+    persistence.get_backend().close()
+    return totals
+
+def _sum_histograms_serially[K](
+    keyed_music_scores: list[tuple[K, iidx.Music, iidx.Score]],
+) -> dict[K, chord_histogram.ChordHistogram]:
+
+    totals: dict[K, chord_histogram.ChordHistogram] = {}
+    for key, music, score in keyed_music_scores:
+        histogram = load_histogram(music, score)
+        if key in totals:
+            totals[key] += histogram
+        else:
+            totals[key] = histogram
+    return totals
+
+def sum_histograms_by_group[K](
+    groups: dict[K, list[tuple[iidx.Music, iidx.Score]]],
+    jobs: int | None = None,
+) -> dict[K, chord_histogram.ChordHistogram]:
+    """
+    グループ毎に、譜面毎の同時押しの個数を合計する。
+    `jobs`が2以上なら、譜面を分割して複数のプロセスで並列に集計する。
+    個数の足し算なので、結果は分割の仕方に依らない。
+    `jobs`を省略した場合は`default_jobs`で決める。
+    """
+
+    keyed_music_scores = [
+        (key, music, score)
+        for key, music_scores in groups.items()
+        for music, score in music_scores
+    ]
+
+    if jobs is None:
+        # ワーカープロセス内は計測できないので、計測中は並列化しない
+        jobs = 1 if profile.is_enabled() else default_jobs(len(keyed_music_scores))
+    if jobs < 1:
+        raise ValueError(jobs)
+    totals = {key: chord_histogram.ChordHistogram() for key in groups}
+
+    def merge(partial: dict[K, chord_histogram.ChordHistogram]) -> None:
+        for key, histogram in partial.items():
+            totals[key] += histogram
+
+    if jobs == 1 or len(keyed_music_scores) <= 1:
+        merge(_sum_histograms_serially(keyed_music_scores))
+        return totals
+
+    # `multiprocessing`は読み込みに時間が掛かるので、並列化する時だけ読み込む
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 重い譜面が偏っても均されるよう、ワーカー数より細かく分ける
+    chunk_count = min(len(keyed_music_scores), jobs * 4)
+    chunks = [keyed_music_scores[i::chunk_count] for i in range(chunk_count)]
+
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=init_worker,
+        initargs=(persistence.get_backend().name, persistence.is_paranoid()),
+    ) as executor:
+        for partial in executor.map(_sum_histograms_in_worker, chunks):
+            merge(partial)
+    return totals
+
+def sum_histograms(
+    music_scores: list[tuple[iidx.Music, iidx.Score]],
+    jobs: int | None = None,
+) -> chord_histogram.ChordHistogram:
+    """
+    譜面毎の同時押しの個数を合計する（`sum_histograms_by_group`参照）。
+    """
+
+    return sum_histograms_by_group({None: music_scores}, jobs)[None]
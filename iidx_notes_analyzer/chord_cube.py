@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+import json
+from typing import Self
+
+from . import chord_cache, chord_histogram, iidx, persistence
+
+# 同時押しの個数を(プレイモード, バージョン, 難易度, レベル)毎に合計しておく。
+# `analyze`の絞り込み条件は曲のタグ以外この4つなので、
+# タグで絞り込まない限り、該当するセルを足し合わせるだけで結果が出る。
+#
+# 各セルは合計に含めた曲のタグも持っておき、
+# 実際に保存されている譜面と食い違っていたら（譜面ファイルを手で消した等）、
+# そのセルは使わずに作り直す。
+
+_AGGREGATE_NAME = 'chord_cube.json'
+_FORMAT_VERSION = 1
+
+CellKey = tuple[iidx.PlayMode, str, iidx.Difficulty, iidx.Level]
+
+def cell_key(music: iidx.Music, score: iidx.Score) -> CellKey:
+    return (
+        score.kind.play_mode, music.version.code,
+        score.kind.difficulty, score.level,
+    )
+
+@dataclass(slots=True)
+class _Cell:
+    music_tags: frozenset[str]
+    histogram: chord_histogram.ChordHistogram
+
+def _encode(cells: dict[CellKey, _Cell]) -> bytes:
+    raw_cells = []
+    for (play_mode, version, difficulty, level), cell in cells.items():
+        raw_cells.append({
+            'play_mode': play_mode,
+            'version': version,
+            'difficulty': difficulty,
+            'level': level,
+            'music_tags': sorted(cell.music_tags),
+            'counts': [
+                [code, count]
+                for code, count in enumerate(cell.histogram.to_list())
+                if count
+            ],
+        })
+
+    return json.dumps(
+        {'format_version': _FORMAT_VERSION, 'cells': raw_cells},
+        separators=(',', ':'),
+    ).encode()
+
+def _decode(data: bytes) -> dict[CellKey, _Cell]:
+    raw = json.loads(data)
+    assert isinstance(raw, dict)
+    if raw['format_version'] != _FORMAT_VERSION:
+        raise ValueError('unsupported format version')
+
+    cells: dict[CellKey, _Cell] = {}
+    for raw_cell in raw['cells']:
+        play_mode = raw_cell['play_mode']
+        if not iidx.is_valid_for_play_mode(play_mode):
+            raise ValueError(play_mode)
+        difficulty = raw_cell['difficulty']
+        if not iidx.is_valid_for_difficulty(difficulty):
+            raise ValueError(difficulty)
+        level = raw_cell['level']
+        if not iidx.is_valid_for_level(level):
+            raise ValueError(level)
+        key: CellKey = (play_mode, raw_cell['version'], difficulty, level)
+
+        counts = [0] * iidx.CHORD_CODE_COUNT
+        for code, count in raw_cell['counts']:
+            counts[code] = count
+
+        cells[key] = _Cell(
+            frozenset(raw_cell['music_tags']),
+            chord_histogram.ChordHistogram(counts),
+        )
+    return cells
+
+class ChordCube:
+    _cells: dict[CellKey, _Cell]
+    _modified: bool
+    _data: bytes | None     # 最後に読み込んだ（保存した）内容
+
+    def __init__(self) -> None:
+        self._cells = {}
+        self._modified = False
+        self._data = None
+
+    @classmethod
+    def load(cls) -> Self:
+        cube = cls()
+        cube._load(persistence.load_aggregate(_AGGREGATE_NAME))
+        return cube
+
+    def _load(self, data: bytes | None) -> None:
+        self._cells = {}
+        self._modified = False
+        self._data = data
+        if data is None:
+            return
+
+        try:
+            self._cells = _decode(data)
+        except (ValueError, LookupError, TypeError, AssertionError):
+            # 壊れていたら空から作り直す
+            self._modified = True
+
+    def reload_if_changed(self) -> bool:
+        """
+        他のプロセスが保存し直していれば読み込み直す（保存していない変更は捨てる）。
+        譜面を保存し直した場合は曲のタグが変わらず`sum_histograms`では気付けないので、
+        保存し直した側が作り直させたセル（`add`）を取り込むために使う。
+        """
+
+        data = persistence.load_aggregate(_AGGREGATE_NAME)
+        if data == self._data:
+            return False
+        self._load(data)
+        return True
+
+    def save(self) -> None:
+        if not self._modified:
+            return
+        data = _encode(self._cells)
+        persistence.save_aggregate(_AGGREGATE_NAME, data)
+        self._data = data
+        self._modified = False
+
+    def clear(self) -> None:
+        self._cells = {}
+        self._modified = True
+
+    def add(
+        self,
+        music: iidx.Music, score: iidx.Score,
+        histogram: chord_histogram.ChordHistogram,
+    ) -> None:
+        """
+        新たに保存した譜面を足し込む。
+        """
+
+        key = cell_key(music, score)
+        cell = self._cells.get(key)
+        if cell is None:
+            # 他の譜面が足りなくても、`sum_histograms`時に検知して作り直される
+            self._cells[key] = _Cell(
+                frozenset([music.tag]),
+                chord_histogram.ChordHistogram(histogram.to_list()),
+            )
+        elif music.tag in cell.music_tags:
+            # 保存し直した場合、前の譜面の分を引けないので作り直させる
+            del self._cells[key]
+        else:
+            cell.music_tags |= {music.tag}
+            cell.histogram += histogram
+        self._modified = True
+
+    def sum_histograms(
+        self,
+        music_scores: list[tuple[iidx.Music, iidx.Score]],
+        jobs: int | None = None,
+    ) -> chord_histogram.ChordHistogram:
+        """
+        譜面毎の同時押しの個数を合計する。
+        `music_scores`は保存済みの譜面の内、曲のタグ以外の条件で絞り込んだものとする。
+        食い違っているセルだけは譜面毎のキャッシュ（`chord_cache`）から作り直す。
+        """
+
+        groups: dict[CellKey, list[tuple[iidx.Music, iidx.Score]]] = {}
+        for music, score in music_scores:
+            groups.setdefault(cell_key(music, score), []).append((music, score))
+
+        stale_groups = {
+            key: group for key, group in groups.items()
+            if not self._is_fresh(key, group)
+        }
+        if stale_groups:
+            rebuilt = chord_cache.sum_histograms_by_group(stale_groups, jobs)
+            for key, histogram in rebuilt.items():
+                self._cells[key] = _Cell(
+                    frozenset(music.tag for music, _ in stale_groups[key]),
+                    histogram,
+                )
+            self._modified = True
+
+        total = chord_histogram.ChordHistogram()
+        for key in groups:
+            total += self._cells[key].histogram
+        return total
+
+    def _is_fresh(
+        self, key: CellKey, group: list[tuple[iidx.Music, iidx.Score]],
+    ) -> bool:
+
+        cell = self._cells.get(key)
+        if cell is None:
+            return False
+        return cell.music_tags == {music.tag for music, _ in group}
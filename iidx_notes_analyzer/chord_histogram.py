@@ -0,0 +1,198 @@
+from array import array
+import sys
+from typing import Any
+
+from . import iidx, notes_codec
+from .util import util
+
+# NumPyがあればベクトル化した集計を使う。無ければ素のPythonで集計する。
+# どちらでも結果は同じ。
+# NumPyは読み込みに時間が掛かるので、実際に使うまで読み込まない（`--help`等を速くする）。
+np: Any = util.import_lazily('numpy')
+
+def numpy_is_available() -> bool:
+    return np is not None
+
+# 同時押しの大きさ（皿を含むかどうか、鍵盤の数）毎の添字。
+# 皿無しの0〜7個、皿有りの0〜7個の順。
+SIZE_COUNT = (iidx.KEY_COUNT + 1) * 2
+
+def size_index(has_scratch: bool, key_count: int) -> int:
+    return (iidx.KEY_COUNT + 1 if has_scratch else 0) + key_count
+
+# 同時押しの符号から大きさの添字への対応。
+# 符号の鍵盤部分のビット数（popcount）と皿のビットを予め表にしておく。
+_SIZE_INDEXES: list[int] = [
+    size_index(
+        chord.lane_contains(iidx.SCRATCH),
+        sum(chord.lane_contains(key) for key in iidx.all_keys()),
+    )
+    for chord in map(iidx.Chord.from_code, range(iidx.CHORD_CODE_COUNT))
+]
+
+class ChordHistogram:
+    """
+    同時押し毎の個数。
+    `iidx.Chord.code`を添字とする固定長の配列で持つので、
+    足し合わせても新たにメモリ確保が起きない。
+    """
+
+    __slots__ = ('_counts',)
+    _counts: Any    # NumPyがあれば`numpy.ndarray`、無ければ`list[int]`
+
+    def __init__(self, counts: list[int] | None = None) -> None:
+        if counts is None:
+            counts = [0] * iidx.CHORD_CODE_COUNT
+        if len(counts) != iidx.CHORD_CODE_COUNT:
+            raise ValueError(len(counts))
+
+        if np is not None:
+            self._counts = np.array(counts, dtype=np.int64)
+        else:
+            self._counts = list(counts)
+
+    @classmethod
+    def _from_raw(cls, counts: Any) -> 'ChordHistogram':
+        histogram = cls.__new__(cls)
+        histogram._counts = counts
+        return histogram
+
+    def __getitem__(self, chord: iidx.Chord) -> int:
+        return int(self._counts[chord.code])
+
+    def __iadd__(self, other: 'ChordHistogram') -> 'ChordHistogram':
+        if np is not None:
+            self._counts += other._counts
+        else:
+            counts = self._counts
+            for code, count in enumerate(other._counts):
+                if count:
+                    counts[code] += count
+        return self
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ChordHistogram):
+            return NotImplemented
+        return self.to_list() == other.to_list()
+
+    def to_list(self) -> list[int]:
+        if np is not None:
+            return self._counts.tolist()
+        return list(self._counts)
+
+    def total(self) -> int:
+        return int(sum(self._counts))
+
+    def count_by_size(self) -> list[int]:
+        """
+        同時押しの大きさ毎の個数（`size_index`を添字とする）。
+        同時押しの種類数分の表引きで済むので、譜面数に依らない。
+        """
+
+        if np is not None:
+            counts = np.zeros(SIZE_COUNT, dtype=np.int64)
+            np.add.at(counts, np.array(_SIZE_INDEXES, dtype=np.intp), self._counts)
+            return counts.tolist()
+
+        list_counts = [0] * SIZE_COUNT
+        for code, count in enumerate(self._counts):
+            if count:
+                list_counts[_SIZE_INDEXES[code]] += count
+        return list_counts
+
+    # バイト列では、個数が0でない同時押しについて(符号, 個数)の組を並べる。
+    # 1譜面に出てくる同時押しの種類はそう多くないので、密な配列より小さい。
+    def to_bytes(self) -> bytes:
+        pairs = array('q')
+        for code, count in enumerate(self.to_list()):
+            if count:
+                pairs.append(code)
+                pairs.append(count)
+        if sys.byteorder != 'little':
+            pairs.byteswap()
+        return pairs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ChordHistogram':
+        pairs = array('q')
+        if len(data) % (pairs.itemsize * 2) != 0:
+            raise ValueError('invalid size: ' + str(len(data)))
+        pairs.frombytes(data)
+        if sys.byteorder != 'little':
+            pairs.byteswap()
+
+        if np is not None:
+            raw_pairs = np.frombuffer(pairs, dtype=np.int64)
+            codes = raw_pairs[0::2]
+            if np.any((codes < 0) | (codes >= iidx.CHORD_CODE_COUNT)):
+                raise ValueError('invalid chord code')
+            counts = np.zeros(iidx.CHORD_CODE_COUNT, dtype=np.int64)
+            counts[codes] = raw_pairs[1::2]
+            return cls._from_raw(counts)
+
+        list_counts = [0] * iidx.CHORD_CODE_COUNT
+        for i in range(0, len(pairs), 2):
+            code = pairs[i]
+            if not 0 <= code < iidx.CHORD_CODE_COUNT:
+                raise ValueError('invalid chord code: ' + str(code))
+            list_counts[code] = pairs[i + 1]
+        return cls._from_raw(list_counts)
+
+# ノーツの符号のレーン部分（`notes_codec`参照）から同時押しの符号のレーン部分への対応
+_CHORD_LANE_BITS: list[int] = [
+    iidx.Chord(1, [notes_codec.decode_note(lane_code).lane]).code
+    for lane_code in range(8)
+]
+
+def _to_chord_codes_numpy(note_codes: array) -> Any:
+    assert np is not None
+
+    codes = np.frombuffer(note_codes, dtype=np.int64)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # 上位ビットが(timing, play_side)、下位3ビットがレーン
+    groups = codes >> 3
+    lane_bits = np.array(_CHORD_LANE_BITS, dtype=np.int64)[codes & 7]
+
+    starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+    play_side_bits = groups[starts] & 1
+    return np.bitwise_or.reduceat(lane_bits, starts) | play_side_bits
+
+def _to_chord_codes_python(note_codes: array) -> array:
+    notes = map(notes_codec.decode_note, note_codes)
+    # 昇順かどうかは読み込み時（`notes_codec`）に検証済み
+    chords = iidx.to_chords(notes, checks_order=False)
+    return array('H', (chord.code for chord in chords))
+
+def to_chord_codes(note_codes: array) -> Any:
+    """
+    1譜面分のノーツの符号（ソート済み）を、同時押しの符号の列にする。
+    NumPyがあれば`numpy.ndarray`、無ければ`array`で返す。
+    """
+
+    if np is not None:
+        return _to_chord_codes_numpy(note_codes)
+    return _to_chord_codes_python(note_codes)
+
+def _count_chords_numpy(note_codes: array) -> ChordHistogram:
+    assert np is not None
+
+    chord_codes = _to_chord_codes_numpy(note_codes)
+    counts = np.bincount(chord_codes, minlength=iidx.CHORD_CODE_COUNT)
+    return ChordHistogram._from_raw(counts.astype(np.int64, copy=False))
+
+def _count_chords_python(note_codes: array) -> ChordHistogram:
+    counts = [0] * iidx.CHORD_CODE_COUNT
+    for code in _to_chord_codes_python(note_codes):
+        counts[code] += 1
+    return ChordHistogram(counts)
+
+def count_chords(note_codes: array) -> ChordHistogram:
+    """
+    1譜面分のノーツの符号（ソート済み）から同時押し毎の個数を数える。
+    """
+
+    if np is not None:
+        return _count_chords_numpy(note_codes)
+    return _count_chords_python(note_codes)
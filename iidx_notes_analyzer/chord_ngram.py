@@ -0,0 +1,484 @@
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+import heapq
+from typing import Any
+
+from . import chord_cache, chord_histogram, iidx, persistence
+from .chord_histogram import np
+from .util import profile
+
+# 連続する同時押しの並び（n-gram）毎の個数。
+# 同時押しの符号（9bit）をn個並べて1つの整数に詰めたものをキーにして数える。
+# 2Pの同時押しは1Pの同時押しと交互に押すわけではないので、
+# DPではプレイサイド毎に別々の並びとして数える。
+#
+# 並びの種類は譜面数に比例して増えるので、上位だけ求める場合は
+# 持っておく種類数を抑えて数え（Misra-Gries）、残った候補だけを数え直す。
+
+_CHORD_CODE_BITS = (iidx.CHORD_CODE_COUNT - 1).bit_length()
+_CHORD_CODE_MASK = iidx.CHORD_CODE_COUNT - 1
+
+# 符号付き64bit整数に詰められる長さ
+MAX_LENGTH = 63 // _CHORD_CODE_BITS
+
+# 譜面毎の集計結果をこの件数まで溜めてから纏めて合算する
+_MERGE_THRESHOLD = 1 << 20
+
+# 上位`k`個を求める時に持っておく種類数（`k`の何倍か。少なくとも`_MIN_CAPACITY`）
+_CAPACITY_FACTOR = 8
+_MIN_CAPACITY = 1 << 16
+
+def capacity_for_top(k: int | None) -> int | None:
+    """
+    上位`k`個を求めるのに持っておく種類数。`k`が無ければ（全て求めるなら）抑えない。
+    """
+
+    if k is None:
+        return None
+    return max(k * _CAPACITY_FACTOR, _MIN_CAPACITY)
+
+@dataclass(frozen=True, slots=True)
+class Ngram:
+    chords: tuple[iidx.Chord, ...]
+    count: int
+    score_count: int    # この並びが出てくる譜面の数
+
+    def show_lanes(self) -> str:
+        return ' > '.join(chord.show_lanes() for chord in self.chords)
+
+def _pack(chords: tuple[iidx.Chord, ...]) -> int:
+    key = 0
+    for chord in chords:
+        key = key << _CHORD_CODE_BITS | chord.code
+    return key
+
+def _unpack(key: int, length: int) -> tuple[iidx.Chord, ...]:
+    return tuple(
+        iidx.Chord.from_code(key >> (_CHORD_CODE_BITS * i) & _CHORD_CODE_MASK)
+        for i in reversed(range(length))
+    )
+
+def _merge_numpy(parts: list[tuple[Any, Any, Any]]) -> tuple[Any, Any, Any]:
+    """
+    (キー, 個数, 譜面数)の配列の組を、キーが重複しないよう纏めて整列する。
+    件数分の一時配列が幾つも要るので、要らなくなった配列から手放していく。
+    """
+
+    assert np is not None
+
+    keys = np.concatenate([part[0] for part in parts])
+    if len(keys) == 0:
+        return keys, keys.copy(), keys.copy()
+    order = np.argsort(keys)
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    keys = keys[starts]
+
+    def sum_column(i: int) -> Any:
+        column = np.concatenate([part[i] for part in parts])[order]
+        return np.add.reduceat(column, starts)
+
+    counts = sum_column(1)
+    score_counts = sum_column(2)
+    return keys, counts, score_counts
+
+class NgramCounts:
+    """
+    長さ`length`の同時押しの並び毎の個数と、それが出てくる譜面の数。
+    NumPyがあれば、キーと個数を整列済みの配列で持つ（1種類あたり24バイト）。
+
+    `capacity`を指定すると、種類数がそれを超える度に、
+    (`capacity`+1)番目に多い個数を全ての並びから引いて、正のものだけ残す（Misra-Gries）。
+    残った並びの個数は引いた分だけ少なく、譜面数も当てにならないので、
+    `recount`で作ったものに数え直させる。
+    """
+
+    __slots__ = (
+        'length', 'capacity', '_keys', '_counts', '_score_counts',
+        '_pending', '_pending_size', '_total', '_pruned', '_recounting',
+    )
+    length: int
+    capacity: int | None
+    _keys: Any              # NumPyがあれば`numpy.ndarray`、無ければ`None`
+    _counts: Any            # NumPyがあれば`numpy.ndarray`、無ければ`Counter[int]`
+    _score_counts: Any      # 同上
+    _pending: list[tuple[Any, Any, Any]]
+    _pending_size: int
+    _total: int             # 捨てた分も含めた、全ての並びの個数
+    _pruned: bool           # `capacity`を超えて捨てた並びがあるか
+    _recounting: bool       # 数え直し中（決まった候補だけ数える）か
+
+    def __init__(self, length: int, capacity: int | None = None) -> None:
+        if not 1 <= length <= MAX_LENGTH:
+            raise ValueError(length)
+        if capacity is not None and capacity < 1:
+            raise ValueError(capacity)
+        self.length = length
+        self.capacity = capacity
+        if np is not None:
+            self._keys = np.zeros(0, dtype=np.int64)
+            self._counts = np.zeros(0, dtype=np.int64)
+            self._score_counts = np.zeros(0, dtype=np.int64)
+        else:
+            self._keys = None
+            self._counts = Counter()
+            self._score_counts = Counter()
+        self._pending = []
+        self._pending_size = 0
+        self._total = 0
+        self._pruned = False
+        self._recounting = False
+
+    def recount(self) -> 'NgramCounts':
+        """
+        今残っている並びだけを候補として、正確に数え直すための空のものを作る。
+        """
+
+        if np is not None:
+            self._flush()
+        counts = NgramCounts(self.length, self.capacity)
+        counts._pruned = self._pruned
+        counts._recounting = True
+        if np is not None:
+            counts._keys = self._keys.copy()
+            counts._counts = np.zeros(len(self._keys), dtype=np.int64)
+            counts._score_counts = np.zeros(len(self._keys), dtype=np.int64)
+        else:
+            counts._counts = Counter(dict.fromkeys(self._counts, 0))
+            counts._score_counts = Counter(dict.fromkeys(self._counts, 0))
+        return counts
+
+    def empty_like(self) -> 'NgramCounts':
+        """
+        同じ設定（数え直し中なら同じ候補）で、まだ何も数えていないものを作る。
+        """
+
+        if self._recounting:
+            return self.recount()
+        return NgramCounts(self.length, self.capacity)
+
+    def _merge_threshold(self) -> int:
+        if self.capacity is None:
+            return _MERGE_THRESHOLD
+        return min(max(self.capacity * 4, 1 << 18), _MERGE_THRESHOLD)
+
+    def _add_numpy(self, keys: Any, counts: Any, score_counts: Any) -> None:
+        self._pending.append((keys, counts, score_counts))
+        self._pending_size += len(keys)
+        if self._pending_size >= self._merge_threshold():
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        parts = self._pending
+        parts.append((self._keys, self._counts, self._score_counts))
+        self._keys = self._counts = self._score_counts = None
+        self._keys, self._counts, self._score_counts = _merge_numpy(parts)
+        self._pending = []
+        self._pending_size = 0
+        self._prune_numpy()
+
+    def _prune_numpy(self) -> None:
+        assert np is not None
+
+        capacity = self.capacity
+        if capacity is None or len(self._counts) <= capacity:
+            return
+        threshold = np.partition(self._counts, -(capacity + 1))[-(capacity + 1)]
+        kept = self._counts > threshold
+        self._keys = self._keys[kept]
+        self._counts = self._counts[kept] - threshold
+        self._score_counts = self._score_counts[kept]
+        self._pruned = True
+
+    def _prune_python(self) -> None:
+        # 毎回削ると遅いので、`capacity`の2倍まで溜まったら削る
+        capacity = self.capacity
+        if capacity is None or len(self._counts) <= capacity * 2:
+            return
+        threshold = heapq.nlargest(capacity + 1, self._counts.values())[-1]
+        self._counts = Counter({
+            key: count - threshold
+            for key, count in self._counts.items() if count > threshold
+        })
+        self._score_counts = Counter({
+            key: self._score_counts[key] for key in self._counts
+        })
+        self._pruned = True
+
+    def add_score(self, note_codes: array) -> None:
+        """
+        1譜面分のノーツの符号（ソート済み）に出てくる並びを数えて加える。
+        """
+
+        chord_codes = chord_histogram.to_chord_codes(note_codes)
+        if np is not None:
+            self._add_score_numpy(chord_codes)
+        else:
+            self._add_score_python(chord_codes)
+
+    def _add_score_numpy(self, chord_codes: Any) -> None:
+        assert np is not None
+
+        length = self.length
+        windows = []
+        for play_side_bit in [0, 1]:
+            codes = chord_codes[chord_codes & 1 == play_side_bit]
+            window_count = len(codes) - length + 1
+            if window_count <= 0:
+                continue
+            keys = np.zeros(window_count, dtype=np.int64)
+            for i in range(length):
+                keys <<= _CHORD_CODE_BITS
+                keys |= codes[i:i + window_count]
+            windows.append(keys)
+        if not windows:
+            return
+
+        keys, counts = np.unique(np.concatenate(windows), return_counts=True)
+        counts = counts.astype(np.int64, copy=False)
+        self._total += int(counts.sum())
+
+        if self._recounting:
+            # 1譜面分のキーは重複しないので、候補の位置にそのまま足せる
+            indexes = np.searchsorted(self._keys, keys)
+            found = indexes < len(self._keys)
+            found[found] = self._keys[indexes[found]] == keys[found]
+            self._counts[indexes[found]] += counts[found]
+            self._score_counts[indexes[found]] += 1
+            return
+
+        self._add_numpy(keys, counts, np.ones(len(keys), dtype=np.int64))
+
+    def _add_score_python(self, chord_codes: array) -> None:
+        length = self.length
+        mask = (1 << (_CHORD_CODE_BITS * length)) - 1
+        score_counts: Counter[int] = Counter()
+        # プレイサイド毎に、直近`length`個の符号を詰めた値を転がしていく
+        keys = [0, 0]
+        filled = [0, 0]
+        for code in chord_codes:
+            play_side_bit = code & 1
+            keys[play_side_bit] = (keys[play_side_bit] << _CHORD_CODE_BITS | code) & mask
+            filled[play_side_bit] += 1
+            if filled[play_side_bit] >= length:
+                score_counts[keys[play_side_bit]] += 1
+        self._total += score_counts.total()
+
+        if self._recounting:
+            for key, count in score_counts.items():
+                if key in self._counts:
+                    self._counts[key] += count
+                    self._score_counts[key] += 1
+            return
+
+        self._counts.update(score_counts)
+        self._score_counts.update(score_counts.keys())
+        self._prune_python()
+
+    def __iadd__(self, other: 'NgramCounts') -> 'NgramCounts':
+        if other.length != self.length:
+            raise ValueError(other.length)
+        if other._recounting != self._recounting:
+            raise ValueError(other._recounting)
+        self._total += other._total
+        self._pruned = self._pruned or other._pruned
+
+        if self._recounting:
+            # 同じ候補を数え直したもの同士
+            if np is not None:
+                self._counts += other._counts
+                self._score_counts += other._score_counts
+            else:
+                self._counts.update(other._counts)
+                self._score_counts.update(other._score_counts)
+            return self
+
+        if np is not None:
+            other._flush()
+            self._add_numpy(other._keys, other._counts, other._score_counts)
+        else:
+            self._counts.update(other._counts)
+            self._score_counts.update(other._score_counts)
+            self._prune_python()
+        return self
+
+    def __getstate__(self) -> tuple[Any, ...]:
+        # ワーカープロセスから返す時に、合算待ちの分を纏めてから送る
+        if np is not None:
+            self._flush()
+        return (
+            self.length, self.capacity, self._keys, self._counts, self._score_counts,
+            self._total, self._pruned, self._recounting,
+        )
+
+    def __setstate__(self, state: tuple[Any, ...]) -> None:
+        (
+            self.length, self.capacity, self._keys, self._counts, self._score_counts,
+            self._total, self._pruned, self._recounting,
+        ) = state
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def pruned(self) -> bool:
+        """
+        `capacity`を超えて捨てた並びがあるか。
+        """
+
+        if np is not None:
+            self._flush()
+        return self._pruned
+
+    def distinct_count(self) -> int | None:
+        """
+        並びの種類数。捨てた並びがある場合は分からないのでNone。
+        """
+
+        if self.pruned:
+            return None
+        return len(self._counts)
+
+    def total(self) -> int:
+        return self._total
+
+    def __getitem__(self, chords: tuple[iidx.Chord, ...]) -> int:
+        """
+        捨てた並び（数え直し中は候補以外）は0。
+        """
+
+        if len(chords) != self.length:
+            raise ValueError(len(chords))
+        key = _pack(chords)
+        if np is None:
+            return self._counts[key]
+        self._flush()
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return int(self._counts[i])
+        return 0
+
+    def top(self, k: int | None = None) -> list[Ngram]:
+        """
+        個数の多い順（同数なら符号順）に`k`個返す。`k`を省略すると全て返す。
+        """
+
+        if k is not None and k < 0:
+            raise ValueError(k)
+
+        if np is not None:
+            self._flush()
+            if k is not None and k == 0:
+                return []
+            if k is not None and k < len(self._counts):
+                # 全種類を並べ替えずに、`k`番目の個数以上のものだけに絞ってから並べる
+                threshold = np.partition(self._counts, -k)[-k]
+                candidates = np.flatnonzero(self._counts >= threshold)
+            else:
+                candidates = np.arange(len(self._counts))
+            order = candidates[np.lexsort((
+                self._keys[candidates], -self._counts[candidates],
+            ))][:k]
+            items = zip(
+                self._keys[order].tolist(),
+                self._counts[order].tolist(),
+                self._score_counts[order].tolist(),
+            )
+        else:
+            keys = sorted(self._counts, key=lambda key: (-self._counts[key], key))[:k]
+            items = ((key, self._counts[key], self._score_counts[key]) for key in keys)
+
+        return [
+            Ngram(_unpack(key, self.length), count, score_count)
+            for key, count, score_count in items
+        ]
+
+    def top_is_exact(self, k: int | None = None) -> bool:
+        """
+        `top(k)`が、捨てた並びが無かった場合と同じ結果か。
+        捨てた並びの個数はそれぞれ`total / (capacity + 1)`以下なので、
+        数え直した`k`番目の個数がそれを超えていれば、上位に漏れは無い。
+        """
+
+        if not self.pruned:
+            return True
+        if not self._recounting or k is None:
+            return False
+        assert self.capacity is not None
+
+        ngrams = self.top(k)
+        if len(ngrams) < k:
+            return False
+        return ngrams[-1].count * (self.capacity + 1) > self._total
+
+def _count_serially(
+    music_scores: list[tuple[iidx.Music, iidx.Score]], template: NgramCounts,
+) -> NgramCounts:
+
+    ngrams = template.empty_like()
+    for music, score in music_scores:
+        with profile.phase('notes_load'):
+            note_codes = persistence.load_note_codes(music, score)
+        with profile.phase('ngram_extraction'):
+            ngrams.add_score(note_codes)
+    return ngrams
+
+def _count_in_worker(
+    args: tuple[list[tuple[iidx.Music, iidx.Score]], NgramCounts],
+) -> NgramCounts:
+
+    music_scores, template = args
+    return _count_serially(music_scores, template)
+
+def _count(
+    music_scores: list[tuple[iidx.Music, iidx.Score]],
+    template: NgramCounts,
+    jobs: int,
+) -> NgramCounts:
+
+    if jobs == 1 or len(music_scores) <= 1:
+        return _count_serially(music_scores, template)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 重い譜面が偏っても均されるよう、ワーカー数より細かく分ける
+    chunk_count = min(len(music_scores), jobs * 4)
+    chunks = [(music_scores[i::chunk_count], template) for i in range(chunk_count)]
+
+    totals = template.empty_like()
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=chord_cache.init_worker,
+        initargs=(persistence.get_backend().name, persistence.is_paranoid()),
+    ) as executor:
+        for partial in executor.map(_count_in_worker, chunks):
+            totals += partial
+    return totals
+
+def count_ngrams(
+    music_scores: list[tuple[iidx.Music, iidx.Score]],
+    length: int,
+    jobs: int | None = None,
+    top_count: int | None = None,
+) -> NgramCounts:
+
+    """
+    譜面毎の長さ`length`の同時押しの並びを数えて合計する。
+    `top_count`を指定すると、上位`top_count`個を求めるのに要る分だけ持っておき
+    （`capacity_for_top`）、捨てた並びがあれば、残った候補を正確に数え直す。
+    `jobs`の扱いは`chord_cache.sum_histograms_by_group`と同じ。
+    """
+
+    if jobs is None:
+        # ワーカープロセス内は計測できないので、計測中は並列化しない
+        jobs = 1 if profile.is_enabled() else chord_cache.default_jobs(len(music_scores))
+    if jobs < 1:
+        raise ValueError(jobs)
+
+    ngrams = _count(music_scores, NgramCounts(length, capacity_for_top(top_count)), jobs)
+    if not ngrams.pruned:
+        return ngrams
+    with profile.phase('recount'):
+        return _count(music_scores, ngrams.recount(), jobs)
@@ -2,8 +2,9 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from functools import total_ordering
 from itertools import combinations, groupby
+from operator import itemgetter
 import re
-from typing import Any, Iterator, Literal, Self, TypeGuard, assert_never
+from typing import Any, Iterable, Iterator, Literal, Self, TypeGuard, assert_never
 
 from .textage_scraper import iidx as tex_iidx
 
@@ -173,30 +174,59 @@ def is_valid_for_play_side(i: int) -> TypeGuard[PlaySide]:
 
 Note = tex_iidx.Note
 
+# 同時押しの符号（9bit）。
+#   ビット0: プレイサイド（1Pなら0、2Pなら1）
+#   ビット1〜8: 各レーンを押すかどうか（`all_lanes()`の順）
+CHORD_CODE_COUNT = 1 << 9
+
+_ALL_LANES: tuple[Lane, ...] = tuple(all_lanes())
+_LANE_BITS: dict[Lane, int] = {
+    lane: 1 << i for i, lane in enumerate(_ALL_LANES, 1)
+}
+
 class Chord:
-    _play_side: PlaySide
-    _lanes: dict[Lane, bool]
+    """
+    同時押し。符号毎にインスタンスが1つだけ存在する（`Chord.from_code`）ので、
+    生成してもメモリ確保は起きない。不変。
+    """
 
-    def __init__(
-        self,
+    __slots__ = ('_code',)
+    _code: int
+
+    def __new__(
+        cls,
         play_side: PlaySide,
-        lanes: list[Lane] = [],
-    ) -> None:
+        lanes: Iterable[Lane] = (),
+    ) -> Self:
 
-        self._play_side = play_side
-        self._lanes = {lane: False for lane in all_lanes()}
+        code = play_side - 1
         for lane in lanes:
-            self.add_lane(lane)
+            code |= _LANE_BITS[lane]
+        return cls.from_code(code)
+
+    @classmethod
+    def from_code(cls, code: int) -> Self:
+        return _CHORDS[code]
+
+    @classmethod
+    def _create(cls, code: int) -> Self:
+        chord = object.__new__(cls)
+        chord._code = code
+        return chord
+
+    @property
+    def code(self) -> int:
+        return self._code
 
     @property
     def play_side(self) -> PlaySide:
-        return self._play_side
+        return 2 if self._code & 1 else 1
 
     def lanes(self) -> list[Lane]:
-        return [lane for lane in all_lanes() if self._lanes[lane]]
+        return [lane for lane in _ALL_LANES if self._code & _LANE_BITS[lane]]
 
     def lane_contains(self, lane: Lane) -> bool:
-        return self._lanes[lane]
+        return self._code & _LANE_BITS[lane] != 0
 
     def show_lanes(self) -> str:
         scratch = 'S' if self.lane_contains(SCRATCH) else ' '
@@ -212,22 +242,18 @@ class Chord:
             case _ as unreachable:
                 assert_never(unreachable)
 
-    def add_lane(self, lane: Lane) -> None:
-        self._lanes[lane] = True
-
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Chord):
             return NotImplemented
-        return self._play_side == other._play_side \
-            and self._lanes == other._lanes
+        return self._code == other._code
 
     def __hash__(self) -> int:
-        h = self.play_side - 1
-        assert h == 0 or h == 1
-        for i, lane in enumerate(all_lanes(), 1):
-            if self.lane_contains(lane):
-                h |= 1 << i
-        return h
+        return self._code
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (Chord.from_code, (self._code,))
+
+_CHORDS: list[Chord] = [Chord._create(code) for code in range(CHORD_CODE_COUNT)]
 
 # 皿無し0個同時押しは含まない
 def all_chord_patterns(
@@ -265,10 +291,30 @@ def all_chord_patterns(
         lanes: list[Lane] = scratches + keys
         yield Chord(play_side, lanes)
 
-def to_chords(notes: list[Note]) -> Iterator[Chord]:
-    assert notes == sorted(notes)
+def _check_sorted(notes: Iterable[Note]) -> Iterator[Note]:
+    last_note: Note | None = None
+    for note in notes:
+        assert last_note is None or last_note <= note
+        last_note = note
+        yield note
+
+def to_chords(
+    notes: Iterable[Note], checks_order: bool = True,
+) -> Iterator[Chord]:
 
-    for _, group in groupby(notes, lambda note: (note.timing, note.play_side)):
-        notes_of_chord = list(group)
-        lanes: list[Lane] = [note.lane for note in notes_of_chord]
-        yield Chord(notes_of_chord[0].play_side, lanes)
+    """
+    ノーツ（昇順）を同時押しに纏める。
+    ノーツは逐次読み進めるので、読み込み中の譜面（`persistence.load_notes`）を
+    そのまま渡せば、読んだ分から同時押しが返る。
+    読み込み時に検証済みのノーツなら、`checks_order`をFalseにして検証を省ける。
+    """
+
+    if __debug__ and checks_order:
+        notes = _check_sorted(notes)
+
+    # `Note`はタプルなので、(timing, play_side)で纏める
+    for (_, play_side), group in groupby(notes, itemgetter(0, 1)):
+        code = play_side - 1
+        for note in group:
+            code |= _LANE_BITS[note.lane]
+        yield _CHORDS[code]
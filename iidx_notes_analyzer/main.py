@@ -1,16 +1,54 @@
-from collections import Counter
 from dataclasses import dataclass
-from typing import assert_never
+from http import HTTPStatus
+from itertools import groupby, product
+import json
+import math
+from operator import itemgetter
+import sys
+import time
+from typing import Any, Callable, Iterator, assert_never
+
+from . import (
+    chord_cache, chord_cube, chord_histogram, chord_ngram, iidx, music_list_diff,
+    note_density, persistence, scrape_journal, server,
+)
+from .util import profile, util
+
+# スクレイピング関係（Playwright等）は読み込みに時間が掛かり、
+# `analyze`等では使わないので、スクレイピングするサブコマンドの中で読み込む。
+# （Playwrightが入っていなくても`analyze`等は使える）
 
-from . import iidx, persistence
-from .adapter import textage_scraper as textage
-from .util import util
-
-# TODO: シグナルを受け付けて穏便にキャンセル終了できる機能
 # TODO: scrape_scoreとanalyzeを統合したい。
 # 解析したい譜面のスクレイプが不足してても気付きにくいのが不丁寧なので、
 # analyze時に自動で足りない譜面をスクレイプする仕組みにしたい。
 
+STORE_NAMES = persistence.BACKEND_NAMES
+MAX_NGRAM_LENGTH = chord_ngram.MAX_LENGTH
+DEFAULT_SERVER_PORT = server.DEFAULT_PORT
+DEFAULT_SERVER_URL = server.default_url()
+def use_store(name: str) -> None:
+    persistence.use_backend(persistence.open_backend(name))
+
+def close_store() -> None:
+    persistence.get_backend().close()
+
+def set_paranoid(paranoid: bool) -> None:
+    persistence.set_paranoid(paranoid)
+
+def start_profiling() -> None:
+    profile.enable()
+
+def report_profile(output_file_path: str | None = None) -> None:
+    """
+    区間毎の計測結果を、`output_file_path`があればJSONで書き出し、無ければ標準エラー出力に出す。
+    """
+
+    if output_file_path is None:
+        print(profile.format_report(), file=sys.stderr)
+        return
+    with open(output_file_path, 'w') as f:
+        json.dump(profile.report_as_dict(), f, indent=2)
+
 HasURLFilter = persistence.HasURLFilter
 
 PlayModeFilter = persistence.PlayModeFilter
@@ -115,15 +153,69 @@ def parse_level_filter(s: str) -> LevelFilter:
         case _:
             raise ValueError(s)
 
-def scrape_music_list(overwrites: bool = False) -> None:
+def scrape_music_list(overwrites: bool = False, refreshes: bool = False) -> None:
+    from .adapter import textage_scraper as textage
+
     with textage.Client() as scraper:
         page = scraper.scrape_music_list_page()
-        try:
+
+    if refreshes:
+        refresh_music_list(page.musics)
+        return
+
+    try:
+        with profile.phase('save'):
             persistence.save_musics(page.musics, overwrites=overwrites)
-        except FileExistsError:
-            print('楽曲一覧は既に保存されています。')
-            print('上書きして良い場合、`--overwrite`オプションを指定してください。')
-            raise SystemExit(1)
+    except FileExistsError:
+        print('楽曲一覧は既に保存されています。')
+        print('上書きして良い場合、`--overwrite`か`--refresh`オプションを指定してください。')
+        raise SystemExit(1)
+
+def refresh_music_list(musics: list[iidx.Music]) -> None:
+    """
+    保存済みの楽曲一覧と比べて、追加・削除・変更された譜面を表示してから上書きする。
+    譜面自体が変わった可能性のある保存済みの譜面は、次の`scrape_score`で取り直させる。
+    """
+
+    try:
+        old_musics = persistence.load_all_musics()
+    except FileNotFoundError:
+        old_musics = []
+    diff = music_list_diff.diff_music_lists(old_musics, musics)
+
+    def score_text(music: iidx.Music, score: iidx.Score) -> str:
+        return \
+            f'{score.kind.play_mode} '\
+            f'VER:{music.version} '\
+            f'[{music.tag}] '\
+            f'{music.title} '\
+            f'({score.kind.difficulty}) '\
+            f'☆{score.level}'
+
+    for music, score in diff.added:
+        print(f'Added: {score_text(music, score)}')
+    for music, score in diff.removed:
+        print(f'Removed: {score_text(music, score)}')
+    for change in diff.changed:
+        changes = ', '.join(change.changes())
+        print(f'Changed: {score_text(change.new_music, change.new_score)} ({changes})')
+    print(
+        f'Found {len(diff.added)} added, {len(diff.removed)} removed '
+        f'and {len(diff.changed)} changed scores.'
+    )
+
+    persistence.save_musics(musics, overwrites=True)
+
+    stale_count = 0
+    for change in diff.changed:
+        if not change.notes_may_be_changed:
+            continue
+        # バージョンが変わった場合は保存先も変わるので、そもそも保存済みでない
+        if not persistence.has_saved_notes(change.new_music, change.new_score):
+            continue
+        persistence.mark_notes_stale(change.new_music, change.new_score)
+        stale_count += 1
+    print(f'Marked {stale_count} saved scores as stale.')
 
 @dataclass(frozen=True, slots=True, kw_only=True)
 class FilterToScrape:
@@ -149,59 +241,261 @@ def parse_filter_to_scrape(
 def scrape_score(
     filter: FilterToScrape = FilterToScrape(),
     debug: bool = False,
+    browser_idle_sec: float | None = 60,
+    resumes: bool = False,
 ) -> None:
 
-    target_music_scores = list(persistence.load_musics(
-        persistence.ScoreFilter(
-            has_URL=True,
-            play_mode=filter.play_mode,
-            version=filter.version,
-            music_tag=filter.music_tag,
-            difficulty=filter.difficulty,
-        ),
-    ))
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from .adapter import textage_scraper as textage
+
+    journal: scrape_journal.ScrapeJournal | None = None
+    if resumes:
+        resumed = scrape_journal.ScrapeJournal.resume()
+        if resumed is None:
+            print('再開できるスクレイピングがありません。')
+            raise SystemExit(1)
+        journal, targets = resumed
+
+        # 前回以降に楽曲一覧から消えた譜面は飛ばす
+        music_scores = {
+            scrape_journal.to_target(music, score): (music, score)
+            for music, score
+            in persistence.load_musics(persistence.ScoreFilter(has_URL=True))
+        }
+        target_music_scores = [
+            music_scores[target] for target in targets if target in music_scores
+        ]
+    else:
+        target_music_scores = list(persistence.load_musics(
+            persistence.ScoreFilter(
+                has_URL=True,
+                play_mode=filter.play_mode,
+                version=filter.version,
+                music_tag=filter.music_tag,
+                difficulty=filter.difficulty,
+            ),
+        ))
+        # デバッグモードでは実際には保存しないので記録しない
+        if not debug:
+            journal = scrape_journal.ScrapeJournal.start([
+                scrape_journal.to_target(music, score)
+                for music, score in target_music_scores
+            ])
 
     print(f'Found {len(target_music_scores)} scores.')
 
-    # スクレイピング先のサーバーへの負荷を下げるために1秒間隔を空ける
-    cool_exec = util.CoolExecutor(1)
+    # 保存は別スレッドで行うので、保存先への問い合わせは先に済ませておく。
+    # 古い扱いの譜面（`refresh_music_list`参照）は取り直して上書きする。
+    saved_indices: set[int] = set()
+    stale_indices: set[int] = set()
+    for score_index, (music, score) in enumerate(target_music_scores):
+        if not persistence.has_saved_notes(music, score):
+            continue
+        if persistence.notes_are_stale(music, score):
+            stale_indices.add(score_index)
+        else:
+            saved_indices.add(score_index)
+
+    # スクレイピング先のサーバーへの負荷を下げるために、ページを開き始める間隔を1秒空ける。
+    # 譜面の解析・保存は別スレッドで行い、その間に次のページを待つ。
+    cool_exec = util.CoolExecutor(1, measures_from_start=True)
     cool_exec.wait_begun = lambda: print('(cool time...', end='', flush=True)
     cool_exec.wait_ended = lambda: print(')', end='', flush=True)
 
-    def with_scraper(scraper: textage.Client | None):
-        for score_index, (music, score) in enumerate(target_music_scores):
-            page_text =\
-                f'{score.kind.play_mode} '\
-                f'VER:{music.version} '\
-                f'[{music.tag}] '\
-                f'{music.title} '\
-                f'({score.kind.difficulty})'
-            print(
-                f'Scraping {score_index + 1}/{len(target_music_scores)} {page_text} ...',
-                end='', flush=True
-            )
-
-            if persistence.has_saved_notes(music, score):
-                print('skipped.')
-                continue
-
-            if scraper is None:
-                # 間隔をあけるのとその時のメッセージ出力だけ再現
-                cool_exec(lambda: None)
-
-                print('do nothing. (debug mode)')
-                continue
-
-            page = cool_exec(lambda: scraper.scrape_score_page(music, score))
-            persistence.save_notes(music, score, page.notes)
+    def save(
+        music: iidx.Music, score: iidx.Score, raw_page: textage.RawScorePage,
+        overwrites: bool,
+    ) -> float:
+
+        started = time.monotonic()
+        with profile.phase('decode'):
+            page = raw_page.parse()
+        with profile.phase('save'):
+            persistence.save_notes(music, score, page.notes, overwrites=overwrites)
+            histogram = chord_cache.rebuild_histogram(music, score)
+        with profile.phase('cube_save'):
+            # 他のプロセス（`serve`等）にすぐ反映されるよう、譜面毎に保存する。
+            # 保存していない変更は無いので、他のプロセスが作り直したセルを先に取り込んでおく
+            cube.reload_if_changed()
+            cube.add(music, score, histogram)
+            cube.save()
+        return time.monotonic() - started
+
+    def with_scraper(
+        scraper: textage.Client | None,
+        saver: ThreadPoolExecutor,
+        stop_requested: Callable[[], bool],
+    ) -> bool:
+
+        # 保存中の譜面と、ページの取得に掛かった時間
+        saving: tuple[scrape_journal.Target, float, Future[float]] | None = None
+
+        def wait_saving() -> None:
+            nonlocal saving
+            if saving is None:
+                return
+            target, fetch_sec, future = saving
+            saving = None
+            try:
+                save_sec = future.result()
+            except Exception as e:
+                print(f'保存に失敗しました: {target} {e!r}')
+                if journal is not None:
+                    journal.record_failed(target, e)
+            else:
+                if journal is not None:
+                    journal.record_done(target, fetch_sec, save_sec)
 
-            print('finished.')
+        try:
+            for score_index, (music, score) in enumerate(target_music_scores):
+                if stop_requested():
+                    return True
+
+                target = scrape_journal.to_target(music, score)
+                page_text =\
+                    f'{score.kind.play_mode} '\
+                    f'VER:{music.version} '\
+                    f'[{music.tag}] '\
+                    f'{music.title} '\
+                    f'({score.kind.difficulty})'
+                print(
+                    f'Scraping {score_index + 1}/{len(target_music_scores)} {page_text} ...',
+                    end='', flush=True
+                )
+
+                if score_index in saved_indices:
+                    print('skipped.')
+                    if journal is not None:
+                        journal.record_done(target)
+                    continue
+
+                if scraper is None:
+                    # 間隔をあけるのとその時のメッセージ出力だけ再現
+                    cool_exec(lambda: None)
+
+                    print('do nothing. (debug mode)')
+                    continue
+
+                def fetch() -> tuple[textage.RawScorePage, float]:
+                    assert scraper is not None
+                    started = time.monotonic()
+                    with profile.phase('fetch'):
+                        raw_page = scraper.fetch_score_page(music, score)
+                    return raw_page, time.monotonic() - started
 
-    if debug:
-        with_scraper(None)
-    else:
-        with textage.Client() as scraper:
-            with_scraper(scraper)
+                try:
+                    raw_page, fetch_sec = cool_exec(fetch)
+                except Exception as e:
+                    # 終了要求でブラウザごと止められた場合は失敗扱いにしない
+                    if stop_requested():
+                        print('interrupted.')
+                        return True
+                    print(f'failed. ({e!r})')
+                    if journal is not None:
+                        journal.record_failed(target, e)
+                    continue
+
+                # 保存待ちは高々1譜面なので、溜まっていくことはない
+                wait_saving()
+                saving = (
+                    target, fetch_sec,
+                    saver.submit(
+                        save, music, score, raw_page, score_index in stale_indices,
+                    ),
+                )
+
+                print('finished.')
+
+            return stop_requested()
+
+        finally:
+            # 中断時も、保存中の譜面は書き終えてから終わる
+            wait_saving()
+
+    # 集計済みの合計も更新しておく（`analyze`・`serve`で使う）
+    cube = chord_cube.ChordCube.load()
+    # エラーで止まった場合も中断扱い
+    interrupted = True
+    try:
+        with (
+            util.deferring_stop_signals() as stop_requested,
+            ThreadPoolExecutor(1) as saver,
+        ):
+            if debug:
+                interrupted = with_scraper(None, saver, stop_requested)
+            else:
+                # ブラウザは実際に譜面を取りに行く時に初めて起動される
+                with textage.Client(idle_timeout_sec=browser_idle_sec) as scraper:
+                    interrupted = with_scraper(scraper, saver, stop_requested)
+    finally:
+        cube.save()
+        if journal is not None:
+            print(journal.finish(interrupted))
+
+    if interrupted:
+        print('中断しました。`--resume`オプションで続きから再開できます。')
+    elif journal is not None and journal.failed_count > 0:
+        print('失敗した譜面があります。`--resume`オプションで再試行できます。')
+
+def migrate_notes(keeps_legacy: bool = False) -> None:
+    count = 0
+    for file_path in persistence.migrate_notes(keeps_legacy=keeps_legacy):
+        print(f'Migrated {file_path}')
+        count += 1
+    print(f'Migrated {count} files.')
+
+def copy_store(source: str, destination: str) -> None:
+    if source == destination:
+        raise ValueError(source, destination)
+
+    source_backend = persistence.open_backend(source)
+    destination_backend = persistence.open_backend(destination)
+    try:
+        count = 0
+        for music, score in persistence.copy_all(source_backend, destination_backend):
+            print(f'Copied {score.kind} [{music.tag}] {music.title}')
+            count += 1
+        print(f'Copied {count} scores.')
+    finally:
+        source_backend.close()
+        destination_backend.close()
+
+def rebuild_cache() -> None:
+    count = 0
+    for _ in chord_cache.rebuild_all():
+        count += 1
+
+    # 集計済みの合計は次の`analyze`時に作り直される
+    cube = chord_cube.ChordCube()
+    cube.clear()
+    cube.save()
+
+    print(f'Rebuilt cache of {count} scores.')
+
+def stats() -> None:
+    counts: dict[tuple[iidx.PlayMode, str], int] = {}
+    sizes: dict[tuple[iidx.PlayMode, str], int] = {}
+    for saved in persistence.iter_saved_notes():
+        key = (saved.play_mode, saved.version_code)
+        counts[key] = counts.get(key, 0) + 1
+        sizes[key] = sizes.get(key, 0) + saved.size
+
+    def sort_key(key: tuple[iidx.PlayMode, str]) -> tuple[str, float]:
+        play_mode, version_code = key
+        version = iidx.to_version(version_code)
+        # CS専用曲は最後
+        order = float(version) if isinstance(version, iidx.VersionAC) else math.inf
+        return (play_mode, order)
+
+    for play_mode, group in groupby(sorted(counts, key=sort_key), itemgetter(0)):
+        keys = list(group)
+        for key in keys:
+            print(f'{play_mode} VER:{key[1]} {counts[key]} scores, {sizes[key]:,} bytes')
+        mode_count = sum(counts[key] for key in keys)
+        mode_size = sum(sizes[key] for key in keys)
+        print(f'{play_mode} total {mode_count} scores, {mode_size:,} bytes')
+
+    print(f'Total {sum(counts.values())} scores, {sum(sizes.values()):,} bytes')
 
 @dataclass(frozen=True, slots=True, kw_only=True)
 class FilterToAnalyze:
@@ -227,58 +521,485 @@ def parse_filter_to_analyze(
         level=parse_level_filter(level),
     )
 
-# TODO: 「n個同時押しはm個」みたいな集計もしたい
-# TODO: 個数ではなく割合で見れるパターンも欲しい
 def analyze(
     filter: FilterToAnalyze,
     show_all: bool = False,
     show_score_list: bool = False,
+    jobs: int | None = None,
+    by_size: bool = False,
+    shows_ratio: bool = False,
+    ngram_length: int | None = None,
+    density_window: int | None = None,
+    top_count: int | None = None,
 ) -> None:
 
-    target_music_scores = [
-        (music, score) for music, score
-        in persistence.load_musics(
-            persistence.ScoreFilter(
-                play_mode=filter.play_mode,
-                version=filter.version,
-                music_tag=filter.music_tag,
-                difficulty=filter.difficulty,
-                level=filter.level,
-            ),
-        )
-        if persistence.has_saved_notes(music, score)
+    """
+    `by_size`がTrueなら、同時押し毎の代わりに、大きさ（皿の有無と鍵盤の数）毎に纏めて表示する。
+    `shows_ratio`がTrueなら、個数の代わりに全体に対する割合を表示する。
+    `ngram_length`を指定した場合、同時押し毎の代わりに、
+    長さ`ngram_length`の同時押しの並び毎に数えて、多い順に`top_count`個表示する。
+    `density_window`を指定した場合、同時押しの代わりに、
+    `timing`の幅`density_window`の窓に入るノーツ数を譜面毎に求め、
+    譜面全体での分布と、最も密な窓のノーツ数が多い順に`top_count`譜面を表示する。
+    """
+
+    target_music_scores = _find_scores_to_analyze(filter)
+    listed_music_scores = target_music_scores if show_score_list else []
+
+    if ngram_length is not None:
+        with profile.phase('aggregate'):
+            ngrams = chord_ngram.count_ngrams(
+                target_music_scores, ngram_length, jobs, top_count,
+            )
+        with profile.phase('render'):
+            _show_score_list(len(target_music_scores), listed_music_scores)
+            _show_ngrams(ngrams, top_count)
+        return
+
+    if density_window is not None:
+        with profile.phase('aggregate'):
+            densities = note_density.measure_all(
+                target_music_scores, density_window, jobs,
+            )
+        with profile.phase('render'):
+            _show_score_list(len(target_music_scores), listed_music_scores)
+            _show_densities(target_music_scores, densities, density_window, top_count)
+        return
+
+    with profile.phase('aggregate'):
+        chord_counts = _sum_chord_counts(filter, target_music_scores, jobs)
+
+    with profile.phase('render'):
+        _show_score_list(len(target_music_scores), listed_music_scores)
+        _show_analysis(filter, chord_counts, show_all, by_size, shows_ratio)
+
+def _find_scores_to_analyze(
+    filter: FilterToAnalyze,
+) -> list[tuple[iidx.Music, iidx.Score]]:
+
+    with profile.phase('catalog_load'):
+        persistence.load_catalog()
+    with profile.phase('filter'):
+        return [
+            (music, score) for music, score
+            in persistence.load_musics(
+                persistence.ScoreFilter(
+                    play_mode=filter.play_mode,
+                    version=filter.version,
+                    music_tag=filter.music_tag,
+                    difficulty=filter.difficulty,
+                    level=filter.level,
+                ),
+            )
+            if persistence.has_saved_notes(music, score)
+        ]
+
+def _sum_chord_counts(
+    filter: FilterToAnalyze,
+    target_music_scores: list[tuple[iidx.Music, iidx.Score]],
+    jobs: int | None,
+    cube: chord_cube.ChordCube | None = None,
+) -> chord_histogram.ChordHistogram:
+
+    """
+    `cube`を省略した場合は、保存されたものを読み込んで使う。
+    """
+
+    if filter.music_tag:
+        return chord_cache.sum_histograms(target_music_scores, jobs)
+
+    if cube is None:
+        with profile.phase('cube_load'):
+            cube = chord_cube.ChordCube.load()
+    chord_counts = cube.sum_histograms(target_music_scores, jobs)
+    with profile.phase('cube_save'):
+        cube.save()
+    return chord_counts
+
+@dataclass(frozen=True, slots=True)
+class BatchQuery:
+    name: str
+    raw_filter: dict[str, str]      # `parse_filter_to_analyze`に渡す前の引数
+    filter: FilterToAnalyze
+
+_BATCH_QUERY_FIELDS = ['play_mode', 'version', 'music_tag', 'difficulty', 'level']
+
+def _describe_raw_filter(raw_filter: dict[str, str]) -> str:
+    options = [
+        f'--{option}={raw_filter[field]}'
+        for field, option in [
+            ('version', 'ver'), ('music_tag', 'tag'),
+            ('difficulty', 'diff'), ('level', 'lv'),
+        ]
+        if raw_filter[field]
     ]
+    return ' '.join([raw_filter['play_mode'], *options])
+
+def load_batch_queries(file_path: str) -> list[BatchQuery]:
+    """
+    `analyze_batch`の問い合わせファイル（JSON）を読み込む。
+    ファイルはオブジェクトの配列で、各オブジェクトは`name`（省略可）と
+    `parse_filter_to_analyze`の引数（`play_mode`以外は省略可）を持つ。
+    引数に配列を渡すと、その全ての組み合わせの問い合わせに展開する。
+    """
+
+    with open(file_path, encoding='utf-8') as f:
+        raw_queries = json.load(f)
+    if not isinstance(raw_queries, list):
+        raise ValueError('the top level must be an array')
+
+    queries: list[BatchQuery] = []
+    for i, raw_query in enumerate(raw_queries):
+        if not isinstance(raw_query, dict):
+            raise ValueError(f'query #{i + 1} must be an object')
+        unknown_keys = raw_query.keys() - {'name', *_BATCH_QUERY_FIELDS}
+        if unknown_keys:
+            raise ValueError(f'query #{i + 1} has unknown keys: {sorted(unknown_keys)}')
+        name = raw_query.get('name')
+        if name is not None and not isinstance(name, str):
+            raise ValueError(f'query #{i + 1} has a non-string name')
+
+        choices: list[list[str]] = []
+        for field in _BATCH_QUERY_FIELDS:
+            value = raw_query.get(field, '')
+            values = value if isinstance(value, list) else [value]
+            # レベルは数値でも書けるようにする
+            if not values or not all(
+                isinstance(v, str) or (isinstance(v, int) and not isinstance(v, bool))
+                for v in values
+            ):
+                raise ValueError(f'query #{i + 1} has an invalid {field}: {value!r}')
+            choices.append([str(v) for v in values])
+
+        expands = any(len(values) > 1 for values in choices)
+        for args in product(*choices):
+            raw_filter = dict(zip(_BATCH_QUERY_FIELDS, args))
+            try:
+                filter = parse_filter_to_analyze(**raw_filter)
+            except ValueError as e:
+                raise ValueError(f'query #{i + 1} has an invalid filter: {e}') from e
+
+            description = _describe_raw_filter(raw_filter)
+            if name is None:
+                query_name = description
+            elif expands:
+                query_name = f'{name} ({description})'
+            else:
+                query_name = name
+            queries.append(BatchQuery(query_name, raw_filter, filter))
+    return queries
+
+def analyze_batch(
+    queries: list[BatchQuery],
+    jobs: int | None = None,
+    output_file_path: str | None = None,
+) -> None:
 
-    print(f'Found {len(target_music_scores)} scores.')
-    if show_score_list:
-        # TODO: ソート＆グルーピングして分かりやすく表示
-        for music, score in target_music_scores:
-            print(
-                f'{score.kind.play_mode} '\
-                f'VER:{music.version} '\
-                f'[{music.tag}] '\
-                f'{music.title} '\
-                f'({score.kind.difficulty}) '\
-                f'☆{score.level}'
+    """
+    `queries`それぞれの同時押しの個数を、1つのJSONに纏めて書き出す
+    （`output_file_path`が無ければ標準出力）。
+    """
+
+    with profile.phase('aggregate'):
+        results = _sum_chord_counts_in_batch(queries, jobs)
+
+    with profile.phase('render'):
+        document = {
+            'queries': [
+                _batch_result_as_dict(query, score_count, chord_counts)
+                for query, (score_count, chord_counts) in zip(queries, results)
+            ],
+        }
+        if output_file_path is None:
+            json.dump(document, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        else:
+            with util.make_file_atomically(output_file_path) as f:
+                json.dump(document, f, ensure_ascii=False, indent=2)
+
+def _sum_chord_counts_in_batch(
+    queries: list[BatchQuery],
+    jobs: int | None,
+) -> list[tuple[int, chord_histogram.ChordHistogram]]:
+
+    """
+    問い合わせ毎の(譜面数, 同時押しの個数)。
+    各譜面は当てはまる全ての問い合わせに振り分けるので、
+    問い合わせが重なっていても、譜面毎の個数は1度しか読み込まない。
+    """
+
+    target_music_scores = [_find_scores_to_analyze(query.filter) for query in queries]
+    totals = [chord_histogram.ChordHistogram() for _ in queries]
+
+    # タグで絞り込まない問い合わせは、集計済みの合計（`chord_cube`）のセル単位で振り分けられる。
+    # 作り直しが要るセルは、全ての問い合わせの分を纏めて1度に作り直しておく
+    untagged_indexes = [i for i, query in enumerate(queries) if not query.filter.music_tag]
+    if untagged_indexes:
+        with profile.phase('cube_load'):
+            cube = chord_cube.ChordCube.load()
+        untagged_music_scores = {
+            score: (music, score)
+            for i in untagged_indexes
+            for music, score in target_music_scores[i]
+        }
+        cube.sum_histograms(list(untagged_music_scores.values()), jobs)
+        with profile.phase('cube_save'):
+            cube.save()
+        for i in untagged_indexes:
+            totals[i] = cube.sum_histograms(target_music_scores[i], jobs)
+
+    # タグで絞り込む問い合わせは、譜面を当てはまる問い合わせの組毎に纏めて合計する
+    routes: dict[iidx.Score, tuple[iidx.Music, list[int]]] = {}
+    for i, query in enumerate(queries):
+        if not query.filter.music_tag:
+            continue
+        for music, score in target_music_scores[i]:
+            routes.setdefault(score, (music, []))[1].append(i)
+    groups: dict[tuple[int, ...], list[tuple[iidx.Music, iidx.Score]]] = {}
+    for score, (music, indexes) in routes.items():
+        groups.setdefault(tuple(indexes), []).append((music, score))
+    if groups:
+        for indexes, histogram in chord_cache.sum_histograms_by_group(groups, jobs).items():
+            for i in indexes:
+                totals[i] += histogram
+
+    return [
+        (len(music_scores), total)
+        for music_scores, total in zip(target_music_scores, totals)
+    ]
+
+def _batch_result_as_dict(
+    query: BatchQuery,
+    score_count: int,
+    chord_counts: chord_histogram.ChordHistogram,
+) -> dict[str, Any]:
+
+    # 問い合わせによって項目が増減しないよう、個数が0でも全て出す
+    size_counts = chord_counts.count_by_size()
+    return {
+        'name': query.name,
+        'filter': query.raw_filter,
+        'score_count': score_count,
+        'total': chord_counts.total(),
+        'counts': {
+            chord.show_lanes(): chord_counts[chord]
+            for chord
+            in iidx.all_chord_patterns(_play_side_to_show(query.filter.play_mode))
+        },
+        'by_size': {
+            size_str: size_counts[size_index] for size_str, size_index in _size_labels()
+        },
+    }
+
+def serve(port: int = server.DEFAULT_PORT, jobs: int | None = None) -> None:
+    """
+    `analyze`の問い合わせにHTTPで答え続ける（`analyze_remotely`）。
+    楽曲一覧と同時押しの集計（`chord_cube`）を読み込んだまま持っておき、
+    問い合わせ毎に、他のプロセスが保存した譜面等だけを反映し直す。
+    """
+
+    cube = chord_cube.ChordCube.load()
+
+    def answer_analyze(params: dict[str, str]) -> dict[str, Any]:
+        try:
+            filter = parse_filter_to_analyze(
+                play_mode=params.get('play_mode', ''),
+                version=params.get('version', ''),
+                music_tag=params.get('music_tag', ''),
+                difficulty=params.get('difficulty', ''),
+                level=params.get('level', ''),
             )
+        except ValueError as e:
+            raise server.QueryError(f'invalid filter: {e}')
+
+        persistence.refresh()
+        cube.reload_if_changed()
+        target_music_scores = _find_scores_to_analyze(filter)
+        chord_counts = _sum_chord_counts(filter, target_music_scores, jobs, cube)
+
+        answer: dict[str, Any] = {
+            'score_count': len(target_music_scores),
+            'counts': [
+                [code, count]
+                for code, count in enumerate(chord_counts.to_list())
+                if count
+            ],
+        }
+        if params.get('list') == '1':
+            answer['scores'] = [
+                {'music': music.as_dict(), 'score': score.as_dict()}
+                for music, score in target_music_scores
+            ]
+        return answer
+
+    def handle(path: str, params: dict[str, str]) -> Any:
+        match path:
+            case '/analyze':
+                return answer_analyze(params)
+            case _:
+                raise server.QueryError('not found: ' + path, HTTPStatus.NOT_FOUND)
+
+    # 最初の問い合わせで待たされないよう、全譜面分の集計を済ませておく
+    started = time.monotonic()
+    score_count = 0
+    for play_mode in ['SP', 'DP']:
+        filter = parse_filter_to_analyze(play_mode=play_mode)
+        target_music_scores = _find_scores_to_analyze(filter)
+        _sum_chord_counts(filter, target_music_scores, jobs, cube)
+        score_count += len(target_music_scores)
+    print(f'Loaded {score_count} scores in {time.monotonic() - started:.1f}s.')
+
+    print(f'Serving on {server.default_url(port)} (Ctrl+C to stop)')
+    server.serve(handle, port)
+
+def analyze_remotely(
+    server_url: str,
+    filter: FilterToAnalyze,
+    raw_filter: dict[str, str],
+    show_all: bool = False,
+    show_score_list: bool = False,
+    by_size: bool = False,
+    shows_ratio: bool = False,
+) -> None:
+
+    """
+    `serve`で起動したサーバーに集計させて、`analyze`と同じように表示する。
+    `raw_filter`は`parse_filter_to_analyze`に渡す前の引数（`filter`は表示に使う）。
+    """
+
+    from urllib.error import URLError
+
+    params = raw_filter | {'list': '1' if show_score_list else '0'}
+    try:
+        answer = server.query(server_url, '/analyze', params)
+    except server.QueryError as e:
+        print(f'サーバーに断られました: {e}')
+        return
+    except URLError as e:
+        print(f'サーバーに接続できませんでした: {server_url} ({e.reason})')
+        print('`serve`サブコマンドでサーバーを起動してください。')
+        return
+
+    counts = [0] * iidx.CHORD_CODE_COUNT
+    for code, count in answer['counts']:
+        counts[code] = count
+    listed_music_scores = [
+        (iidx.Music.from_dict(raw['music']), iidx.Score.from_dict(raw['score']))
+        for raw in answer.get('scores', [])
+    ]
+
+    _show_score_list(answer['score_count'], listed_music_scores)
+    _show_analysis(
+        filter, chord_histogram.ChordHistogram(counts),
+        show_all, by_size, shows_ratio,
+    )
 
-    chord_counts = Counter()
-    for music, score in target_music_scores:
-        notes = list(persistence.load_notes(music, score))
-        chords = iidx.to_chords(notes)
-        chord_counts += Counter(chords)
+def _show_score_list(
+    score_count: int,
+    listed_music_scores: list[tuple[iidx.Music, iidx.Score]],
+) -> None:
 
-    match filter.play_mode:
+    print(f'Found {score_count} scores.')
+    # TODO: ソート＆グルーピングして分かりやすく表示
+    for music, score in listed_music_scores:
+        print(_format_score(music, score))
+
+def _format_score(music: iidx.Music, score: iidx.Score) -> str:
+    return f'{score.kind.play_mode} '\
+        f'VER:{music.version} '\
+        f'[{music.tag}] '\
+        f'{music.title} '\
+        f'({score.kind.difficulty}) '\
+        f'☆{score.level}'
+
+def _play_side_to_show(play_mode: iidx.PlayMode) -> iidx.PlaySide | None:
+    """
+    同時押しのパターンを表示するプレイサイド（DPは両サイドなのでNone）。
+    """
+
+    match play_mode:
         case 'SP':
-            play_side = 1
+            return 1
         case 'DP':
-            play_side = None
+            return None
         case _ as unreachable:
             assert_never(unreachable)
 
-    for chord in iidx.all_chord_patterns(play_side):
+def _size_labels() -> Iterator[tuple[str, int]]:
+    """
+    同時押しの大きさ毎の(表示名, `chord_histogram.size_index`)を表示順に返す。
+    """
+
+    for has_scratch in [False, True]:
+        for key_count in range(0 if has_scratch else 1, iidx.KEY_COUNT + 1):
+            size_str = ('S+' if has_scratch else '') + f'{key_count}keys'
+            yield size_str, chord_histogram.size_index(has_scratch, key_count)
+
+def _show_analysis(
+    filter: FilterToAnalyze,
+    chord_counts: chord_histogram.ChordHistogram,
+    show_all: bool,
+    by_size: bool,
+    shows_ratio: bool,
+) -> None:
+
+    total = chord_counts.total()
+
+    def format_count(count: int) -> str:
+        if count == 0:
+            return ''
+        if shows_ratio:
+            return f'{count / total:.2%}'
+        return str(count)
+
+    if by_size:
+        size_counts = chord_counts.count_by_size()
+        for size_str, size_index in _size_labels():
+            count = size_counts[size_index]
+            if show_all or count > 0:
+                print(f'{size_str}:{format_count(count)}')
+        return
+
+    for chord in iidx.all_chord_patterns(_play_side_to_show(filter.play_mode)):
         count = chord_counts[chord]
         if show_all or count > 0:
             chord_str = chord.show_lanes()
-            count_str = str(count) if count > 0 else ''
-            print(f'{chord_str}:{count_str}')
+            print(f'{chord_str}:{format_count(count)}')
+
+def _show_ngrams(ngrams: chord_ngram.NgramCounts, top_count: int | None) -> None:
+    distinct_count = ngrams.distinct_count()
+    # 上位だけ求めた場合、種類が多いと全ては持っておかないので、種類数は分からない
+    kinds = f' ({distinct_count} kinds)' if distinct_count is not None else ''
+    print(f'Found {ngrams.total()} sequences of {ngrams.length} chords{kinds}.')
+    for ngram in ngrams.top(top_count):
+        print(f'{ngram.show_lanes()}:{ngram.count} ({ngram.score_count} scores)')
+    if not ngrams.top_is_exact(top_count):
+        print('※並びの種類が多いため、上位に入るべき並びが漏れている可能性があります（個数は正確です）。')
+
+def _format_density(stats: note_density.DensityStats) -> str:
+    return ' '.join(
+        f'p{p}:{value}' for p, value in zip(note_density.PERCENTILES, stats.percentiles)
+    ) + f' max:{stats.max}'
+
+def _show_densities(
+    target_music_scores: list[tuple[iidx.Music, iidx.Score]],
+    densities: list[note_density.DensityStats],
+    window: int,
+    top_count: int | None,
+) -> None:
+
+    peaks = sorted(stats.max for stats in densities)
+    print(f'Notes per {window} timings:')
+    print(
+        'peak of each score: ' + ' '.join(
+            f'p{p}:{note_density.percentile(peaks, p)}'
+            for p in note_density.PERCENTILES
+        ) + f' max:{peaks[-1] if peaks else 0}'
+    )
+
+    ranking = sorted(
+        zip(target_music_scores, densities),
+        key=lambda item: item[1].max, reverse=True,
+    )
+    for (music, score), stats in ranking[:top_count]:
+        print(f'{_format_score(music, score)}: {_format_density(stats)}')
@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+
+from . import iidx
+
+@dataclass(frozen=True, slots=True)
+class ChangedScore:
+    old_music: iidx.Music
+    old_score: iidx.Score
+    new_music: iidx.Music
+    new_score: iidx.Score
+
+    def changes(self) -> list[str]:
+        changes = []
+        if self.old_music.version != self.new_music.version:
+            changes.append(f'VER:{self.old_music.version} -> {self.new_music.version}')
+        if self.old_score.level != self.new_score.level:
+            changes.append(f'☆{self.old_score.level} -> ☆{self.new_score.level}')
+        if self.old_score.has_URL != self.new_score.has_URL:
+            changes.append(f'URL:{self.old_score.has_URL} -> {self.new_score.has_URL}')
+        return changes
+
+    @property
+    def notes_may_be_changed(self) -> bool:
+        """
+        譜面自体が変わっている可能性があるか。
+        レベルが変わった場合は譜面も修正されていることがある。
+        """
+        return self.old_score.level != self.new_score.level
+
+@dataclass(frozen=True, slots=True)
+class MusicListDiff:
+    added: list[tuple[iidx.Music, iidx.Score]]
+    removed: list[tuple[iidx.Music, iidx.Score]]
+    changed: list[ChangedScore]
+
+def diff_music_lists(
+    old_musics: list[iidx.Music], new_musics: list[iidx.Music],
+) -> MusicListDiff:
+    """
+    楽曲一覧を譜面単位で比べる。
+    曲名等、譜面データに関わらない項目の違いは無視する。
+    """
+
+    def key(music: iidx.Music, score: iidx.Score) -> tuple[str, iidx.ScoreKind]:
+        return (music.tag, score.kind)
+
+    old_music_scores = {
+        key(music, score): (music, score)
+        for music in old_musics for score in music.scores
+    }
+    new_music_scores = {
+        key(music, score): (music, score)
+        for music in new_musics for score in music.scores
+    }
+
+    added = []
+    changed = []
+    for k, (new_music, new_score) in new_music_scores.items():
+        old = old_music_scores.get(k)
+        if old is None:
+            added.append((new_music, new_score))
+            continue
+
+        change = ChangedScore(old[0], old[1], new_music, new_score)
+        if change.changes():
+            changed.append(change)
+
+    removed = [
+        music_score for k, music_score in old_music_scores.items()
+        if k not in new_music_scores
+    ]
+
+    return MusicListDiff(added, removed, changed)
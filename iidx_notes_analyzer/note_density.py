@@ -0,0 +1,139 @@
+from array import array
+from dataclasses import dataclass
+import math
+from typing import Any, Sequence
+
+from . import chord_cache, iidx, notes_codec, persistence
+from .chord_histogram import np
+from .util import profile
+
+# 譜面の密度。`timing`の幅`window`の窓に入るノーツ数を数える。
+# 窓はノーツのある`timing`毎に、そこから始まるものを考える
+# （最も密な窓は必ずどれかのノーツから始まるので、最大値はこれで求まる）。
+
+PERCENTILES = (50, 90, 99)
+
+@dataclass(frozen=True, slots=True)
+class DensityStats:
+    note_count: int
+    max: int                        # 最も密な窓のノーツ数
+    percentiles: tuple[int, ...]    # 窓毎のノーツ数の`PERCENTILES`パーセンタイル
+
+def percentile(sorted_values: Sequence[int], p: float) -> int:
+    """
+    昇順に並んだ値の`p`パーセンタイル（最近順位法）。値が無ければ0。
+    """
+
+    if len(sorted_values) == 0:
+        return 0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return int(sorted_values[rank - 1])
+
+def _window_counts_numpy(note_codes: array, window: int) -> Any:
+    assert np is not None
+
+    timings = np.frombuffer(note_codes, dtype=np.int64) >> notes_codec.TIMING_SHIFT
+    starts = np.flatnonzero(np.concatenate(([True], timings[1:] != timings[:-1])))
+    # 昇順なので、窓の終わりは二分探索で一度に求まる
+    ends = np.searchsorted(timings, timings[starts] + window, side='left')
+    return np.sort(ends - starts)
+
+def _window_counts_python(note_codes: array, window: int) -> list[int]:
+    timings = [code >> notes_codec.TIMING_SHIFT for code in note_codes]
+    counts = []
+    # 窓の始まりと終わりの2つの位置を、それぞれ前に進めるだけで済む
+    end = 0
+    for start, timing in enumerate(timings):
+        if start > 0 and timings[start - 1] == timing:
+            continue
+        limit = timing + window
+        while end < len(timings) and timings[end] < limit:
+            end += 1
+        counts.append(end - start)
+    counts.sort()
+    return counts
+
+def measure(note_codes: array, window: int) -> DensityStats:
+    """
+    1譜面分のノーツの符号（ソート済み）から密度を求める。
+    """
+
+    if window <= 0:
+        raise ValueError(window)
+
+    if np is not None:
+        counts: Sequence[int] = _window_counts_numpy(note_codes, window)
+    else:
+        counts = _window_counts_python(note_codes, window)
+    return DensityStats(
+        len(note_codes),
+        int(counts[-1]) if len(counts) > 0 else 0,
+        tuple(percentile(counts, p) for p in PERCENTILES),
+    )
+
+def _measure_serially(
+    indexed_music_scores: list[tuple[int, iidx.Music, iidx.Score]], window: int,
+) -> list[tuple[int, DensityStats]]:
+
+    results = []
+    for i, music, score in indexed_music_scores:
+        with profile.phase('notes_load'):
+            note_codes = persistence.load_note_codes(music, score)
+        with profile.phase('density_measurement'):
+            results.append((i, measure(note_codes, window)))
+    return results
+
+def _measure_in_worker(
+    args: tuple[list[tuple[int, iidx.Music, iidx.Score]], int],
+) -> list[tuple[int, DensityStats]]:
+
+    indexed_music_scores, window = args
+    return _measure_serially(indexed_music_scores, window)
+
+def measure_all(
+    music_scores: list[tuple[iidx.Music, iidx.Score]],
+    window: int,
+    jobs: int | None = None,
+) -> list[DensityStats]:
+
+    """
+    譜面毎の密度を`music_scores`の順に返す。
+    `jobs`の扱いは`chord_cache.sum_histograms_by_group`と同じ。
+    """
+
+    if window <= 0:
+        raise ValueError(window)
+    if jobs is None:
+        # ワーカープロセス内は計測できないので、計測中は並列化しない
+        jobs = 1 if profile.is_enabled() else chord_cache.default_jobs(len(music_scores))
+    if jobs < 1:
+        raise ValueError(jobs)
+
+    indexed_music_scores = [
+        (i, music, score) for i, (music, score) in enumerate(music_scores)
+    ]
+    results: dict[int, DensityStats] = {}
+
+    def merge(partial: list[tuple[int, DensityStats]]) -> None:
+        for i, stats in partial:
+            results[i] = stats
+
+    if jobs == 1 or len(music_scores) <= 1:
+        merge(_measure_serially(indexed_music_scores, window))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # 重い譜面が偏っても均されるよう、ワーカー数より細かく分ける
+        chunk_count = min(len(music_scores), jobs * 4)
+        chunks = [
+            (indexed_music_scores[i::chunk_count], window) for i in range(chunk_count)
+        ]
+        with ProcessPoolExecutor(
+            jobs,
+            initializer=chord_cache.init_worker,
+            initargs=(persistence.get_backend().name, persistence.is_paranoid()),
+        ) as executor:
+            for partial in executor.map(_measure_in_worker, chunks):
+                merge(partial)
+
+    return [results[i] for i in range(len(music_scores))]
@@ -0,0 +1,211 @@
+from array import array
+from dataclasses import dataclass
+from itertools import islice
+from operator import le
+import struct
+import sys
+from typing import IO, Iterable, Iterator
+import zlib
+
+from . import iidx
+
+# 譜面のバイナリ形式。
+#   ヘッダー: マジックナンバー(4byte), 形式のバージョン(uint16), フラグ(uint16),
+#             ノーツ数(uint32), 本体のCRC-32(uint32)
+#   本体: ノーツ毎の符号(int64)の配列
+# 数値は全てリトルエンディアン。
+# バージョン1はフラグの所が予約で、CRC-32が無い。
+#
+# フラグのビット0（検証済み）は、書き込み時にノーツが正しく昇順に並んでいるのを
+# 確かめたことを表す。読み込み時はCRC-32さえ合っていればノーツ毎の検証を省ける。
+#
+# ノーツの符号は`timing << 4 | (play_side - 1) << 3 | lane`。
+# laneは鍵盤1〜7を0〜6、皿を7とする。
+# こうすることで、符号の大小関係が`iidx.Note`（タプル）の大小関係と一致する。
+# （文字列としては'1' < ... < '7' < 'S'）
+
+MAGIC = b'IXNT'
+FORMAT_VERSION = 2
+
+_HEADER_V1 = struct.Struct('<4sHHI')
+_HEADER_V2_CRC = struct.Struct('<I')
+HEADER_SIZE = _HEADER_V1.size + _HEADER_V2_CRC.size
+
+FLAG_VALIDATED = 1 << 0
+
+_CODE_TYPECODE = 'q'
+assert array(_CODE_TYPECODE).itemsize == 8
+
+TIMING_SHIFT = 4
+
+_LANES: list[iidx.Lane] = ['1', '2', '3', '4', '5', '6', '7', 'S']
+_LANE_CODES: dict[iidx.Lane, int] = {lane: i for i, lane in enumerate(_LANES)}
+
+def encode_note(note: iidx.Note) -> int:
+    return note.timing << TIMING_SHIFT | (note.play_side - 1) << 3 | _LANE_CODES[note.lane]
+
+def decode_note(code: int) -> iidx.Note:
+    play_side: iidx.PlaySide = 2 if code >> 3 & 1 else 1
+    return iidx.Note(code >> TIMING_SHIFT, play_side, _LANES[code & 7])
+
+def encode(notes: Iterable[iidx.Note]) -> bytes:
+    """
+    ノーツのプレイサイド・レーンが不正なら`ValueError`。
+    昇順に並んでいれば検証済みとして書き込む。
+    """
+
+    codes = array(_CODE_TYPECODE)
+    for note in notes:
+        if note.timing < 0:
+            raise ValueError(note)
+        if not iidx.is_valid_for_play_side(note.play_side):
+            raise ValueError(note)
+        if note.lane not in _LANE_CODES:
+            raise ValueError(note)
+        codes.append(encode_note(note))
+    return encode_codes(codes, codes_are_sorted(codes))
+
+def encode_codes(codes: array, validated: bool = False) -> bytes:
+    flags = FLAG_VALIDATED if validated else 0
+    if sys.byteorder != 'little':
+        codes = array(_CODE_TYPECODE, codes)
+        codes.byteswap()
+    body = codes.tobytes()
+    header = _HEADER_V1.pack(MAGIC, FORMAT_VERSION, flags, len(codes)) +\
+        _HEADER_V2_CRC.pack(zlib.crc32(body))
+    return header + body
+
+@dataclass(frozen=True, slots=True)
+class _Header:
+    version: int
+    count: int
+    validated: bool
+    crc: int | None     # バージョン1には無い
+
+    def trusts(self, paranoid: bool) -> bool:
+        """
+        CRC-32が合っていれば、ノーツ毎の検証を省いて良いか。
+        """
+        return self.validated and self.crc is not None and not paranoid
+
+def _unpack_header(data: bytes) -> tuple[_Header, int]:
+    """
+    ヘッダーと、その長さを返す。
+    """
+
+    if len(data) < _HEADER_V1.size:
+        raise ValueError('too short header')
+    magic, version, flags, count = _HEADER_V1.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('unknown magic number: ' + repr(magic))
+
+    match version:
+        case 1:
+            return _Header(version, count, False, None), _HEADER_V1.size
+        case 2:
+            if len(data) < HEADER_SIZE:
+                raise ValueError('too short header')
+            (crc,) = _HEADER_V2_CRC.unpack_from(data, _HEADER_V1.size)
+            validated = flags & FLAG_VALIDATED != 0
+            return _Header(version, count, validated, crc), HEADER_SIZE
+        case _:
+            raise ValueError('unsupported format version: ' + str(version))
+
+def _read_header(f: IO[bytes]) -> _Header:
+    data = f.read(_HEADER_V1.size)
+    if len(data) == _HEADER_V1.size and _HEADER_V1.unpack(data)[1] >= 2:
+        data += f.read(_HEADER_V2_CRC.size)
+    header, _ = _unpack_header(data)
+    return header
+
+def _check_crc(header: _Header, crc: int) -> None:
+    if header.crc is not None and header.crc != crc:
+        raise ValueError('checksum mismatch')
+
+def read_format_version(f: IO[bytes]) -> int:
+    return _read_header(f).version
+
+def read_codes(f: IO[bytes], paranoid: bool = False) -> array:
+    """
+    バイナリ形式の譜面ファイルからノーツの符号の配列を読み込む。
+    ファイルの中身を配列のバッファへ直接読み込むので、
+    コピーはほぼ1回で済む。
+    CRC-32は常に確かめる。ノーツが昇順に並んでいるかは、
+    検証済みの譜面なら確かめない（`paranoid`がTrueなら確かめる）。
+    """
+
+    header = _read_header(f)
+
+    codes = array(_CODE_TYPECODE)
+    try:
+        codes.fromfile(f, header.count)
+    except EOFError:
+        raise ValueError('too short body')
+    if f.read(1):
+        raise ValueError('too long body')
+    _check_crc(header, zlib.crc32(codes))
+
+    if sys.byteorder != 'little':
+        codes.byteswap()
+    if not header.trusts(paranoid):
+        assert codes_are_sorted(codes)
+    return codes
+
+def iter_code_chunks(
+    f: IO[bytes], chunk_size: int = 1 << 14, paranoid: bool = False,
+) -> Iterator[array]:
+
+    """
+    `read_codes`の逐次版。ノーツの符号を`chunk_size`個ずつの配列で返す。
+    ノーツが昇順に並んでいるかを確かめる場合は、読んだ分だけ順に確かめる。
+    CRC-32は全部読み終えてから確かめるので、合わなければ最後に`ValueError`となる。
+    """
+
+    header = _read_header(f)
+    checks_order = not header.trusts(paranoid)
+
+    crc = 0
+    last_code: int | None = None
+    remaining = header.count
+    while remaining > 0:
+        codes = array(_CODE_TYPECODE)
+        try:
+            codes.fromfile(f, min(remaining, chunk_size))
+        except EOFError:
+            raise ValueError('too short body')
+        remaining -= len(codes)
+        crc = zlib.crc32(codes, crc)
+
+        if sys.byteorder != 'little':
+            codes.byteswap()
+        if checks_order:
+            assert last_code is None or last_code <= codes[0]
+            assert codes_are_sorted(codes)
+            last_code = codes[-1]
+        yield codes
+
+    if f.read(1):
+        raise ValueError('too long body')
+    _check_crc(header, crc)
+
+def decode_codes(data: bytes, paranoid: bool = False) -> array:
+    header, header_size = _unpack_header(data)
+
+    body = memoryview(data)[header_size:]
+    codes = array(_CODE_TYPECODE)
+    codes.frombytes(body)
+    if len(codes) != header.count:
+        raise ValueError('body size mismatch')
+    _check_crc(header, zlib.crc32(body))
+
+    if sys.byteorder != 'little':
+        codes.byteswap()
+    if not header.trusts(paranoid):
+        assert codes_are_sorted(codes)
+    return codes
+
+def decode(data: bytes) -> list[iidx.Note]:
+    return [decode_note(code) for code in decode_codes(data)]
+
+def codes_are_sorted(codes: array) -> bool:
+    return all(map(le, codes, islice(codes, 1, None)))
@@ -1,14 +1,21 @@
-from abc import ABC
+from abc import ABC, abstractmethod
+from array import array
 from dataclasses import dataclass
 import json
+import marshal
 import os
-from typing import Iterator, Literal
+import struct
+from typing import TYPE_CHECKING, ClassVar, Iterator, Literal
 
-from . import iidx
+from . import iidx, notes_codec
 from .util import pjson, util
 
+if TYPE_CHECKING:
+    from .catalog import Catalog
+
 _DATA_DIR_PATH = 'data'
 _MUSICS_FILE_PATH = os.path.join(_DATA_DIR_PATH, 'musics.json')
+_SQLITE_FILE_PATH = os.path.join(_DATA_DIR_PATH, 'iidx.sqlite3')
 
 HasURLFilter = bool | None
 
@@ -109,8 +116,8 @@ class ScoreFilter:
     difficulty: DifficultyFilter = ''
     level: LevelFilter = LevelFilterAll()
 
-def _match_version_filter(
-    music: iidx.Music,
+def match_version_filter(
+    version: iidx.Version,
     cond: VersionFilter,
 ) -> bool:
 
@@ -119,20 +126,20 @@ def _match_version_filter(
             return True
 
         case VersionFilterSingle():
-            return music.version == cond.value
+            return version == cond.value
 
         case VersionFilterRange():
-            if not isinstance(music.version, iidx.VersionAC):
+            if not isinstance(version, iidx.VersionAC):
                 return False
-            match_start = cond.start is None or music.version >= cond.start
-            match_end = cond.end is None or music.version <= cond.end
+            match_start = cond.start is None or version >= cond.start
+            match_end = cond.end is None or version <= cond.end
             return match_start and match_end
 
         case _:
             raise ValueError('unexpected type: ' + str(type(cond)))
 
-def _match_level_filter(
-    score: iidx.Score,
+def match_level_filter(
+    level: iidx.Level,
     cond: LevelFilter,
 ) -> bool:
 
@@ -141,114 +148,915 @@ def _match_level_filter(
             return True
 
         case LevelFilterSingle():
-            return score.level == cond.value
+            return level == cond.value
 
         case LevelFilterRange():
-            match_start = cond.start is None or score.level >= cond.start
-            match_end = cond.end is None or score.level <= cond.end
+            match_start = cond.start is None or level >= cond.start
+            match_end = cond.end is None or level <= cond.end
             return match_start and match_end
 
         case _:
             raise ValueError('unexpected type: ' + str(type(cond)))
 
-def save_musics(musics: list[iidx.Music], overwrites: bool = False):
-    os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+@dataclass(frozen=True, slots=True)
+class SavedNotes:
+    """
+    保存済みの譜面データの概要。
+    """
 
-    if not overwrites and os.path.exists(_MUSICS_FILE_PATH):
-        raise FileExistsError(_MUSICS_FILE_PATH)
+    play_mode: iidx.PlayMode
+    version_code: str
+    music_tag: str
+    difficulty: iidx.Difficulty
+    size: int
 
-    dict_musics = [music.as_dict() for music in musics]
-    with util.make_file_atomically(_MUSICS_FILE_PATH) as f:
-        pjson.dump(dict_musics, f, ensure_ascii=False)
+class Backend(ABC):
+    """
+    楽曲一覧と譜面データの保存先。
+    """
 
-def load_musics(filter: ScoreFilter) -> Iterator[tuple[iidx.Music, iidx.Score]]:
-    with open(_MUSICS_FILE_PATH) as f:
-        raw_musics = json.load(f)
-        assert isinstance(raw_musics, list)
-        assert util.is_list_of_dict(raw_musics)
-        assert util.is_list_of_str_dict(raw_musics)
-
-    all_musics = (iidx.Music.from_dict(raw_music) for raw_music in raw_musics)
-    target_musics = (
-        music for music in all_musics
-        if _match_version_filter(music, filter.version)
-        if not filter.music_tag or music.tag == filter.music_tag
-    )
-    for music in target_musics:
-        target_scores = (
-            score for score in music.scores
-            if filter.has_URL is None or score.has_URL == filter.has_URL
-            if not filter.play_mode or score.kind.play_mode == filter.play_mode
-            if not filter.difficulty or score.kind.difficulty == filter.difficulty
-            if _match_level_filter(score, filter.level)
-        )
-        for score in target_scores:
-            yield (music, score)
+    name: ClassVar[str]
+
+    @abstractmethod
+    def save_musics(self, musics: list[iidx.Music], overwrites: bool = False) -> None:
+        pass
+
+    @abstractmethod
+    def load_all_musics(self) -> list[iidx.Music]:
+        pass
+
+    def load_catalog(self) -> 'Catalog':
+        from .catalog import Catalog
+        return Catalog(self.load_all_musics())
+
+    @abstractmethod
+    def load_musics(
+        self, filter: ScoreFilter,
+    ) -> Iterator[tuple[iidx.Music, iidx.Score]]:
+        pass
+
+    @abstractmethod
+    def has_saved_notes(self, music: iidx.Music, score: iidx.Score) -> bool:
+        pass
+
+    @abstractmethod
+    def save_notes(
+        self, music: iidx.Music, score: iidx.Score, notes: list[iidx.Note],
+        overwrites: bool = False,
+    ) -> None:
+        """
+        保存し直した譜面データは古い（`mark_notes_stale`）扱いでなくなる。
+        """
+        pass
+
+    @abstractmethod
+    def mark_notes_stale(self, music: iidx.Music, score: iidx.Score) -> None:
+        """
+        保存済みの譜面データを、取り直すべき古いものとして扱う。
+        """
+        pass
+
+    @abstractmethod
+    def notes_are_stale(self, music: iidx.Music, score: iidx.Score) -> bool:
+        pass
+
+    @abstractmethod
+    def iter_saved_notes(self) -> Iterator[SavedNotes]:
+        """
+        保存済みの全譜面データの概要を返す（順不同）。
+        """
+        pass
+
+    @abstractmethod
+    def load_note_codes(self, music: iidx.Music, score: iidx.Score) -> array:
+        """
+        譜面をノーツの符号（`notes_codec`参照）の配列として読み込む。
+        `iidx.Note`を組み立てない分、`load_notes`より速い。
+        """
+        pass
+
+    def load_notes(
+        self, music: iidx.Music, score: iidx.Score,
+    ) -> Iterator[iidx.Note]:
+
+        yield from map(notes_codec.decode_note, self.load_note_codes(music, score))
+
+    def load_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str,
+    ) -> bytes | None:
+        """
+        譜面データから導出したデータ（キャッシュ）を読み込む。
+        保存されていない場合や、譜面データが更新されて古くなっている場合は`None`。
+        """
+        return None
+
+    def save_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str, data: bytes,
+    ) -> None:
+        """
+        譜面データから導出したデータ（キャッシュ）を保存する。
+        キャッシュなので、書き込みの永続性は保証しなくて良い。
+        """
+        pass
+
+    def load_aggregate(self, name: str) -> bytes | None:
+        """
+        複数の譜面データから導出したデータ（キャッシュ）を読み込む。
+        保存されていない場合は`None`。
+        """
+        return None
+
+    def save_aggregate(self, name: str, data: bytes) -> None:
+        pass
+
+    def refresh(self) -> None:
+        """
+        読み込み済みの一覧等に、他のプロセスが保存した分を反映する。
+        長く動かし続けるプロセス（`serve`）用。
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+def _get_notes_root_dir_path() -> str:
+    return os.path.join(_DATA_DIR_PATH, 'notes')
 
 def _get_notes_dir_path(play_mode: iidx.PlayMode, version: iidx.Version) -> str:
-    return os.path.join(_DATA_DIR_PATH, 'notes', play_mode, version.code)
+    return os.path.join(_get_notes_root_dir_path(), play_mode, version.code)
+
+# 譜面ファイルはバイナリ形式（`notes_codec`）で保存する。
+# 以前はJSON形式で保存していたので、そちらも読み込めるようにしておく。
+_NOTES_FILE_EXT = '.bin'
+_LEGACY_NOTES_FILE_EXT = '.json'
 
 def _get_notes_file_path(
     play_mode: iidx.PlayMode, version: iidx.Version,
     music_tag: str, difficulty: iidx.Difficulty,
+    ext: str = _NOTES_FILE_EXT,
 ) -> str:
 
     dir = _get_notes_dir_path(play_mode, version)
-    filename = f'{music_tag}({difficulty}).json'
+    filename = f'{music_tag}({difficulty}){ext}'
     return os.path.join(dir, filename)
 
-def has_saved_notes(music: iidx.Music, score: iidx.Score) -> bool:
-    file_path = _get_notes_file_path(
-        score.kind.play_mode, music.version, music.tag, score.kind.difficulty
+def _iter_legacy_notes(file_path: str) -> Iterator[iidx.Note]:
+    """
+    JSON形式の譜面ファイルを先頭から少しずつ読み、ノーツを順に返す。
+    """
+
+    last_note: iidx.Note | None = None
+    with open(file_path) as f:
+        for raw_note in util.iter_json_array(f):
+            assert isinstance(raw_note, list)
+            assert len(raw_note) == 3
+
+            timing = raw_note[0]
+            assert isinstance(timing, int)
+            play_side = raw_note[1]
+            assert isinstance(play_side, int)
+            assert iidx.is_valid_for_play_side(play_side)
+            lane = raw_note[2]
+            assert isinstance(lane, str)
+            assert iidx.is_valid_for_lane(lane)
+
+            note = iidx.Note(timing, play_side, lane)
+            assert last_note is None or last_note <= note
+            last_note = note
+            yield note
+
+def _load_legacy_notes(file_path: str) -> list[iidx.Note]:
+    return list(_iter_legacy_notes(file_path))
+
+# 導出データのファイルのヘッダー。
+# 導出元の譜面ファイルのサイズと更新日時を持ち、古くなっていないかの判定に使う。
+_DERIVED_HEADER = struct.Struct('<4sHHqq')
+_DERIVED_MAGIC = b'IXDV'
+_DERIVED_FORMAT_VERSION = 1
+
+def _get_derived_file_path(
+    music: iidx.Music, score: iidx.Score, kind: str,
+) -> str:
+
+    if not kind.isalnum():
+        raise ValueError(kind)
+    ext = '.' + kind
+    if ext in [_NOTES_FILE_EXT, _LEGACY_NOTES_FILE_EXT]:
+        raise ValueError(kind)
+
+    return _get_notes_file_path(
+        score.kind.play_mode, music.version, music.tag, score.kind.difficulty,
+        ext,
     )
-    return os.path.exists(file_path)
+
+def _get_file_stamp(file_path: str) -> tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+# 楽曲一覧のスナップショットのヘッダー。
+# 元の`musics.json`のサイズと更新日時を持ち、古くなっていないかの判定に使う。
+_CATALOG_SNAPSHOT_FILE_PATH = os.path.join(_DATA_DIR_PATH, 'musics.snapshot')
+_CATALOG_SNAPSHOT_HEADER = struct.Struct('<4sHHqq')
+_CATALOG_SNAPSHOT_MAGIC = b'IXCT'
+_CATALOG_SNAPSHOT_FORMAT_VERSION = 1
+
+def _load_catalog_snapshot(musics_stamp: tuple[int, int]) -> 'Catalog | None':
+    from .catalog import Catalog
+
+    try:
+        with open(_CATALOG_SNAPSHOT_FILE_PATH, 'rb') as f:
+            header = f.read(_CATALOG_SNAPSHOT_HEADER.size)
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(header) != _CATALOG_SNAPSHOT_HEADER.size:
+        return None
+    magic, version, _, musics_size, musics_mtime_ns =\
+        _CATALOG_SNAPSHOT_HEADER.unpack(header)
+    if magic != _CATALOG_SNAPSHOT_MAGIC:
+        return None
+    if version != _CATALOG_SNAPSHOT_FORMAT_VERSION:
+        return None
+    if (musics_size, musics_mtime_ns) != musics_stamp:
+        return None
+
+    try:
+        return Catalog.from_snapshot(data)
+    except ValueError:
+        return None
+
+def _save_catalog_snapshot(
+    musics_stamp: tuple[int, int], catalog: 'Catalog',
+) -> None:
+
+    header = _CATALOG_SNAPSHOT_HEADER.pack(
+        _CATALOG_SNAPSHOT_MAGIC, _CATALOG_SNAPSHOT_FORMAT_VERSION, 0,
+        *musics_stamp,
+    )
+    with util.make_binary_file_atomically(
+        _CATALOG_SNAPSHOT_FILE_PATH, syncs=False,
+    ) as f:
+        f.write(header)
+        f.write(catalog.to_snapshot())
+
+def _load_note_codes(file_path: str) -> array:
+    with open(file_path, 'rb') as f:
+        return notes_codec.read_codes(f, paranoid=_paranoid)
+
+def _iter_notes(file_path: str) -> Iterator[iidx.Note]:
+    with open(file_path, 'rb') as f:
+        for codes in notes_codec.iter_code_chunks(f, paranoid=_paranoid):
+            yield from map(notes_codec.decode_note, codes)
+
+# 保存済みの譜面ファイルの一覧（マニフェスト）。
+# 譜面毎にファイルの有無を調べるとネットワーク越しのファイルシステム等では遅いので、
+# `os.scandir`で作った一覧を保存しておき、更新日時が変わったフォルダだけ調べ直す。
+_NOTES_MANIFEST_FILE_PATH = os.path.join(_DATA_DIR_PATH, 'notes.manifest')
+_NOTES_MANIFEST_FORMAT_VERSION = 1
+
+# 取り直すべき古い譜面データの一覧（`Backend.mark_notes_stale`）。
+# `(プレイモード, バージョン, 曲のタグ, 難易度)`のリストをJSONで保存する。
+_STALE_NOTES_FILE_PATH = os.path.join(_DATA_DIR_PATH, 'stale_notes.json')
+
+class _NotesManifest:
+    # フォルダの相対パス（`notes`フォルダ自身は''）-> 更新日時
+    _dir_mtimes: dict[str, int]
+    # 譜面のフォルダの相対パス -> `<曲のタグ>(<難易度>)` -> (拡張子, ファイルサイズ)
+    _files: dict[str, dict[str, tuple[str, int]]]
+    _modified: bool
+
+    def __init__(self) -> None:
+        self._dir_mtimes = {}
+        self._files = {}
+        self._modified = False
+
+    @classmethod
+    def load(cls) -> '_NotesManifest':
+        manifest = cls()
+        try:
+            with open(_NOTES_MANIFEST_FILE_PATH, 'rb') as f:
+                raw = marshal.load(f)
+            format_version, dir_mtimes, files = raw
+            if format_version != _NOTES_MANIFEST_FORMAT_VERSION:
+                raise ValueError(format_version)
+            assert isinstance(dir_mtimes, dict)
+            assert isinstance(files, dict)
+        except FileNotFoundError:
+            pass
+        except (EOFError, ValueError, TypeError, AssertionError):
+            # 壊れていたら全て調べ直す
+            manifest._modified = True
+        else:
+            manifest._dir_mtimes = dir_mtimes
+            manifest._files = files
+        return manifest
+
+    def save(self) -> None:
+        if not self._modified:
+            return
+        os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+        with util.make_binary_file_atomically(
+            _NOTES_MANIFEST_FILE_PATH, syncs=False,
+        ) as f:
+            marshal.dump(
+                (_NOTES_MANIFEST_FORMAT_VERSION, self._dir_mtimes, self._files), f,
+            )
+        self._modified = False
+
+    def refresh(self) -> None:
+        """
+        フォルダの更新日時を確かめ、変わっていれば調べ直す。
+        """
+
+        root_dir = _get_notes_root_dir_path()
+
+        def get_mtime(rel_dir: str) -> int | None:
+            try:
+                return os.stat(os.path.join(root_dir, rel_dir)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+
+        def list_sub_dirs(rel_dir: str) -> list[str]:
+            with os.scandir(os.path.join(root_dir, rel_dir)) as entries:
+                return [entry.name for entry in entries if entry.is_dir()]
+
+        def forget(rel_dir: str) -> None:
+            for key in [
+                key for key in self._dir_mtimes
+                if key == rel_dir or key.startswith(rel_dir + '/')
+            ]:
+                del self._dir_mtimes[key]
+            self._files.pop(rel_dir, None)
+            self._modified = True
+
+        def known_sub_dirs(rel_dir: str) -> list[str]:
+            prefix = rel_dir + '/' if rel_dir else ''
+            return [
+                key.removeprefix(prefix) for key in self._dir_mtimes
+                if key.startswith(prefix) and key != rel_dir
+                if '/' not in key.removeprefix(prefix)
+            ]
+
+        root_mtime = get_mtime('')
+        if root_mtime is None:
+            if self._dir_mtimes:
+                self._dir_mtimes = {}
+                self._files = {}
+                self._modified = True
+            return
+
+        # `notes/<プレイモード>/<バージョン>/`の3階層
+        play_modes = known_sub_dirs('')
+        if self._dir_mtimes.get('') != root_mtime:
+            play_modes = [
+                name for name in list_sub_dirs('')
+                if iidx.is_valid_for_play_mode(name)
+            ]
+            for name in known_sub_dirs(''):
+                if name not in play_modes:
+                    forget(name)
+            self._dir_mtimes[''] = root_mtime
+            self._modified = True
+
+        for play_mode in play_modes:
+            mode_mtime = get_mtime(play_mode)
+            if mode_mtime is None:
+                forget(play_mode)
+                continue
+
+            version_codes = known_sub_dirs(play_mode)
+            if self._dir_mtimes.get(play_mode) != mode_mtime:
+                version_codes = [
+                    name for name in list_sub_dirs(play_mode)
+                    if iidx.VersionAC.code_is_valid(name)
+                    or iidx.VersionCSOnly.code_is_valid(name)
+                ]
+                for name in known_sub_dirs(play_mode):
+                    if name not in version_codes:
+                        forget(f'{play_mode}/{name}')
+                self._dir_mtimes[play_mode] = mode_mtime
+                self._modified = True
+
+            for version_code in version_codes:
+                rel_dir = f'{play_mode}/{version_code}'
+                dir_mtime = get_mtime(rel_dir)
+                if dir_mtime is None:
+                    forget(rel_dir)
+                elif self._dir_mtimes.get(rel_dir) != dir_mtime:
+                    self._files[rel_dir] = self._scan_notes_dir(rel_dir)
+                    self._dir_mtimes[rel_dir] = dir_mtime
+                    self._modified = True
+
+    def _scan_notes_dir(self, rel_dir: str) -> dict[str, tuple[str, int]]:
+        files: dict[str, tuple[str, int]] = {}
+        dir = os.path.join(_get_notes_root_dir_path(), rel_dir)
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext not in [_NOTES_FILE_EXT, _LEGACY_NOTES_FILE_EXT]:
+                    continue
+                # 両方ある場合はバイナリ形式の方を正とする
+                if ext == _LEGACY_NOTES_FILE_EXT and stem in files:
+                    continue
+                if not entry.is_file():
+                    continue
+                files[stem] = (ext, entry.stat().st_size)
+        return files
+
+    def find(
+        self,
+        play_mode: iidx.PlayMode, version: iidx.Version,
+        music_tag: str, difficulty: iidx.Difficulty,
+    ) -> str | None:
+        """
+        譜面ファイルの拡張子を返す。保存されていなければ`None`。
+        """
+
+        files = self._files.get(f'{play_mode}/{version.code}')
+        if files is None:
+            return None
+        entry = files.get(f'{music_tag}({difficulty})')
+        if entry is None:
+            return None
+        return entry[0]
+
+    def add(
+        self,
+        play_mode: iidx.PlayMode, version: iidx.Version,
+        music_tag: str, difficulty: iidx.Difficulty,
+        ext: str, size: int,
+    ) -> None:
+        """
+        自分で保存した譜面ファイルを反映する。
+        フォルダの更新日時も取り直して、次回に調べ直さなくて済むようにする。
+        """
+
+        rel_dir = f'{play_mode}/{version.code}'
+        self._files.setdefault(rel_dir, {})[f'{music_tag}({difficulty})'] =\
+            (ext, size)
+
+        root_dir = _get_notes_root_dir_path()
+        for key in ['', play_mode, rel_dir]:
+            self._dir_mtimes[key] = os.stat(os.path.join(root_dir, key)).st_mtime_ns
+        self._modified = True
+
+    def __iter__(self) -> Iterator[SavedNotes]:
+        for rel_dir, files in self._files.items():
+            play_mode, version_code = rel_dir.split('/')
+            assert iidx.is_valid_for_play_mode(play_mode)
+            for stem, (_, size) in files.items():
+                music_tag, _, difficulty = stem.removesuffix(')').rpartition('(')
+                if not iidx.is_valid_for_difficulty(difficulty):
+                    continue
+                yield SavedNotes(play_mode, version_code, music_tag, difficulty, size)
+
+class FileBackend(Backend):
+    """
+    `data`フォルダ下に、楽曲一覧を1つのJSONファイル、譜面を1譜面1ファイルで保存する。
+    """
+
+    name = 'file'
+
+    _catalog: 'Catalog | None'
+    _catalog_stamp: tuple[int, int] | None
+    _notes_manifest: _NotesManifest | None
+    _stale_notes: set[tuple[str, str, str, str]] | None
+
+    def __init__(self) -> None:
+        self._catalog = None
+        self._catalog_stamp = None
+        self._notes_manifest = None
+        self._stale_notes = None
+
+    def close(self) -> None:
+        if self._notes_manifest is None:
+            return
+        self._notes_manifest.save()
+        self._notes_manifest = None
+
+    def refresh(self) -> None:
+        # 楽曲一覧は読み込む度に更新日時を確かめているので、それ以外を調べ直す
+        if self._notes_manifest is not None:
+            self._notes_manifest.refresh()
+        self._stale_notes = None
+
+    @property
+    def _manifest(self) -> _NotesManifest:
+        # 同じプロセス内では、自分で保存した分を反映していくので調べ直さない
+        if self._notes_manifest is None:
+            manifest = _NotesManifest.load()
+            manifest.refresh()
+            manifest.save()
+            self._notes_manifest = manifest
+        return self._notes_manifest
+
+    def _find_notes_file_path(
+        self, music: iidx.Music, score: iidx.Score,
+    ) -> str | None:
+
+        ext = self._manifest.find(
+            score.kind.play_mode, music.version, music.tag, score.kind.difficulty,
+        )
+        if ext is None:
+            return None
+        return _get_notes_file_path(
+            score.kind.play_mode, music.version, music.tag, score.kind.difficulty,
+            ext,
+        )
+
+    def save_musics(self, musics: list[iidx.Music], overwrites: bool = False) -> None:
+        os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+
+        if not overwrites and os.path.exists(_MUSICS_FILE_PATH):
+            raise FileExistsError(_MUSICS_FILE_PATH)
+
+        dict_musics = [music.as_dict() for music in musics]
+        with util.make_file_atomically(_MUSICS_FILE_PATH) as f:
+            pjson.dump(dict_musics, f, ensure_ascii=False)
+
+    def load_all_musics(self) -> list[iidx.Music]:
+        return self.load_catalog().musics
+
+    def load_catalog(self) -> 'Catalog':
+        """
+        楽曲一覧を索引付きで読み込む。
+        `musics.json`を解析し直さなくて済むよう、横にスナップショットを保存しておく。
+        """
+
+        from .catalog import Catalog
+
+        stamp = _get_file_stamp(_MUSICS_FILE_PATH)
+        if self._catalog is not None and self._catalog_stamp == stamp:
+            return self._catalog
+
+        catalog = _load_catalog_snapshot(stamp)
+        if catalog is None:
+            with open(_MUSICS_FILE_PATH) as f:
+                raw_musics = json.load(f)
+                assert isinstance(raw_musics, list)
+                assert util.is_list_of_dict(raw_musics)
+                assert util.is_list_of_str_dict(raw_musics)
+
+            musics = [iidx.Music.from_dict(raw_music) for raw_music in raw_musics]
+            catalog = Catalog(musics)
+            _save_catalog_snapshot(stamp, catalog)
+
+        self._catalog = catalog
+        self._catalog_stamp = stamp
+        return catalog
+
+    def load_musics(
+        self, filter: ScoreFilter,
+    ) -> Iterator[tuple[iidx.Music, iidx.Score]]:
+
+        yield from self.load_catalog().query(filter)
+
+    def has_saved_notes(self, music: iidx.Music, score: iidx.Score) -> bool:
+        return self._find_notes_file_path(music, score) is not None
+
+    def save_notes(
+        self, music: iidx.Music, score: iidx.Score, notes: list[iidx.Note],
+        overwrites: bool = False,
+    ) -> None:
+
+        os.makedirs(
+            _get_notes_dir_path(score.kind.play_mode, music.version),
+            exist_ok=True,
+        )
+
+        existing_file_path = self._find_notes_file_path(music, score)
+        if existing_file_path is not None and not overwrites:
+            raise FileExistsError(existing_file_path)
+
+        file_path = _get_notes_file_path(
+            score.kind.play_mode, music.version, music.tag, score.kind.difficulty
+        )
+        notes.sort()
+        data = notes_codec.encode(notes)
+        with util.make_binary_file_atomically(file_path) as f:
+            f.write(data)
+        # JSON形式の古い譜面ファイルが残っていると紛らわしいので消す
+        if existing_file_path is not None and existing_file_path != file_path:
+            os.remove(existing_file_path)
+
+        self._manifest.add(
+            score.kind.play_mode, music.version, music.tag, score.kind.difficulty,
+            _NOTES_FILE_EXT, len(data),
+        )
+
+        key = self._notes_key(music, score)
+        stale_notes = self._load_stale_notes()
+        if key in stale_notes:
+            stale_notes.remove(key)
+            self._save_stale_notes()
+
+    def _notes_key(
+        self, music: iidx.Music, score: iidx.Score,
+    ) -> tuple[str, str, str, str]:
+
+        return (
+            score.kind.play_mode, music.version.code,
+            music.tag, score.kind.difficulty,
+        )
+
+    def _load_stale_notes(self) -> set[tuple[str, str, str, str]]:
+        if self._stale_notes is None:
+            try:
+                with open(_STALE_NOTES_FILE_PATH) as f:
+                    raw_stale_notes = json.load(f)
+                    assert isinstance(raw_stale_notes, list)
+                    assert util.is_list_of_list(raw_stale_notes)
+            except FileNotFoundError:
+                raw_stale_notes = []
+            self._stale_notes = {
+                (play_mode, version, music_tag, difficulty)
+                for play_mode, version, music_tag, difficulty in raw_stale_notes
+            }
+        return self._stale_notes
+
+    def _save_stale_notes(self) -> None:
+        os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+        with util.make_file_atomically(_STALE_NOTES_FILE_PATH) as f:
+            json.dump(sorted(self._load_stale_notes()), f)
+
+    def mark_notes_stale(self, music: iidx.Music, score: iidx.Score) -> None:
+        if not self.has_saved_notes(music, score):
+            raise FileNotFoundError(
+                _get_notes_file_path(
+                    score.kind.play_mode, music.version, music.tag, score.kind.difficulty
+                )
+            )
+        self._load_stale_notes().add(self._notes_key(music, score))
+        self._save_stale_notes()
+
+    def notes_are_stale(self, music: iidx.Music, score: iidx.Score) -> bool:
+        return self._notes_key(music, score) in self._load_stale_notes()
+
+    def iter_saved_notes(self) -> Iterator[SavedNotes]:
+        return iter(self._manifest)
+
+    def _find_existing_notes_file_path(
+        self, music: iidx.Music, score: iidx.Score,
+    ) -> str:
+
+        file_path = self._find_notes_file_path(music, score)
+        if file_path is None:
+            raise FileNotFoundError(
+                _get_notes_file_path(
+                    score.kind.play_mode, music.version, music.tag, score.kind.difficulty
+                )
+            )
+        return file_path
+
+    def load_note_codes(self, music: iidx.Music, score: iidx.Score) -> array:
+        file_path = self._find_existing_notes_file_path(music, score)
+        if file_path.endswith(_LEGACY_NOTES_FILE_EXT):
+            notes = _load_legacy_notes(file_path)
+            return array('q', map(notes_codec.encode_note, notes))
+        return _load_note_codes(file_path)
+
+    def load_notes(
+        self, music: iidx.Music, score: iidx.Score,
+    ) -> Iterator[iidx.Note]:
+
+        # 大きな譜面でも全体を読み込まず、読んだ分から順に返す
+        file_path = self._find_existing_notes_file_path(music, score)
+        if file_path.endswith(_LEGACY_NOTES_FILE_EXT):
+            yield from _iter_legacy_notes(file_path)
+        else:
+            yield from _iter_notes(file_path)
+
+    def load_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str,
+    ) -> bytes | None:
+
+        notes_file_path = self._find_notes_file_path(music, score)
+        if notes_file_path is None:
+            return None
+
+        try:
+            with open(_get_derived_file_path(music, score, kind), 'rb') as f:
+                header = f.read(_DERIVED_HEADER.size)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(header) != _DERIVED_HEADER.size:
+            return None
+        magic, version, _, notes_size, notes_mtime_ns =\
+            _DERIVED_HEADER.unpack(header)
+        if magic != _DERIVED_MAGIC or version != _DERIVED_FORMAT_VERSION:
+            return None
+        if (notes_size, notes_mtime_ns) != _get_file_stamp(notes_file_path):
+            return None
+        return data
+
+    def save_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str, data: bytes,
+    ) -> None:
+
+        notes_file_path = self._find_existing_notes_file_path(music, score)
+        notes_size, notes_mtime_ns = _get_file_stamp(notes_file_path)
+        header = _DERIVED_HEADER.pack(
+            _DERIVED_MAGIC, _DERIVED_FORMAT_VERSION, 0,
+            notes_size, notes_mtime_ns,
+        )
+
+        file_path = _get_derived_file_path(music, score, kind)
+        with util.make_binary_file_atomically(file_path, syncs=False) as f:
+            f.write(header)
+            f.write(data)
+
+    def _get_aggregate_file_path(self, name: str) -> str:
+        if os.path.basename(name) != name or name == 'musics.json':
+            raise ValueError(name)
+        return os.path.join(_DATA_DIR_PATH, name)
+
+    def load_aggregate(self, name: str) -> bytes | None:
+        try:
+            with open(self._get_aggregate_file_path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_aggregate(self, name: str, data: bytes) -> None:
+        os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+        file_path = self._get_aggregate_file_path(name)
+        with util.make_binary_file_atomically(file_path, syncs=False) as f:
+            f.write(data)
+
+def get_work_file_path(file_name: str) -> str:
+    """
+    保存先に依らず`data`フォルダに置く、作業用のファイルのパス。
+    """
+
+    if os.path.basename(file_name) != file_name:
+        raise ValueError(file_name)
+    os.makedirs(_DATA_DIR_PATH, exist_ok=True)
+    return os.path.join(_DATA_DIR_PATH, file_name)
+
+def open_backend(name: str) -> Backend:
+    match name:
+        case FileBackend.name:
+            return FileBackend()
+        case 'sqlite':
+            from .persistence_sqlite import SQLiteBackend
+            return SQLiteBackend(_SQLITE_FILE_PATH)
+        case _:
+            raise ValueError('unknown backend: ' + name)
+
+BACKEND_NAMES = ['file', 'sqlite']
+
+_backend: Backend = FileBackend()
+
+def get_backend() -> Backend:
+    return _backend
+
+def use_backend(backend: Backend) -> None:
+    global _backend
+    _backend.close()
+    _backend = backend
+
+# Trueなら、保存時に検証済みの譜面データも読み込み時に全て検証し直す
+_paranoid = False
+
+def is_paranoid() -> bool:
+    return _paranoid
+
+def set_paranoid(paranoid: bool) -> None:
+    global _paranoid
+    _paranoid = paranoid
+
+def save_musics(musics: list[iidx.Music], overwrites: bool = False) -> None:
+    _backend.save_musics(musics, overwrites=overwrites)
+
+def load_musics(filter: ScoreFilter) -> Iterator[tuple[iidx.Music, iidx.Score]]:
+    return _backend.load_musics(filter)
+
+def load_all_musics() -> list[iidx.Music]:
+    return _backend.load_all_musics()
+
+def load_catalog() -> 'Catalog':
+    return _backend.load_catalog()
+
+def refresh() -> None:
+    _backend.refresh()
+
+def has_saved_notes(music: iidx.Music, score: iidx.Score) -> bool:
+    return _backend.has_saved_notes(music, score)
 
 def save_notes(
     music: iidx.Music, score: iidx.Score, notes: list[iidx.Note],
+    overwrites: bool = False,
 ) -> None:
 
-    os.makedirs(
-        _get_notes_dir_path(score.kind.play_mode, music.version),
-        exist_ok=True,
-    )
+    _backend.save_notes(music, score, notes, overwrites=overwrites)
 
-    file_path = _get_notes_file_path(
-        score.kind.play_mode, music.version, music.tag, score.kind.difficulty
-    )
-    if os.path.exists(file_path):
-        raise FileExistsError(file_path)
+def mark_notes_stale(music: iidx.Music, score: iidx.Score) -> None:
+    _backend.mark_notes_stale(music, score)
+
+def notes_are_stale(music: iidx.Music, score: iidx.Score) -> bool:
+    return _backend.notes_are_stale(music, score)
 
-    notes.sort()
-    with util.make_file_atomically(file_path) as f:
-        pjson.dump(notes, f)
+def iter_saved_notes() -> Iterator[SavedNotes]:
+    return _backend.iter_saved_notes()
+
+def load_note_codes(music: iidx.Music, score: iidx.Score) -> array:
+    return _backend.load_note_codes(music, score)
 
 def load_notes(
     music: iidx.Music, score: iidx.Score,
 ) -> Iterator[iidx.Note]:
 
-    file_path = _get_notes_file_path(
-        score.kind.play_mode, music.version, music.tag, score.kind.difficulty
-    )
-    with open(file_path) as f:
-        raw_notes = json.load(f)
-        assert isinstance(raw_notes, list)
-        assert util.is_list_of_list(raw_notes)
-
-    notes = []
-    for raw_note in raw_notes:
-        assert len(raw_note) == 3
-
-        timing = raw_note[0]
-        assert isinstance(timing, int)
-        play_side = raw_note[1]
-        assert isinstance(play_side, int)
-        assert iidx.is_valid_for_play_side(play_side)
-        lane = raw_note[2]
-        assert isinstance(lane, str)
-        assert iidx.is_valid_for_lane(lane)
-
-        note = iidx.Note(timing, play_side, lane)
-        notes.append(note)
-
-    assert notes == sorted(notes)
-    yield from notes
+    return _backend.load_notes(music, score)
+
+def load_derived(
+    music: iidx.Music, score: iidx.Score, kind: str,
+) -> bytes | None:
+
+    return _backend.load_derived(music, score, kind)
+
+def save_derived(
+    music: iidx.Music, score: iidx.Score, kind: str, data: bytes,
+) -> None:
+
+    _backend.save_derived(music, score, kind, data)
+
+def load_aggregate(name: str) -> bytes | None:
+    return _backend.load_aggregate(name)
+
+def save_aggregate(name: str, data: bytes) -> None:
+    _backend.save_aggregate(name, data)
+
+def copy_all(
+    source: Backend, destination: Backend,
+) -> Iterator[tuple[iidx.Music, iidx.Score]]:
+
+    """
+    保存先間で楽曲一覧と譜面データを全てコピーする。
+    コピーした譜面を順に返す。
+    """
+
+    musics = source.load_all_musics()
+    destination.save_musics(musics, overwrites=True)
+
+    for music, score in source.load_musics(ScoreFilter()):
+        if not source.has_saved_notes(music, score):
+            continue
+        if destination.has_saved_notes(music, score):
+            continue
+        notes = list(source.load_notes(music, score))
+        destination.save_notes(music, score, notes)
+        yield (music, score)
+
+def _upgrade_notes_file(file_path: str) -> bool:
+    """
+    古いバージョンのバイナリ形式なら書き直す。書き直したかどうかを返す。
+    """
+
+    with open(file_path, 'rb') as f:
+        if notes_codec.read_format_version(f) >= notes_codec.FORMAT_VERSION:
+            return False
+        f.seek(0)
+        codes = notes_codec.read_codes(f, paranoid=True)
+
+    if not notes_codec.codes_are_sorted(codes):
+        raise ValueError('unsorted notes: ' + file_path)
+    with util.make_binary_file_atomically(file_path) as f:
+        f.write(notes_codec.encode_codes(codes, validated=True))
+    return True
+
+def migrate_notes(keeps_legacy: bool = False) -> Iterator[str]:
+    """
+    JSON形式で保存された譜面ファイルを全てバイナリ形式に変換する。
+    古いバージョンのバイナリ形式の譜面ファイルも、全て検証した上で最新のバージョンにする。
+    変換したファイルのパスを順に返す。
+    """
+
+    root_dir = _get_notes_root_dir_path()
+    if not os.path.isdir(root_dir):
+        return
+
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in sorted(file_names):
+            if file_name.endswith(_NOTES_FILE_EXT):
+                file_path = os.path.join(dir_path, file_name)
+                if _upgrade_notes_file(file_path):
+                    yield file_path
+                continue
+            if not file_name.endswith(_LEGACY_NOTES_FILE_EXT):
+                continue
+
+            legacy_file_path = os.path.join(dir_path, file_name)
+            file_path =\
+                legacy_file_path.removesuffix(_LEGACY_NOTES_FILE_EXT) + _NOTES_FILE_EXT
+            # 以前に`keeps_legacy`で変換済みならバイナリ形式の方を正とする
+            if not os.path.exists(file_path):
+                notes = _load_legacy_notes(legacy_file_path)
+                with util.make_binary_file_atomically(file_path) as f:
+                    f.write(notes_codec.encode(notes))
+
+            if not keeps_legacy:
+                os.remove(legacy_file_path)
+            yield legacy_file_path
@@ -0,0 +1,400 @@
+from array import array
+import os
+import sqlite3
+from typing import Any, Iterator
+
+from . import iidx, notes_codec
+from .persistence import (
+    Backend, SavedNotes, ScoreFilter, is_paranoid,
+    LevelFilter, LevelFilterAll, LevelFilterRange, LevelFilterSingle,
+    VersionFilter, VersionFilterAll, VersionFilterRange, VersionFilterSingle,
+)
+
+# 曲・譜面の並び順は楽曲一覧の保存時の順番を保つ（`position`）。
+# `version_order`はACのバージョンの大小比較用で、CS専用曲はNULL。
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS musics (
+    tag TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    version_order REAL,
+    genre TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS musics_version ON musics (version);
+CREATE INDEX IF NOT EXISTS musics_version_order ON musics (version_order);
+
+CREATE TABLE IF NOT EXISTS scores (
+    music_tag TEXT NOT NULL REFERENCES musics (tag),
+    position INTEGER NOT NULL,
+    play_mode TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    has_URL INTEGER NOT NULL,
+    PRIMARY KEY (music_tag, play_mode, difficulty)
+);
+CREATE INDEX IF NOT EXISTS scores_kind_level
+    ON scores (play_mode, difficulty, level);
+CREATE INDEX IF NOT EXISTS scores_level ON scores (level);
+
+CREATE TABLE IF NOT EXISTS notes (
+    play_mode TEXT NOT NULL,
+    version TEXT NOT NULL,
+    music_tag TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (play_mode, version, music_tag, difficulty)
+);
+
+CREATE TABLE IF NOT EXISTS stale_notes (
+    play_mode TEXT NOT NULL,
+    version TEXT NOT NULL,
+    music_tag TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    PRIMARY KEY (play_mode, version, music_tag, difficulty)
+);
+
+CREATE TABLE IF NOT EXISTS derived (
+    play_mode TEXT NOT NULL,
+    version TEXT NOT NULL,
+    music_tag TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (play_mode, version, music_tag, difficulty, kind)
+);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    name TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+'''
+
+def _version_order(version: iidx.Version) -> float | None:
+    if not isinstance(version, iidx.VersionAC):
+        return None
+    return float(version)
+
+def _version_condition(cond: VersionFilter) -> tuple[str, list[Any]]:
+    match cond:
+        case VersionFilterAll():
+            return '1', []
+
+        case VersionFilterSingle():
+            return 'm.version = ?', [cond.value.code]
+
+        case VersionFilterRange():
+            sql = 'm.version_order IS NOT NULL'
+            params: list[Any] = []
+            if cond.start is not None:
+                sql += ' AND m.version_order >= ?'
+                params.append(float(cond.start))
+            if cond.end is not None:
+                sql += ' AND m.version_order <= ?'
+                params.append(float(cond.end))
+            return sql, params
+
+        case _:
+            raise ValueError('unexpected type: ' + str(type(cond)))
+
+def _level_condition(cond: LevelFilter) -> tuple[str, list[Any]]:
+    match cond:
+        case LevelFilterAll():
+            return '1', []
+
+        case LevelFilterSingle():
+            return 's.level = ?', [cond.value]
+
+        case LevelFilterRange():
+            sql = '1'
+            params: list[Any] = []
+            if cond.start is not None:
+                sql += ' AND s.level >= ?'
+                params.append(cond.start)
+            if cond.end is not None:
+                sql += ' AND s.level <= ?'
+                params.append(cond.end)
+            return sql, params
+
+        case _:
+            raise ValueError('unexpected type: ' + str(type(cond)))
+
+def _score_filter_condition(filter: ScoreFilter) -> tuple[str, list[Any]]:
+    conditions: list[str] = []
+    params: list[Any] = []
+
+    if filter.has_URL is not None:
+        conditions.append('s.has_URL = ?')
+        params.append(int(filter.has_URL))
+    if filter.play_mode:
+        conditions.append('s.play_mode = ?')
+        params.append(filter.play_mode)
+    if filter.music_tag:
+        conditions.append('m.tag = ?')
+        params.append(filter.music_tag)
+    if filter.difficulty:
+        conditions.append('s.difficulty = ?')
+        params.append(filter.difficulty)
+
+    for sql, sub_params in [
+        _version_condition(filter.version),
+        _level_condition(filter.level),
+    ]:
+        conditions.append(sql)
+        params += sub_params
+
+    return ' AND '.join(conditions), params
+
+class SQLiteBackend(Backend):
+    """
+    楽曲一覧と譜面データを1つのSQLiteデータベースに保存する。
+    譜面データはバイナリ形式（`notes_codec`）のままBLOBとして持つ。
+    """
+
+    name = 'sqlite'
+
+    _file_path: str
+    _connection: sqlite3.Connection | None
+
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+        self._connection = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            dir = os.path.dirname(self._file_path)
+            if dir:
+                os.makedirs(dir, exist_ok=True)
+            # `analyze --jobs`で複数プロセスから書き込まれることがあるので長めに待つ。
+            # `scrape_score`では保存を別スレッドで行う（同時には使わない）。
+            self._connection = sqlite3.connect(
+                self._file_path, timeout=30, check_same_thread=False,
+            )
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is None:
+            return
+        # `save_derived`の分はここでまとめてコミットする
+        self._connection.commit()
+        self._connection.close()
+        self._connection = None
+
+    def save_musics(self, musics: list[iidx.Music], overwrites: bool = False) -> None:
+        db = self._db
+        if not overwrites and db.execute('SELECT 1 FROM musics LIMIT 1').fetchone():
+            raise FileExistsError(self._file_path)
+
+        with db:
+            db.execute('DELETE FROM scores')
+            db.execute('DELETE FROM musics')
+            db.executemany(
+                'INSERT INTO musics VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (
+                        music.tag, position,
+                        music.version.code, _version_order(music.version),
+                        music.genre, music.artist, music.title,
+                    )
+                    for position, music in enumerate(musics)
+                ),
+            )
+            db.executemany(
+                'INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (
+                        music.tag, position,
+                        score.kind.play_mode, score.kind.difficulty,
+                        score.level, int(score.has_URL),
+                    )
+                    for music in musics
+                    for position, score in enumerate(music.scores)
+                ),
+            )
+
+    def _load_musics_by_tags(self, tags: list[str] | None) -> list[iidx.Music]:
+        music_sql = 'SELECT tag, version, genre, artist, title FROM musics'
+        score_sql = '''
+            SELECT music_tag, play_mode, difficulty, level, has_URL FROM scores
+        '''
+        params: list[str] = []
+        if tags is not None:
+            placeholders = ', '.join('?' * len(tags))
+            music_sql += f' WHERE tag IN ({placeholders})'
+            score_sql += f' WHERE music_tag IN ({placeholders})'
+            params = tags
+        music_sql += ' ORDER BY position'
+        score_sql += ' ORDER BY music_tag, position'
+
+        scores: dict[str, list[iidx.Score]] = {}
+        for music_tag, play_mode, difficulty, level, has_URL\
+            in self._db.execute(score_sql, params):
+
+            scores.setdefault(music_tag, []).append(iidx.Score(
+                music_tag,
+                iidx.ScoreKind(play_mode, difficulty),
+                level,
+                bool(has_URL),
+            ))
+
+        return [
+            iidx.Music(
+                tag, iidx.to_version(version), genre, artist, title,
+                scores.get(tag, []),
+            )
+            for tag, version, genre, artist, title
+            in self._db.execute(music_sql, params)
+        ]
+
+    def load_all_musics(self) -> list[iidx.Music]:
+        return self._load_musics_by_tags(None)
+
+    def load_musics(
+        self, filter: ScoreFilter,
+    ) -> Iterator[tuple[iidx.Music, iidx.Score]]:
+
+        where, params = _score_filter_condition(filter)
+        rows = self._db.execute(
+            f'''
+            SELECT m.tag, s.play_mode, s.difficulty
+            FROM scores AS s JOIN musics AS m ON s.music_tag = m.tag
+            WHERE {where}
+            ORDER BY m.position, s.position
+            ''',
+            params,
+        ).fetchall()
+
+        # SQLiteのプレースホルダー数の上限を超えないよう、少しずつ組み立てる
+        chunk_size = 500
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i + chunk_size]
+            tags = list(dict.fromkeys(tag for tag, _, _ in chunk))
+            musics = {
+                music.tag: music for music in self._load_musics_by_tags(tags)
+            }
+            for tag, play_mode, difficulty in chunk:
+                music = musics[tag]
+                kind = iidx.ScoreKind(play_mode, difficulty)
+                score = next(score for score in music.scores if score.kind == kind)
+                yield (music, score)
+
+    def _notes_key(self, music: iidx.Music, score: iidx.Score) -> tuple[str, ...]:
+        return (
+            score.kind.play_mode, music.version.code,
+            music.tag, score.kind.difficulty,
+        )
+
+    def has_saved_notes(self, music: iidx.Music, score: iidx.Score) -> bool:
+        row = self._db.execute(
+            '''
+            SELECT 1 FROM notes
+            WHERE play_mode = ? AND version = ? AND music_tag = ? AND difficulty = ?
+            ''',
+            self._notes_key(music, score),
+        ).fetchone()
+        return row is not None
+
+    def save_notes(
+        self, music: iidx.Music, score: iidx.Score, notes: list[iidx.Note],
+        overwrites: bool = False,
+    ) -> None:
+
+        if not overwrites and self.has_saved_notes(music, score):
+            raise FileExistsError(self._file_path, self._notes_key(music, score))
+
+        notes.sort()
+        with self._db as db:
+            # 譜面データが変わったら導出データは古くなる
+            for table in ['derived', 'stale_notes']:
+                db.execute(
+                    f'''
+                    DELETE FROM {table}
+                    WHERE play_mode = ? AND version = ? AND music_tag = ? AND difficulty = ?
+                    ''',
+                    self._notes_key(music, score),
+                )
+            db.execute(
+                'INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?)',
+                self._notes_key(music, score) + (notes_codec.encode(notes),),
+            )
+
+    def mark_notes_stale(self, music: iidx.Music, score: iidx.Score) -> None:
+        if not self.has_saved_notes(music, score):
+            raise FileNotFoundError(self._file_path, self._notes_key(music, score))
+        with self._db as db:
+            db.execute(
+                'INSERT OR IGNORE INTO stale_notes VALUES (?, ?, ?, ?)',
+                self._notes_key(music, score),
+            )
+
+    def notes_are_stale(self, music: iidx.Music, score: iidx.Score) -> bool:
+        row = self._db.execute(
+            '''
+            SELECT 1 FROM stale_notes
+            WHERE play_mode = ? AND version = ? AND music_tag = ? AND difficulty = ?
+            ''',
+            self._notes_key(music, score),
+        ).fetchone()
+        return row is not None
+
+    def iter_saved_notes(self) -> Iterator[SavedNotes]:
+        for play_mode, version, music_tag, difficulty, size in self._db.execute(
+            'SELECT play_mode, version, music_tag, difficulty, length(data) FROM notes'
+        ):
+            yield SavedNotes(play_mode, version, music_tag, difficulty, size)
+
+    def load_note_codes(self, music: iidx.Music, score: iidx.Score) -> array:
+        row = self._db.execute(
+            '''
+            SELECT data FROM notes
+            WHERE play_mode = ? AND version = ? AND music_tag = ? AND difficulty = ?
+            ''',
+            self._notes_key(music, score),
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(self._file_path, self._notes_key(music, score))
+
+        return notes_codec.decode_codes(row[0], paranoid=is_paranoid())
+
+    def load_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str,
+    ) -> bytes | None:
+
+        row = self._db.execute(
+            '''
+            SELECT data FROM derived
+            WHERE play_mode = ? AND version = ? AND music_tag = ? AND difficulty = ?
+                AND kind = ?
+            ''',
+            self._notes_key(music, score) + (kind,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def save_derived(
+        self, music: iidx.Music, score: iidx.Score, kind: str, data: bytes,
+    ) -> None:
+
+        # 1件毎にコミットすると遅いので、コミットは`close`時等にまとめて行う
+        self._db.execute(
+            'INSERT OR REPLACE INTO derived VALUES (?, ?, ?, ?, ?, ?)',
+            self._notes_key(music, score) + (kind, data),
+        )
+
+    def load_aggregate(self, name: str) -> bytes | None:
+        row = self._db.execute(
+            'SELECT data FROM aggregates WHERE name = ?', (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def save_aggregate(self, name: str, data: bytes) -> None:
+        with self._db as db:
+            db.execute(
+                'INSERT OR REPLACE INTO aggregates VALUES (?, ?)', (name, data),
+            )
@@ -0,0 +1,157 @@
+import json
+import time
+from typing import Any, IO, Self
+
+from . import iidx, persistence
+
+# `scrape_score`の記録（ジャーナル）。
+# 1行1イベントのJSONで追記していくので、途中で強制終了されても直前の行までは残る。
+# 最後の行が書きかけなら読み飛ばす。
+#
+# イベントの種類：
+#   plan:    対象の譜面一覧（セッションの開始）
+#   resume:  `--resume`での再開
+#   done:    保存した（または保存済みだった）譜面と、掛かった時間
+#   failed:  失敗した譜面とエラー内容
+#   end:     セッションの終了（中断を含む）と集計
+
+_FILE_NAME = 'scrape_journal.jsonl'
+
+Target = tuple[str, iidx.PlayMode, iidx.Difficulty]
+
+def to_target(music: iidx.Music, score: iidx.Score) -> Target:
+    return (music.tag, score.kind.play_mode, score.kind.difficulty)
+
+def _read_events() -> list[dict[str, Any]]:
+    try:
+        f = open(persistence.get_work_file_path(_FILE_NAME))
+    except FileNotFoundError:
+        return []
+
+    events = []
+    with f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            assert isinstance(event, dict)
+            events.append(event)
+    return events
+
+class ScrapeJournal:
+    _file: IO[str]
+    _started: float
+    _done_count: int
+    _skipped_count: int
+    _failed_count: int
+    _fetch_sec: float
+    _save_sec: float
+
+    def __init__(self, file: IO[str]) -> None:
+        self._file = file
+        self._started = time.monotonic()
+        self._done_count = 0
+        self._skipped_count = 0
+        self._failed_count = 0
+        self._fetch_sec = 0
+        self._save_sec = 0
+
+    @classmethod
+    def start(cls, targets: list[Target]) -> Self:
+        """
+        新しいセッションを始める。前のセッションの記録は消える。
+        """
+
+        file = open(persistence.get_work_file_path(_FILE_NAME), 'w')
+        journal = cls(file)
+        journal._write({'event': 'plan', 'targets': targets})
+        return journal
+
+    @classmethod
+    def resume(cls) -> tuple[Self, list[Target]] | None:
+        """
+        前のセッションで保存し終えていない譜面から再開する。
+        再開する譜面が無ければ`None`。
+        """
+
+        planned: list[Target] = []
+        done: set[Target] = set()
+        for event in _read_events():
+            match event['event']:
+                case 'plan':
+                    planned = [tuple(target) for target in event['targets']]
+                    done = set()
+                case 'done':
+                    done.add(tuple(event['target']))
+
+        remaining = [target for target in planned if target not in done]
+        if not remaining:
+            return None
+
+        file = open(persistence.get_work_file_path(_FILE_NAME), 'a')
+        journal = cls(file)
+        journal._write({'event': 'resume', 'remaining': len(remaining)})
+        return journal, remaining
+
+    @property
+    def failed_count(self) -> int:
+        return self._failed_count
+
+    def _write(self, event: dict[str, Any]) -> None:
+        event['time'] = time.time()
+        self._file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def record_done(
+        self, target: Target,
+        fetch_sec: float | None = None, save_sec: float | None = None,
+    ) -> None:
+        """
+        `fetch_sec`が`None`なら、保存済みで飛ばしたものとする。
+        """
+
+        if fetch_sec is None or save_sec is None:
+            self._skipped_count += 1
+            self._write({'event': 'done', 'target': target, 'skipped': True})
+            return
+
+        self._done_count += 1
+        self._fetch_sec += fetch_sec
+        self._save_sec += save_sec
+        self._write({
+            'event': 'done', 'target': target,
+            'fetch_sec': round(fetch_sec, 3), 'save_sec': round(save_sec, 3),
+        })
+
+    def record_failed(self, target: Target, error: BaseException) -> None:
+        self._failed_count += 1
+        self._write({'event': 'failed', 'target': target, 'error': repr(error)})
+
+    def finish(self, interrupted: bool) -> str:
+        """
+        セッションを終える。集計結果を文章で返す。
+        """
+
+        elapsed = time.monotonic() - self._started
+        self._write({
+            'event': 'end',
+            'interrupted': interrupted,
+            'elapsed_sec': round(elapsed, 3),
+            'done': self._done_count,
+            'skipped': self._skipped_count,
+            'failed': self._failed_count,
+            'fetch_sec': round(self._fetch_sec, 3),
+            'save_sec': round(self._save_sec, 3),
+        })
+        self._file.close()
+
+        summary =\
+            f'Scraped {self._done_count}, '\
+            f'skipped {self._skipped_count}, '\
+            f'failed {self._failed_count} scores in {elapsed:.1f}s.'
+        if self._done_count > 0:
+            summary +=\
+                f' (average fetch {self._fetch_sec / self._done_count:.2f}s, '\
+                f'save {self._save_sec / self._done_count:.3f}s)'
+        return summary
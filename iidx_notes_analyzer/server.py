@@ -0,0 +1,103 @@
+from http import HTTPStatus
+import json
+import sys
+from typing import TYPE_CHECKING, Any, Callable
+from urllib import parse
+
+if TYPE_CHECKING:
+    from http.server import BaseHTTPRequestHandler
+
+# `serve`で起動するローカルのHTTPサーバーと、それに問い合わせるクライアント。
+# GETのパスとクエリ文字列を受け取り、結果をJSONで返すだけの薄い層で、
+# 何に答えるかは`handle`に任せる。
+#
+# 他のマシンからは使わない前提なので、ループバックアドレスでしか待ち受けない。
+# 保存先（SQLite等）を複数のスレッドから触らないよう、問い合わせは1つずつ処理する。
+#
+# `http.server`等は読み込みに時間が掛かるので、サーバー・クライアントとして使う時に読み込む
+# （`analyze`のヘルプ等で待たされないように）。
+
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+def default_url(port: int = DEFAULT_PORT) -> str:
+    return f'http://{HOST}:{port}'
+
+class QueryError(Exception):
+    """
+    問い合わせの内容が不正（HTTPの400番台）。
+    """
+
+    status: HTTPStatus
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST) -> None:
+        super().__init__(message)
+        self.status = status
+
+Handler = Callable[[str, dict[str, str]], Any]
+
+def _make_request_handler(handle: Handler) -> type['BaseHTTPRequestHandler']:
+    from http.server import BaseHTTPRequestHandler
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = parse.urlsplit(self.path)
+            params = dict(parse.parse_qsl(url.query, keep_blank_values=True))
+            try:
+                result = handle(url.path, params)
+            except QueryError as e:
+                self._send_json(e.status, {'error': str(e)})
+            except Exception as e:
+                self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(e)})
+                raise
+            else:
+                self._send_json(HTTPStatus.OK, result)
+
+        def _send_json(self, status: HTTPStatus, body: Any) -> None:
+            data = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            print(format % args, file=sys.stderr)
+
+    return RequestHandler
+
+def serve(handle: Handler, port: int = DEFAULT_PORT) -> None:
+    """
+    Ctrl+C（`KeyboardInterrupt`）まで問い合わせに答え続ける。
+    `handle`は問い合わせ毎に(パス, パラメーター)で呼ばれ、JSONにできる値を返す。
+    不正な問い合わせには`QueryError`を投げる。
+    """
+
+    from http.server import HTTPServer
+
+    with HTTPServer((HOST, port), _make_request_handler(handle)) as http_server:
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+def query(base_url: str, path: str, params: dict[str, str]) -> Any:
+    """
+    サーバーに問い合わせて、結果（JSON）を返す。
+    サーバーが不正な問い合わせとして断った場合は`QueryError`。
+    繋がらない場合は`urllib.error.URLError`。
+    """
+
+    from urllib import error, request
+
+    url = base_url.rstrip('/') + path + '?' + parse.urlencode(params)
+    try:
+        with request.urlopen(url) as response:
+            return json.load(response)
+    except error.HTTPError as e:
+        with e:
+            try:
+                message = json.load(e)['error']
+            except (ValueError, LookupError, TypeError):
+                message = e.reason
+        raise QueryError(message, HTTPStatus(e.code)) from None
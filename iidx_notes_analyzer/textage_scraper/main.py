@@ -1,5 +1,6 @@
+from contextlib import AbstractContextManager, nullcontext
 from dataclasses import dataclass
-from typing import Any, Self
+from typing import Any, Callable, Self
 
 import playwright.sync_api as playwright
 
@@ -13,16 +14,58 @@ class MusicListPage:
 class ScorePage:
     notes: list[iidx.Note]
 
+@dataclass(frozen=True, slots=True)
+class RawScorePage:
+    """
+    解析前の譜面ページ。
+    解析にはブラウザを使わないので、ページを開くのとは別のスレッドで行える。
+    """
+
+    note_positions: list[Any]
+
+    def parse(self) -> ScorePage:
+        notes = [_textage.NotePosition(raw).to_entity() for raw in self.note_positions]
+        return ScorePage(notes)
+
+# 解析に使わないリソース。軽量モードでは読み込まない。
+_BLOCKED_RESOURCE_TYPES = {'image', 'stylesheet', 'font', 'media'}
+
+def _route_lean(route: playwright.Route) -> None:
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+def _no_phase(name: str) -> AbstractContextManager[Any]:
+    return nullcontext()
+
 class Client:
+    """
+    `lean`がTrue（軽量モード）の場合、画像・CSS等を読み込まず、
+    `load`イベントを待たずに必要なデータが揃った時点で解析する。
+    `phase`を渡すと、ページを開く（`goto`）・データを取り出す（`evaluate`）・
+    解析する（`decode`）区間をそれぞれ`with phase(区間名):`で囲んで呼ぶ（計測用）。
+    """
+
     _playwright: playwright.Playwright
     _browser: playwright.Browser
     _page: playwright.Page
+    _lean: bool
+    _phase: Callable[[str], AbstractContextManager[Any]]
     _closed: bool
 
-    def __init__(self) -> None:
+    def __init__(
+        self, lean: bool = True,
+        phase: Callable[[str], AbstractContextManager[Any]] = _no_phase,
+    ) -> None:
+
         self._playwright = playwright.sync_playwright().start()
         self._browser = self._playwright.chromium.launch()
         self._page = self._browser.new_page()
+        self._lean = lean
+        self._phase = phase
+        if lean:
+            self._page.route('**/*', _route_lean)
         self._closed = False
 
     def close(self) -> None:
@@ -47,23 +90,48 @@ class Client:
     def closed(self) -> bool:
         return self._closed
 
+    def _goto(self, page_url: str, global_names: list[str]) -> None:
+        """
+        ページを開き、`global_names`のグローバル変数が揃うまで待つ。
+        """
+
+        with self._phase('goto'):
+            self._goto_without_phase(page_url, global_names)
+
+    def _goto_without_phase(self, page_url: str, global_names: list[str]) -> None:
+        if not self._lean:
+            self._page.goto(page_url)
+            return
+
+        # 変数を定義するスクリプトは同期的に読み込まれるので、
+        # HTMLの解析が終われば（`readyState`が`loading`でなくなれば）中身も揃っている
+        self._page.goto(page_url, wait_until='commit')
+        defined = ' && '.join(f"typeof {name} !== 'undefined'" for name in global_names)
+        self._page.wait_for_function(
+            f"document.readyState !== 'loading' && {defined}",
+        )
+
     def scrape_music_list_page(self) -> MusicListPage:
         # Current Ver.表示で開くと、曲データが中途半端に書き換えられてしまう。
         # そのためWhole Ver.表示で曲データを落としてから、
         # Current Ver.表示時のコードを模倣してデータを絞り込む。
-        self._page.goto(url.ALL_MUSIC_LIST_PAGE)
-        raw_arcade_music_table = self._page.evaluate('actbl')
-        raw_title_table = self._page.evaluate('titletbl')
-
-        arcade_music_table = _textage.MusicTable(raw_arcade_music_table)
-        title_table = _textage.MusicTitleTable(raw_title_table)
-        musics = _textage.construct_arcade_musics(arcade_music_table, title_table)
+        self._goto(url.ALL_MUSIC_LIST_PAGE, ['actbl', 'titletbl'])
+        with self._phase('evaluate'):
+            raw_arcade_music_table = self._page.evaluate('actbl')
+            raw_title_table = self._page.evaluate('titletbl')
+
+        with self._phase('decode'):
+            arcade_music_table = _textage.MusicTable(raw_arcade_music_table)
+            title_table = _textage.MusicTitleTable(raw_title_table)
+            musics = _textage.construct_arcade_musics(arcade_music_table, title_table)
         return MusicListPage(musics)
 
-    def scrape_score_page(self, url_params: url.ScorePageParams) -> ScorePage:
-        self._page.goto(url_params.to_url())
-        raw_note_positions = self._page.evaluate('npos')
+    def fetch_score_page(self, url_params: url.ScorePageParams) -> RawScorePage:
+        self._goto(url_params.to_url(), ['npos'])
+        with self._phase('evaluate'):
+            raw_note_positions = self._page.evaluate('npos')
         assert isinstance(raw_note_positions, list)
+        return RawScorePage(raw_note_positions)
 
-        notes = [_textage.NotePosition(raw).to_entity() for raw in raw_note_positions]
-        return ScorePage(notes)
+    def scrape_score_page(self, url_params: url.ScorePageParams) -> ScorePage:
+        return self.fetch_score_page(url_params).parse()
@@ -0,0 +1,143 @@
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import asdict, dataclass
+import threading
+import time
+import tracemalloc
+from typing import Any, Self
+
+# 処理の区間（フェーズ）毎の所要時間・呼び出し回数・メモリ使用量のピークを測る。
+# `enable`するまでは何もしない（`phase`は使い回しの空のコンテキストマネージャを返すだけ）。
+#
+# 区間は入れ子にでき、`外側/内側`という名前で別々に集計する（時間は内側の分も含む）。
+# 入れ子はスレッド毎に辿るが、メモリ使用量は`tracemalloc`で測るのでプロセス全体の値になる。
+
+@dataclass(slots=True)
+class PhaseStats:
+    name: str
+    calls: int
+    total_sec: float
+    peak_bytes: int     # 区間内でのメモリ使用量（`tracemalloc`で追跡している分）の最大
+
+class _Frame:
+    __slots__ = ('peak_bytes',)
+    peak_bytes: int
+
+    def __init__(self) -> None:
+        self.peak_bytes = 0
+
+_enabled = False
+_started: float = 0
+_stats: dict[str, PhaseStats] = {}
+_peak_bytes = 0
+_lock = threading.Lock()
+_open_frames: set[_Frame] = set()
+_local = threading.local()
+
+_NULL_PHASE: AbstractContextManager[None] = nullcontext()
+
+def enable() -> None:
+    global _enabled, _started
+    if _enabled:
+        return
+    tracemalloc.start()
+    _enabled = True
+    _started = time.perf_counter()
+
+def is_enabled() -> bool:
+    return _enabled
+
+def _fold_peak() -> None:
+    # `tracemalloc`のピークは1つしかないので、リセットする前に
+    # 開いている全ての区間（他のスレッドの分も）と全体に反映しておく
+    global _peak_bytes
+    _, peak = tracemalloc.get_traced_memory()
+    _peak_bytes = max(_peak_bytes, peak)
+    for frame in _open_frames:
+        frame.peak_bytes = max(frame.peak_bytes, peak)
+    tracemalloc.reset_peak()
+
+class _Phase:
+    _name: str
+    _path: str
+    _frame: _Frame
+    _started: float
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __enter__(self) -> Self:
+        stack: list[str] = _local.__dict__.setdefault('stack', [])
+        stack.append(self._name)
+        self._path = '/'.join(stack)
+        self._frame = _Frame()
+        with _lock:
+            if self._path not in _stats:
+                _stats[self._path] = PhaseStats(self._path, 0, 0, 0)
+            _fold_peak()
+            _open_frames.add(self._frame)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> bool:
+        elapsed = time.perf_counter() - self._started
+        with _lock:
+            _fold_peak()
+            _open_frames.remove(self._frame)
+            stats = _stats[self._path]
+            stats.calls += 1
+            stats.total_sec += elapsed
+            stats.peak_bytes = max(stats.peak_bytes, self._frame.peak_bytes)
+        _local.stack.pop()
+        return False
+
+def phase(name: str) -> AbstractContextManager[Any]:
+    """
+    `with phase('名前'):`の中を1回分として測る。
+    """
+
+    if not _enabled:
+        return _NULL_PHASE
+    return _Phase(name)
+
+def _tree_order(names: list[str]) -> list[str]:
+    # 初めて入った順を保ちつつ、内側の区間を外側の区間の直後に並べる
+    first_seen = {name: i for i, name in enumerate(names)}
+
+    def key(name: str) -> list[int]:
+        parts = name.split('/')
+        return [first_seen['/'.join(parts[:i + 1])] for i in range(len(parts))]
+
+    return sorted(names, key=key)
+
+def report_as_dict() -> dict[str, Any]:
+    with _lock:
+        _fold_peak()
+        phases = [asdict(_stats[name]) for name in _tree_order(list(_stats))]
+    return {
+        'wall_sec': time.perf_counter() - _started,
+        'peak_bytes': _peak_bytes,
+        'phases': phases,
+    }
+
+def format_report() -> str:
+    report = report_as_dict()
+    lines = [
+        f'{"phase":<40} {"calls":>8} {"total":>10} {"average":>10} {"peak":>10}',
+    ]
+    for stats in report['phases']:
+        if stats['calls'] == 0:
+            # 報告の時点でまだ終わっていない区間
+            continue
+        depth = stats['name'].count('/')
+        name = '  ' * depth + stats['name'].rsplit('/', 1)[-1]
+        average_ms = stats['total_sec'] / stats['calls'] * 1000
+        lines.append(
+            f'{name:<40} {stats["calls"]:>8} '
+            f'{stats["total_sec"]:>9.3f}s {average_ms:>8.2f}ms '
+            f'{stats["peak_bytes"] / 1e6:>8.1f}MB'
+        )
+    lines.append(
+        f'{"(total)":<40} {"":>8} {report["wall_sec"]:>9.3f}s {"":>10} '
+        f'{report["peak_bytes"] / 1e6:>8.1f}MB'
+    )
+    return '\n'.join(lines)
@@ -1,10 +1,17 @@
 from contextlib import contextmanager
+import importlib.util
+import json
 import os
 import shutil
+import signal
+import sys
 import tempfile
 import time
+from types import ModuleType
 from typing import Any, Callable, IO, Iterator, TypeGuard
 
+from . import profile
+
 # TODO: `is_list_of_T`みたいにTを指定して使える汎用的な関数にしたい
 def is_list_of_list(l: list) -> TypeGuard[list[list]]:
     return all(isinstance(item, list) for item in l)
@@ -18,6 +25,107 @@ def is_list_of_str_dict(l: list[dict]) -> TypeGuard[list[dict[str, Any]]]:
         for item in l
     )
 
+def import_lazily(name: str) -> ModuleType | None:
+    """
+    インストールされていればモジュールを返す。無ければ`None`。
+    モジュールの中身は、初めて属性を参照した時に読み込まれる。
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        return None
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+_JSON_WHITESPACE = ' \t\n\r'
+_JSON_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    JSON配列の要素を先頭から順に返す。
+    `json.load`と違ってファイル全体を読み込まないので、
+    メモリ上に持つのは`chunk_size`文字と要素1つ分程度で済む。
+    形式が不正なら`ValueError`（`json.JSONDecodeError`）。
+    """
+
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace() -> str:
+        # 空白を読み飛ばし、次の1文字を返す（終端なら空文字列）
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return ''
+
+    def error(message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, buf, pos)
+
+    if skip_whitespace() != '[':
+        raise error("expecting '['")
+    pos += 1
+
+    if skip_whitespace() == ']':
+        pos += 1
+    else:
+        while True:
+            skip_whitespace()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # 要素がチャンクの境目で切れているかもしれない
+                    if fill():
+                        continue
+                    raise
+                # 数値は途中（"1."等）で切れていても読めてしまうので、
+                # 後ろがバッファの終わりまで数値の文字なら読み足して読み直す
+                tail = end
+                while tail < len(buf) and buf[tail] in _JSON_NUMBER_CHARS:
+                    tail += 1
+                if tail == len(buf) and fill():
+                    continue
+                break
+            pos = end
+            yield item
+
+            match skip_whitespace():
+                case ',':
+                    pos += 1
+                case ']':
+                    pos += 1
+                    break
+                case _:
+                    raise error("expecting ',' or ']'")
+
+    if skip_whitespace() != '':
+        raise error('extra data')
+
 @contextmanager
 def make_file_atomically(file_path: str) -> Iterator[IO[str]]:
     """
@@ -28,6 +136,27 @@ def make_file_atomically(file_path: str) -> Iterator[IO[str]]:
     具体的には、一時ファイルを作成して書き込み、無事完了したらリネームしている。
     """
 
+    with _make_file_atomically(file_path, 'w') as f:
+        yield f
+
+@contextmanager
+def make_binary_file_atomically(
+    file_path: str, syncs: bool = True,
+) -> Iterator[IO[bytes]]:
+    """
+    `make_file_atomically`のバイナリ版。
+    `syncs`がFalseの場合はディスクへの書き込みを待たない。
+    キャッシュ等、電源断等で壊れても読み込み時に検知して作り直せるものに使う。
+    """
+
+    with _make_file_atomically(file_path, 'wb', syncs) as f:
+        yield f
+
+@contextmanager
+def _make_file_atomically(
+    file_path: str, mode: str, syncs: bool = True,
+) -> Iterator[IO]:
+
     file_name = os.path.basename(file_path)
 
     temp_prefix = file_name + '.'
@@ -37,42 +166,85 @@ def make_file_atomically(file_path: str) -> Iterator[IO[str]]:
     temp_dir = os.path.dirname(file_path)
 
     with tempfile.NamedTemporaryFile(
-        mode='w', dir=temp_dir, delete=True,
+        mode=mode, dir=temp_dir, delete=True,
         prefix=temp_prefix, suffix=temp_suffix,
     ) as temp_file:
 
         yield temp_file
 
         temp_file.flush()
-        os.fsync(temp_file.fileno())
+        if syncs:
+            os.fsync(temp_file.fileno())
 
         shutil.move(temp_file.name, file_path)
 
+@contextmanager
+def deferring_stop_signals() -> Iterator[Callable[[], bool]]:
+    """
+    SIGINT・SIGTERMを受けても即座に終了せず、終了を要求されたことだけ記録する。
+    要求されたかどうかを返す関数を渡すので、区切りの良い所で確かめて終了する。
+    2回目のシグナルは通常通り扱われる（すぐに終了する）。
+    メインスレッドでのみ使える。
+    """
+
+    requested = False
+    previous_handlers: dict[int, Any] = {}
+
+    def handle(signum: int, frame: Any) -> None:
+        nonlocal requested
+        requested = True
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        previous_handlers[signum] = signal.signal(signum, handle)
+    try:
+        yield lambda: requested
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
 class CoolExecutor:
+    """
+    前回の実行から一定時間空けて実行する。
+    `measures_from_start`がTrueの場合、前回の実行の開始時から測る。
+    実行時間の分だけ待ち時間が減るので、実行の開始間隔がちょうど`cool_time_sec`に近付く。
+    """
+
     wait_begun: Callable[[], None] | None
     wait_ended: Callable[[], None] | None
     _cool_time_sec: float
+    _measures_from_start: bool
     _last_executed: float | None
 
-    def __init__(self, cool_time_sec: float) -> None:
+    def __init__(
+        self, cool_time_sec: float, measures_from_start: bool = False,
+    ) -> None:
+
         if cool_time_sec < 0:
             raise ValueError(cool_time_sec)
 
         self.wait_begun = None
         self.wait_ended = None
         self._cool_time_sec = cool_time_sec
+        self._measures_from_start = measures_from_start
         self._last_executed = None
 
     def __call__[T](self, call: Callable[[], T]) -> T:
         if self._last_executed is not None:
-            elasped = time.time() - self._last_executed
+            elasped = time.monotonic() - self._last_executed
             if elasped < self._cool_time_sec:
                 if self.wait_begun:
                     self.wait_begun()
-                time.sleep(self._cool_time_sec - elasped)
+                with profile.phase('cool_down'):
+                    time.sleep(self._cool_time_sec - elasped)
                 if self.wait_ended:
                     self.wait_ended()
 
+        if self._measures_from_start:
+            self._last_executed = time.monotonic()
+            return call()
+
         result = call()
-        self._last_executed = time.time()
+        self._last_executed = time.monotonic()
         return result